@@ -6,12 +6,25 @@
 import forumdb
 
 # Other modules used to run a web server.
+import argparse
 import cgi
-from wsgiref.simple_server import make_server
+import datetime
+import hashlib
+import os
+import Queue
+import signal
+import sys
+import threading
+import time
+import urllib
+from collections import OrderedDict
+from email.utils import mktime_tz, parsedate_tz
+from wsgiref.handlers import format_date_time
+from wsgiref.simple_server import make_server, WSGIServer
 from wsgiref import util
 
-# HTML template for the forum page
-HTML_WRAP = '''\
+# HTML templates for the forum page, sent before and after the posts
+HTML_HEADER = '''\
 <!DOCTYPE html>
 <html>
   <head>
@@ -21,9 +34,10 @@ HTML_WRAP = '''\
       textarea { width: 400px; height: 100px; }
       div.post { border: 1px solid #999;
                  padding: 10px 10px;
-		 margin: 10px 20%%; }
-      hr.postbound { width: 50%%; }
+		 margin: 10px 20%; }
+      hr.postbound { width: 50%; }
       em.date { color: #999 }
+      div.nav { text-align: center; }
     </style>
   </head>
   <body>
@@ -33,6 +47,9 @@ HTML_WRAP = '''\
       <div><button id="go" type="submit">Post message</button></div>
     </form>
     <!-- post content will go here -->
+'''
+HTML_FOOTER = '''\
+    <!-- links to other pages will go here -->
 %s
   </body>
 </html>
@@ -43,18 +60,162 @@ POST = '''\
     <div class=post><em class=date>%(time)s</em><br>%(content)s</div>
 '''
 
+# HTML template for the links to the newest and the older posts
+NEWEST_POSTS = '''\
+    <div class=nav><a href="/">Newest posts</a></div>
+'''
+OLDER_POSTS = '''\
+    <div class=nav><a href="/?%s">Older posts</a></div>
+'''
+
+# Formats of the times of the posts in the links to the older posts
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+## Read the page of posts requested
+def PageKey(env):
+    '''Returns the key (time, id) of the last post before the page requested,
+    or None for the first page.
+
+    Raises:
+      ValueError: if the page in the query string is not valid.
+    '''
+    fields = cgi.parse_qs(env.get('QUERY_STRING', ''))
+    if 'before' not in fields:
+        return None
+    before = fields['before'][0]
+    post = int(fields.get('id', [''])[0])
+    for format in TIME_FORMATS:
+        try:
+            datetime.datetime.strptime(before, format)
+            return (before, post)
+        except ValueError:
+            pass
+    raise ValueError("Invalid time: %s" % before)
+
+## Render the links to other pages
+def Links(before, last):
+    '''Returns the HTML of the links of the page of posts before the key
+    'before', to the newest posts and to the ones older than the key 'last'.
+    '''
+    links = ''
+    if before is not None:
+        links += NEWEST_POSTS
+    if last is not None:
+        links += OLDER_POSTS % cgi.escape(
+            urllib.urlencode([('before', last[0]), ('id', last[1])]), True)
+    return links
+
+## Render a page of posts
+def RenderPage(before):
+    '''Generates the HTML of the page of posts before the key (time, id), or
+    of the first page if it is None: the header, the posts in chunks, as they
+    are read from the database, and the footer. At the end the page is saved
+    in the cache.
+    '''
+    changes = forumdb.Changes()
+    parts = [HTML_HEADER]
+    yield HTML_HEADER
+    for posts, last in forumdb.StreamPosts(before):
+        if posts:
+            part = ''.join(POST % p for p in posts)
+            parts.append(part)
+            yield part
+    footer = HTML_FOOTER % Links(before, last)
+    parts.append(footer)
+    yield footer
+    StorePage(before, changes, ''.join(parts))
+
+## Seconds a rendered page is served from the cache. The posts added by this
+## process clear the cache right away, the ones added by other processes
+## show up when the pages expire.
+PAGE_CACHE_SECONDS = 5
+
+## Maximum number of pages in the cache of each process.
+PAGE_CACHE_SIZE = 100
+
+_pages = OrderedDict()      # page key -> (changes, expires, body, etag, time)
+_pagesLock = threading.Lock()
+
+## Get a rendered page from the cache
+def CachedPage(before):
+    '''Returns a tuple (body, etag, modified) of the page of posts before the
+    key (time, id), or None if it is not in the cache or is out of date.
+
+    The ETag is a hash of the body, so it is the same in every process, and
+    modified is the time the page was rendered, in seconds since the epoch.
+    '''
+    with _pagesLock:
+        page = _pages.get(before)
+    if (page is None or page[0] != forumdb.Changes() or
+        page[1] <= time.time()):
+        return None
+    return page[2:]
+
+## Save a rendered page in the cache
+def StorePage(before, changes, body):
+    '''Saves the page of posts before the key (time, id), rendered when
+    forumdb.Changes() was 'changes', in the cache.'''
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+    now = time.time()
+    modified = int(now)
+    with _pagesLock:
+        old = _pages.pop(before, None)
+        # keep the time of the page if it didn't change, for If-Modified-Since
+        if old is not None and old[3] == etag:
+            modified = old[4]
+        _pages[before] = (changes, now + PAGE_CACHE_SECONDS,
+                          body, etag, modified)
+        while len(_pages) > PAGE_CACHE_SIZE:
+            _pages.popitem(last=False)
+
+## Check the conditional headers of a request
+def NotModified(env, etag, modified):
+    '''Returns True if the client already has the page with the given ETag
+    and time, according to If-None-Match or, without it, If-Modified-Since.
+    '''
+    match = env.get('HTTP_IF_NONE_MATCH')
+    if match is not None:
+        tags = [tag.strip() for tag in match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    since = env.get('HTTP_IF_MODIFIED_SINCE')
+    if since is not None:
+        date = parsedate_tz(since.split(';')[0])
+        if date is not None:
+            return modified <= mktime_tz(date)
+    return False
+
 ## Request handler for main page
 def View(env, resp):
     '''View is the 'main page' of the forum.
 
-    It displays the submission form and the previously posted messages.
+    It displays the submission form and a page of the previously posted
+    messages, with links to the older ones. The pages are cached, and
+    requests with the ETag or the time of the cached page get a 304. The
+    pages that are not cached are streamed while they are rendered, without
+    validators, since the ETag is known only at the end.
     '''
-    # get posts from database
-    posts = forumdb.GetAllPosts()
+    try:
+        before = PageKey(env)
+    except ValueError:
+        resp('400 Bad Request', [('Content-type', 'text/plain')])
+        return ['Bad Request: invalid page']
+    page = CachedPage(before)
+    if page is None:
+        # send results as they are read from database
+        resp('200 OK', [('Cache-Control', 'no-cache'),
+                        ('Content-type', 'text/html')])
+        return RenderPage(before)
+    body, etag, modified = page
+    headers = [('ETag', etag),
+               ('Last-Modified', format_date_time(modified)),
+               ('Cache-Control', 'no-cache')]
+    if NotModified(env, etag, modified):
+        resp('304 Not Modified', headers)
+        return []
     # send results
-    headers = [('Content-type', 'text/html')]
+    headers.append(('Content-type', 'text/html'))
     resp('200 OK', headers)
-    return [HTML_WRAP % ''.join(POST % p for p in posts)]
+    return [body]
 
 ## Request handler for posting - inserts to database
 def Post(env, resp):
@@ -100,8 +261,94 @@ def Dispatcher(env, resp):
         return ['Not Found: ' + page]
 
 
-# Run this bad server only on localhost!
-httpd = make_server('', 8000, Dispatcher)
-print "Serving HTTP on port 8000..."
-httpd.serve_forever()
+## Server that handles the requests with a pool of threads
+class ThreadPoolServer(WSGIServer):
+    '''WSGI server that handles the requests with a fixed number of threads.
+
+    The threads start in serve_forever(), so a server created before forking
+    the workers gets its own threads in each of them.
+    '''
+    threads = 1
+    # Connections waiting to be accepted, for bursts of many readers
+    request_queue_size = 128
+
+    def serve_forever(self, *args):
+        self.requests = Queue.Queue(self.threads)
+        for i in range(self.threads):
+            thread = threading.Thread(target=self.Work)
+            thread.daemon = True
+            thread.start()
+        WSGIServer.serve_forever(self, *args)
+
+    def process_request(self, request, client_address):
+        '''Queues the request for the next free thread.'''
+        self.requests.put((request, client_address))
+
+    def Work(self):
+        '''Handles the queued requests, one at a time.'''
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+## Run the server, in one or more processes
+def Serve(port, processes=1, threads=1):
+    '''Serves the forum on a port until interrupted.
+
+    Args:
+      port: the TCP port to listen on.
+      processes: number of worker processes, forked after opening the port
+        so all of them accept its connections. With 1, there's no fork.
+      threads: number of threads that handle requests in each process, each
+        with its own DB connection.
+    '''
+    forumdb.POOL_SIZE = threads
+    if processes == 1 and threads == 1:
+        httpd = make_server('', port, Dispatcher)
+    else:
+        httpd = make_server('', port, Dispatcher,
+                            server_class=ThreadPoolServer)
+        httpd.threads = threads
+    print "Serving HTTP on port %d (%d processes x %d threads)..." % (
+        port, processes, threads)
+    if processes == 1:
+        httpd.serve_forever()
+        return
+
+    workers = []
+    for i in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                httpd.serve_forever()
+            finally:
+                os._exit(0)
+        workers.append(pid)
+    # Stopping the parent stops the workers too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for pid in workers:
+            os.waitpid(pid, 0)
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="DB Forum server.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--processes', type=int, default=1,
+                        help="number of worker processes (prefork)")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="number of threads of each worker process")
+    args = parser.parse_args()
+    # Run this bad server only on localhost!
+    Serve(args.port, args.processes, args.threads)
 
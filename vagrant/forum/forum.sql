@@ -1,5 +1,9 @@
-
 CREATE TABLE posts ( content TEXT,
                      time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                     id SERIAL );
+                     id SERIAL,
+                     -- The content sanitized once, when it's posted, so the
+                     -- pages show it as is (see forumdb.AddPost)
+                     safe_content TEXT NOT NULL );
 
+-- The forum shows the posts by pages, newest first (see forumdb.GetPosts)
+CREATE INDEX posts_time_id ON posts (time, id);
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Test cases for forum.py and forumdb.py
+#
+# They run against the forum_test DB, not the forum one, and drop and create
+# its posts table with forum.sql first. Create it once with
+# `createdb forum_test`, then run `python forum_test.py`.
+
+import os
+import re
+from StringIO import StringIO
+from wsgiref.handlers import format_date_time
+from wsgiref import util
+
+import forum
+import forumdb
+
+# DB of the tests, emptied by resetPosts()
+TEST_DSN = "dbname=forum_test"
+
+forumdb.DSN = TEST_DSN
+
+
+def resetPosts():
+    schema = open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'forum.sql')).read()
+    with forumdb.Connection() as db:
+        cur = db.cursor()
+        cur.execute("DROP TABLE IF EXISTS posts;")
+        cur.execute(schema)
+        cur.close()
+    forum._pages.clear()
+
+def addPosts(times):
+    """Adds a post for each time, with its index as content, in order."""
+    with forumdb.Connection() as db:
+        cur = db.cursor()
+        for (i, time) in enumerate(times):
+            cur.execute("INSERT INTO posts (content, safe_content, time) "
+                        "VALUES (%s, %s, %s);", [str(i), str(i), time])
+        cur.close()
+
+def request(query = '', headers = None):
+    """Sends a GET of the main page of the forum, with the given query string
+    and headers (as WSGI environ keys), and returns a tuple (status, headers,
+    body)."""
+    env = {'PATH_INFO': '/', 'QUERY_STRING': query, 'REQUEST_METHOD': 'GET',
+           'wsgi.input': StringIO('')}
+    env.update(headers or {})
+    util.setup_testing_defaults(env)
+    response = []
+    def startResponse(status, headers):
+        response.extend([status, dict(headers)])
+    body = ''.join(forum.Dispatcher(env, startResponse))
+    return response[0], response[1], body
+
+def contents(posts):
+    return [int(post['content']) for post in posts]
+
+
+def testPaging():
+    resetPosts()
+    # 45 posts, 10 of them at the same time, on both sides of the end of the
+    # first page, so only their id tells them apart
+    addPosts(["2016-01-01 00:%02d:00" % (20 if 20 <= i < 30 else i)
+              for i in range(45)])
+    pages = []
+    last = None
+    while True:
+        posts, last = forumdb.GetPosts(last)
+        pages.append(contents(posts))
+        if last is None:
+            break
+    if [len(page) for page in pages] != [20, 20, 5]:
+        raise ValueError("The posts should be paged by PAGE_SIZE.")
+    if sum(pages, []) != range(44, -1, -1):
+        raise ValueError("Every post should be in a page once, newest first.")
+
+    # The pages of the forum show the same posts, with a link to the older
+    # ones until the last page
+    shown = []
+    query = ''
+    while query is not None:
+        status, headers, body = request(query)
+        if status != '200 OK':
+            raise ValueError("Pages should be found, not %s." % status)
+        shown.append([int(p) for p in re.findall(r'<br>(\d+)</div>', body)])
+        link = re.search(r'<a href="/\?([^"]*)">Older posts', body)
+        query = link and link.group(1).replace('&amp;', '&')
+    if shown != pages:
+        raise ValueError("The links to the older posts should show the next "
+                         "pages.")
+    print "1. Posts are paged by their (time, id)."
+
+
+def testBadPage():
+    for query in ["before=yesterday&id=1", "before=2016-01-01+00%3A00%3A00",
+                  "before=2016-01-01+00%3A00%3A00&id=x"]:
+        status, headers, body = request(query)
+        if status != '400 Bad Request':
+            raise ValueError("An invalid page should get a 400, not %s." %
+                             status)
+    print "2. Invalid pages get a 400 Bad Request."
+
+
+def testCacheInvalidation():
+    resetPosts()
+    addPosts(["2016-01-01 00:00:00"])
+    status, headers, body = request()
+    if 'ETag' in headers:
+        raise ValueError("Pages that are not cached have no ETag.")
+    status, headers, cached = request()
+    if 'ETag' not in headers or cached != body:
+        raise ValueError("A page should be served from the cache.")
+
+    changes = forumdb.Changes()
+    forumdb.AddPost("<script>New</script> post")
+    if forumdb.Changes() != changes + 1:
+        raise ValueError("Changes() should count the posts added.")
+    status, headers, body = request()
+    if 'ETag' in headers or 'New&lt;/script&gt; post' not in body or \
+            '<script>' in body:
+        raise ValueError("A new post should drop the cached pages.")
+    print "3. Cached pages are dropped when Changes() changes."
+
+
+def testNotModified():
+    resetPosts()
+    addPosts(["2016-01-01 00:00:00"])
+    request()
+    status, headers, body = request()
+    etag, modified = headers['ETag'], headers['Last-Modified']
+    cases = [
+        ({'HTTP_IF_NONE_MATCH': etag}, '304 Not Modified'),
+        ({'HTTP_IF_NONE_MATCH': '"other", ' + etag}, '304 Not Modified'),
+        ({'HTTP_IF_NONE_MATCH': '"other"'}, '200 OK'),
+        ({'HTTP_IF_MODIFIED_SINCE': modified}, '304 Not Modified'),
+        ({'HTTP_IF_MODIFIED_SINCE': format_date_time(0)}, '200 OK'),
+        # If-None-Match wins over If-Modified-Since
+        ({'HTTP_IF_NONE_MATCH': '"other"',
+          'HTTP_IF_MODIFIED_SINCE': modified}, '200 OK'),
+    ]
+    for (conditions, expected) in cases:
+        status, headers, body = request('', conditions)
+        if status != expected:
+            raise ValueError("With %s, the page should get %s, not %s." %
+                             (conditions, expected, status))
+        if status.startswith('304') and (body or headers['ETag'] != etag):
+            raise ValueError("A 304 should have the ETag and no body.")
+    print "4. Requests with the ETag or time of a cached page get a 304."
+
+
+if __name__ == '__main__':
+    testPaging()
+    testBadPage()
+    testCacheInvalidation()
+    testNotModified()
+    print "Success!  All tests pass!"
@@ -3,39 +3,153 @@
 #
 
 import bleach
-import time
-import psycopg2
+import os
+import threading
+from contextlib import contextmanager
+from psycopg2 import pool
 
-## Database connection
-DB = psycopg2.connect("dbname=forum")
+## Database connections
+DSN = "dbname=forum"
 
-## Get posts from database.
-def GetAllPosts():
-    '''Get all the posts from the database, sorted with the newest first.
+## Maximum number of connections of each process, one for each thread that
+## serves requests at the same time (see forum.py).
+POOL_SIZE = 1
+
+_pool = None
+_poolPid = None
+_poolLock = threading.Lock()
+
+## Number of posts added by this process, so the pages cached by forum.py
+## can tell when they are out of date.
+_changes = 0
+_changesLock = threading.Lock()
+
+## Get a connection from the pool of this process.
+@contextmanager
+def Connection():
+    '''Context manager that lends a connection of the pool, and gives it back
+    at the end of the block, committing what was done or rolling it back if
+    there was an exception.
+
+    Every process has its own pool, opened on first use, so the workers forked
+    by forum.py never share a connection.
+    '''
+    global _pool, _poolPid
+    with _poolLock:
+        if _pool is None or _poolPid != os.getpid():
+            _pool = pool.ThreadedConnectionPool(1, POOL_SIZE, DSN)
+            _poolPid = os.getpid()
+        connPool = _pool
+    db = connPool.getconn()
+    try:
+        yield db
+        db.commit()
+    except:
+        db.rollback()
+        raise
+    finally:
+        connPool.putconn(db)
+
+## Number of posts shown on each page of the forum.
+PAGE_SIZE = 20
+
+## Number of posts fetched at a time from the server-side cursor of
+## StreamPosts().
+CHUNK_SIZE = 10
+
+## Stream a page of posts from database.
+def StreamPosts(before=None, limit=PAGE_SIZE, chunk=CHUNK_SIZE):
+    '''Get a page of posts from the database, sorted with the newest first,
+    a few at a time.
+
+    The page starts right after the post with the key 'before', so any page
+    costs the same however many posts there are (keyset pagination on the
+    index of (time, id)). The posts are read from a server-side cursor, so
+    only a chunk of them is in memory at once, and the connection is kept
+    until the generator is exhausted or closed.
+
+    Args:
+      before: the key (time, id) of the last post of the previous page, as
+        returned by this function, or None for the first page.
+      limit: the maximum number of posts of the page.
+      chunk: the maximum number of posts of each tuple.
+
+    Yields:
+      Tuples (posts, last), where posts is a list of dictionaries, each with
+      a 'content' key pointing to the post content, already sanitized, and
+      a 'time' key pointing to the time it was posted. last is None except
+      in the last tuple, where it is the key of the last post of the page if
+      there are older posts.
+    '''
+    with Connection() as db:
+        cur = db.cursor('posts')
+        cur.itersize = chunk
+        # One more post than needed tells if there are older posts
+        if before is None:
+            cur.execute("SELECT safe_content, time, id FROM posts "
+                        "ORDER BY time DESC, id DESC LIMIT %s;", [limit + 1])
+        else:
+            cur.execute("SELECT safe_content, time, id FROM posts "
+                        "WHERE (time, id) < (%s, %s) "
+                        "ORDER BY time DESC, id DESC LIMIT %s;",
+                        [before[0], before[1], limit + 1])
+        count = 0
+        row = None
+        while count < limit:
+            rows = cur.fetchmany(min(chunk, limit - count))
+            if not rows:
+                break
+            count += len(rows)
+            row = rows[-1]
+            yield [{
+                    'content': r[0],
+                    'time': str(r[1])
+                    } for r in rows], None
+        more = row is not None and cur.fetchone() is not None
+        cur.close()
+    yield [], (str(row[1]), row[2]) if more else None
+
+## Get a page of posts from database.
+def GetPosts(before=None, limit=PAGE_SIZE):
+    '''Get a page of posts from the database, sorted with the newest first,
+    like StreamPosts() but all at once.
 
     Returns:
-      A list of dictionaries, where each dictionary has a 'content' key
-      pointing to the post content, and 'time' key pointing to the time
-      it was posted.
+      A tuple (posts, last), where posts is a list of dictionaries with the
+      'content' and 'time' of each post, as yielded by StreamPosts(), and
+      last is the key of the last post of the page, or None if there are no
+      older posts.
     '''
-    cur = DB.cursor()
-    cur.execute("SELECT content, time FROM posts ORDER BY time DESC;")
-    rows = cur.fetchall()
-    cur.close()
-    return [{
-            'content': str(bleach.clean(row[0])),
-            'time': str(row[1])
-            } for row in rows]
+    posts = []
+    for chunk, last in StreamPosts(before, limit):
+        posts.extend(chunk)
+    return posts, last
 
 ## Add a post to the database.
 def AddPost(content):
     '''Add a new post to the database.
 
+    The content is sanitized here, once, and stored with the original text,
+    so the pages of the forum don't have to clean it again.
+
     Args:
       content: The text content of the new post.
     '''
-    query = "INSERT INTO posts (content) VALUES (%s);"
-    cur = DB.cursor()
-    cur.execute(query, [bleach.clean(content)])
-    DB.commit()
-    cur.close()
+    query = "INSERT INTO posts (content, safe_content) VALUES (%s, %s);"
+    with Connection() as db:
+        cur = db.cursor()
+        cur.execute(query, [content, bleach.clean(content)])
+        cur.close()
+    global _changes
+    with _changesLock:
+        _changes += 1
+
+## Count the changes of the posts.
+def Changes():
+    '''Returns the number of posts added by this process. The pages cached
+    by forum.py are out of date when it changes.
+
+    The posts added by other processes are not counted: the pages cached
+    before them have to expire on their own.
+    '''
+    return _changes
@@ -0,0 +1,7 @@
+-- Migration of an existing forum DB to the schema with the index of the
+-- pages of posts (see forum.sql).
+--
+-- Run it from psql, connected to the forum DB:
+-- \i migrations/01_posts_index.sql
+
+CREATE INDEX posts_time_id ON posts (time, id);
@@ -0,0 +1,51 @@
+#
+# Backfill of the sanitized content of the existing posts, after
+# migrations/02_safe_content.sql. Run it from the forum directory:
+# python migrations/02_safe_content.py
+#
+
+import bleach
+import os
+import sys
+from psycopg2.extras import execute_values
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import forumdb
+
+## Number of posts sanitized in each transaction.
+BATCH_SIZE = 1000
+
+## Fill the sanitized content of the posts that don't have it.
+def Backfill():
+    '''Sanitizes the content of the posts without safe_content, in batches,
+    and then makes the column NOT NULL like in forum.sql.
+
+    Returns:
+      The number of posts sanitized.
+    '''
+    count = 0
+    while True:
+        with forumdb.Connection() as db:
+            cur = db.cursor()
+            cur.execute("SELECT id, content FROM posts "
+                        "WHERE safe_content IS NULL LIMIT %s;", [BATCH_SIZE])
+            rows = cur.fetchall()
+            # A single statement for the whole batch
+            execute_values(cur, "UPDATE posts SET safe_content = v.safe "
+                           "FROM (VALUES %s) AS v (id, safe) "
+                           "WHERE posts.id = v.id;",
+                           [(id, bleach.clean(content or ''))
+                            for (id, content) in rows],
+                           page_size=BATCH_SIZE)
+            cur.close()
+        count += len(rows)
+        if len(rows) < BATCH_SIZE:
+            break
+    with forumdb.Connection() as db:
+        cur = db.cursor()
+        cur.execute("ALTER TABLE posts ALTER COLUMN safe_content SET NOT NULL;")
+        cur.close()
+    return count
+
+if __name__ == '__main__':
+    print "Sanitized %d posts" % Backfill()
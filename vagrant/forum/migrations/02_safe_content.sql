@@ -0,0 +1,10 @@
+-- Migration of an existing forum DB to the schema with the sanitized content
+-- of the posts (see forum.sql).
+--
+-- Run it from psql, connected to the forum DB:
+-- \i migrations/02_safe_content.sql
+--
+-- and then fill the column of the existing posts, which needs bleach:
+-- python migrations/02_safe_content.py
+
+ALTER TABLE posts ADD COLUMN safe_content TEXT;
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+#
+# backend.py -- selection of the tournament backend by configuration
+#
+# Both backends have the same functions, so the code using them can do:
+#
+#     from backend import getBackend
+#     tournament = getBackend()
+#     tournament.registerPlayer("Bruno Walton")
+#
+
+import importlib
+import os
+
+
+# Modules implementing the tournament functions, by name.
+BACKENDS = {
+    'postgres': 'tournament',
+    'memory': 'tournament_memory',
+}
+
+# Backend used when none is given, unless the TOURNAMENT_BACKEND environment
+# variable sets another one.
+DEFAULT_BACKEND = 'postgres'
+
+
+def getBackend(name = None):
+    """Returns the module of a tournament backend.
+
+    Args:
+        name: one of the BACKENDS, or None to use the TOURNAMENT_BACKEND
+        environment variable, or DEFAULT_BACKEND if it's not set.
+
+    Raises:
+        ValueError: if there's no backend with that name.
+    """
+    if name is None:
+        name = os.environ.get('TOURNAMENT_BACKEND', DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError("Unknown tournament backend '%s', use one of: %s" %
+                         (name, ", ".join(sorted(BACKENDS))))
+    return importlib.import_module(BACKENDS[name])
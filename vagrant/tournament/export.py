@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+#
+# export.py -- export of the standings of tournaments to files
+#
+# Used by the exportStandings() function of both backends, so the files have
+# the same format whatever the backend.
+#
+
+import csv
+import json
+from collections import OrderedDict
+
+
+# Formats of the exported files, by name.
+FORMATS = ('csv', 'jsonl')
+
+# Columns of the exported standings, in the order of the allStandings() rows.
+COLUMNS = ('tournament', 'player', 'name', 'wins', 'matches', 'omw')
+
+
+def writeStandings(rows, outfile, format = 'csv'):
+    """Writes standings rows to a file, as they are read.
+
+    Args:
+        rows: iterable of (tournament, id, name, wins, matches, omw) tuples,
+        like the ones generated by allStandings().
+        outfile: file open for writing.
+        format: 'csv' for a CSV file with a header, or 'jsonl' for a JSON
+        object per line.
+
+    Returns:
+        The number of rows written.
+
+    Raises:
+        ValueError: if the format isn't one of the FORMATS.
+    """
+    if format not in FORMATS:
+        raise ValueError("Unknown export format '%s', use one of: %s" %
+                         (format, ", ".join(FORMATS)))
+
+    count = 0
+    if format == 'csv':
+        writer = csv.writer(outfile)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            outfile.write(json.dumps(OrderedDict(zip(COLUMNS, row))) + "\n")
+            count += 1
+    return count
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# metrics.py -- metrics of the statements sent to the DB, used by tournament.py
+#
+# Every statement is aggregated by its text (with the %s placeholders, before
+# the values are bound), so the registry stays small however many calls are
+# made, and can be exported at any time as JSON lines.
+#
+
+import json
+import threading
+from collections import OrderedDict
+
+
+# Columns of the exported metrics.
+COLUMNS = ('kind', 'statement', 'calls', 'seconds', 'maxSeconds', 'rows')
+
+
+class Metrics(object):
+    """Thread-safe registry of the statements sent to the DB, and of the
+    connections opened to it.
+
+    For each statement it keeps the number of calls, the total and maximum
+    time, and the rows returned or changed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0      # statements added, see queries()
+        self.reset()
+
+    def reset(self):
+        """Forgets all the metrics, but not the count of queries()."""
+        with self.lock:
+            self.statements = {}        # statement -> [calls, secs, max, rows]
+            self.connections = [0, 0.0, 0.0]   # [opened, seconds, max]
+
+    def addQuery(self, statement, seconds, rows = None):
+        """Adds a call of a statement, that took the given seconds and
+        returned or changed the given rows (None if unknown)."""
+        statement = " ".join(statement.split())
+        with self.lock:
+            self.count += 1
+            metric = self.statements.get(statement)
+            if metric is None:
+                metric = self.statements[statement] = [0, 0.0, 0.0, 0]
+            metric[0] += 1
+            metric[1] += seconds
+            metric[2] = max(metric[2], seconds)
+            if rows is not None and rows >= 0:
+                metric[3] += rows
+
+    def addConnection(self, seconds):
+        """Adds a connection opened to the DB, that took the given seconds."""
+        with self.lock:
+            self.connections[0] += 1
+            self.connections[1] += seconds
+            self.connections[2] = max(self.connections[2], seconds)
+
+    def queries(self):
+        """Returns the number of statements added since the registry was
+        created (reset() doesn't change it)."""
+        return self.count
+
+    def records(self):
+        """Returns the metrics as a list of dicts with the COLUMNS: one per
+        statement (kind 'query'), slowest first, and one for the connections
+        (kind 'connect')."""
+        with self.lock:
+            statements = sorted(self.statements.items(),
+                                key=lambda item: -item[1][1])
+            connections = list(self.connections)
+        records = [OrderedDict(zip(COLUMNS, ('query', statement) +
+                                   tuple(metric)))
+                   for (statement, metric) in statements]
+        records.append(OrderedDict(zip(COLUMNS, ['connect', None] +
+                                       connections + [None])))
+        return records
+
+    def write(self, outfile):
+        """Writes the records() to a file as JSON lines. Returns the number of
+        records written."""
+        records = self.records()
+        for record in records:
+            outfile.write(json.dumps(record) + "\n")
+        return len(records)
@@ -0,0 +1,159 @@
+-- Migration of a tournament DB created with the first tournament.sql to the
+-- schema with the standings kept in the scores table (see tournament.sql).
+-- It's the first migration, run it before the others.
+--
+-- Run it from psql, connected to the tournament DB:
+-- \i migrations/00_scores.sql
+
+BEGIN;
+
+-- Materialized standings: wins, games and omw of each player/tournament. The
+-- triggers below keep it up to date on every change of the registry and the
+-- matches, so reading the standings doesn't need to aggregate the matches.
+-- The playerWins, playerGames and playerOMWs views compute the same numbers
+-- from scratch, and are only used by rebuild_scores() to recover the table if
+-- it ever gets out of sync.
+CREATE TABLE scores (
+    tournament  integer NOT NULL,
+    player      integer NOT NULL,
+    wins        integer NOT NULL DEFAULT 0,
+    games       integer NOT NULL DEFAULT 0,
+    omw         integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (tournament, player),
+    FOREIGN KEY (tournament, player) REFERENCES registry(tournament, player)
+        ON DELETE CASCADE
+);
+
+-- Lets the standings of a tournament be read in order from the index
+CREATE INDEX scores_standings ON scores
+    (tournament, wins DESC, omw DESC, games ASC, player ASC);
+
+-- Adds the players to the scores when they enter a tournament, and updates
+-- their wins (and the omw of their opponents) when they get a bye.
+CREATE OR REPLACE FUNCTION update_scores_on_registry() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO scores (tournament, player, wins)
+            VALUES (NEW.tournament, NEW.player, NEW.bye);
+    ELSIF NEW.bye != OLD.bye THEN
+        UPDATE scores SET wins = wins + NEW.bye - OLD.bye
+            WHERE tournament = NEW.tournament AND player = NEW.player;
+        UPDATE scores SET omw = omw + NEW.bye - OLD.bye
+            WHERE tournament = NEW.tournament AND player IN (
+                SELECT CASE WHEN player1 = NEW.player
+                    THEN player2 ELSE player1 END
+                FROM matches WHERE tournament = NEW.tournament
+                AND NEW.player IN (player1, player2));
+    END IF;
+    RETURN NULL;
+END;
+$$ language plpgsql;
+
+CREATE TRIGGER update_scores_on_registry AFTER INSERT OR UPDATE ON registry
+    FOR EACH ROW EXECUTE PROCEDURE update_scores_on_registry();
+
+-- Updates the scores of the players of a match when it's added or removed.
+-- Matches are never updated, just inserted or deleted.
+-- It runs before the change, so each row of a multi-row statement sees the
+-- matches as if it was inserted or deleted alone: the ones before it in the
+-- statement are already changed, and the ones after it are not.
+CREATE OR REPLACE FUNCTION update_scores_on_match() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        -- Each player adds the wins of the other to his omw, counted before
+        -- the result of the match...
+        UPDATE scores AS s SET
+            games = s.games + 1,
+            omw = s.omw + o.wins
+        FROM scores AS o
+        WHERE s.tournament = NEW.tournament AND o.tournament = NEW.tournament
+            AND ((s.player = NEW.player1 AND o.player = NEW.player2)
+                OR (s.player = NEW.player2 AND o.player = NEW.player1));
+
+        -- ... and then the new win counts for the omw of all the opponents of
+        -- the winner (this match isn't inserted yet, so its loser is added
+        -- explicitly).
+        IF NEW.winner IS NOT NULL THEN
+            UPDATE scores SET wins = wins + 1
+                WHERE tournament = NEW.tournament AND player = NEW.winner;
+            UPDATE scores SET omw = omw + 1
+                WHERE tournament = NEW.tournament AND (player IN (
+                    SELECT CASE WHEN player1 = NEW.winner
+                        THEN player2 ELSE player1 END
+                    FROM matches WHERE tournament = NEW.tournament
+                    AND NEW.winner IN (player1, player2))
+                OR player IN (NEW.player1, NEW.player2)
+                    AND player != NEW.winner);
+        END IF;
+        RETURN NEW;
+    END IF;
+
+    -- A deleted match is subtracted in the reverse order: first the win, from
+    -- the winner and the omw of all his opponents (this one included)...
+    IF OLD.winner IS NOT NULL THEN
+        UPDATE scores SET wins = wins - 1
+            WHERE tournament = OLD.tournament AND player = OLD.winner;
+        UPDATE scores SET omw = omw - 1
+            WHERE tournament = OLD.tournament AND player IN (
+                SELECT CASE WHEN player1 = OLD.winner
+                    THEN player2 ELSE player1 END
+                FROM matches WHERE tournament = OLD.tournament
+                AND OLD.winner IN (player1, player2));
+    END IF;
+
+    -- ... and then the wins of each player from the omw of the other
+    UPDATE scores AS s SET
+        games = s.games - 1,
+        omw = s.omw - o.wins
+    FROM scores AS o
+    WHERE s.tournament = OLD.tournament AND o.tournament = OLD.tournament
+        AND ((s.player = OLD.player1 AND o.player = OLD.player2)
+            OR (s.player = OLD.player2 AND o.player = OLD.player1));
+    RETURN OLD;
+END;
+$$ language plpgsql;
+
+CREATE TRIGGER update_scores_on_match BEFORE INSERT OR DELETE ON matches
+    FOR EACH ROW EXECUTE PROCEDURE update_scores_on_match();
+
+-- Recomputes the scores of a tournament (or of all of them, if NULL) from
+-- the registry and the matches
+CREATE OR REPLACE FUNCTION rebuild_scores(t integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM scores WHERE t IS NULL OR tournament = t;
+    INSERT INTO scores (tournament, player, wins, games, omw)
+        SELECT pw.tournament, pw.player, pw.wins, pg.games, po.omws
+        FROM playerWins AS pw
+        INNER JOIN playerGames AS pg
+            ON pg.tournament = pw.tournament AND pg.player = pw.player
+        INNER JOIN playerOMWs AS po
+            ON po.tournament = pw.tournament AND po.player = pw.player
+        WHERE t IS NULL OR pw.tournament = t;
+END;
+$$ language plpgsql;
+
+-- This view just puts together the scores and the names of the players, in
+-- the order of the standings.
+DROP VIEW standings;
+CREATE VIEW standings AS
+SELECT
+    s.player as player,
+    p.name as name,
+    s.tournament AS tournament,
+    s.wins as wins,
+    s.games as games,
+    s.omw as omw
+FROM scores AS s
+INNER JOIN players AS p ON s.player = p.id
+ORDER BY
+    tournament ASC, -- this order is just for easier human-reading
+    wins DESC,
+    omw DESC,
+    games ASC, -- ASC improves the pairing heurestic (vs DESC) to avoid giving
+               -- a player 2 byes
+    player ASC; -- ties are always listed in the same order
+
+-- Fill the scores of the existing tournaments
+SELECT rebuild_scores(NULL);
+
+COMMIT;
@@ -0,0 +1,71 @@
+-- Migration of an existing tournament DB to the schema with indexes on the
+-- matches, and the playerScores view (see tournament.sql).
+--
+-- Run it from psql, connected to the tournament DB: \i migrations/01_indexes.sql
+
+BEGIN;
+
+-- The unique index on the normalized pair replaces the check_match trigger
+CREATE UNIQUE INDEX matches_pair ON matches
+    (tournament, LEAST(player1, player2), GREATEST(player1, player2));
+DROP TRIGGER check_match ON matches;
+DROP FUNCTION check_match();
+
+CREATE INDEX matches_player2 ON matches (tournament, player2);
+CREATE INDEX matches_winner ON matches (tournament, winner);
+
+-- The standings are sorted after joining the players' names, so the primary
+-- key is the index used to read the scores of a tournament
+DROP INDEX scores_standings;
+
+-- The three nested views are replaced by playerScores
+CREATE VIEW playerScores AS
+WITH results AS (
+    SELECT tournament, player1 AS player, player2 AS opponent, winner
+    FROM matches
+    UNION ALL
+    SELECT tournament, player2 AS player, player1 AS opponent, winner
+    FROM matches
+),
+totals AS (
+    SELECT
+        r.tournament AS tournament,
+        r.player AS player,
+        r.bye + COUNT(CASE WHEN x.winner = r.player THEN 1 END) AS wins,
+        COUNT(x.opponent) AS games
+    FROM registry AS r
+    LEFT JOIN results AS x
+        ON x.tournament = r.tournament AND x.player = r.player
+    GROUP BY r.tournament, r.player, r.bye
+)
+SELECT
+    t.tournament AS tournament,
+    t.player AS player,
+    t.wins AS wins,
+    t.games AS games,
+    COALESCE(SUM(o.wins), 0) AS omw,
+    rank() OVER (PARTITION BY t.tournament
+        ORDER BY t.wins DESC, COALESCE(SUM(o.wins), 0) DESC, t.games ASC)
+        AS place
+FROM totals AS t
+LEFT JOIN results AS x
+    ON x.tournament = t.tournament AND x.player = t.player
+LEFT JOIN totals AS o
+    ON o.tournament = x.tournament AND o.player = x.opponent
+GROUP BY t.tournament, t.player, t.wins, t.games;
+
+CREATE OR REPLACE FUNCTION rebuild_scores(t integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM scores WHERE t IS NULL OR tournament = t;
+    INSERT INTO scores (tournament, player, wins, games, omw)
+        SELECT tournament, player, wins, games, omw
+        FROM playerScores
+        WHERE t IS NULL OR tournament = t;
+END;
+$$ language plpgsql;
+
+DROP VIEW playerOMWs;
+DROP VIEW playerGames;
+DROP VIEW playerWins;
+
+COMMIT;
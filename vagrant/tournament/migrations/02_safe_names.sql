@@ -0,0 +1,34 @@
+-- Migration of an existing tournament DB to the schema with the names of the
+-- players sanitized once, when they are registered (see tournament.sql).
+--
+-- Run it from psql, connected to the tournament DB:
+-- \i migrations/02_safe_names.sql
+--
+-- The names are sanitized in Python, so then fill the new column with
+-- tournament.sanitizePlayers(), and make it required:
+-- ALTER TABLE players ALTER COLUMN safe_name SET NOT NULL;
+
+BEGIN;
+
+ALTER TABLE players ADD COLUMN safe_name text;
+
+DROP VIEW standings;
+CREATE VIEW standings AS
+SELECT
+    s.player as player,
+    p.safe_name as name,
+    s.tournament AS tournament,
+    s.wins as wins,
+    s.games as games,
+    s.omw as omw
+FROM scores AS s
+INNER JOIN players AS p ON s.player = p.id
+ORDER BY
+    tournament ASC, -- this order is just for easier human-reading
+    wins DESC,
+    omw DESC,
+    games ASC, -- ASC improves the pairing heurestic (vs DESC) to avoid giving
+               -- a player 2 byes
+    player ASC; -- ties are always listed in the same order
+
+COMMIT;
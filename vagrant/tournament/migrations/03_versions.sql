@@ -0,0 +1,29 @@
+-- Migration of an existing tournament DB to the schema with a version for
+-- every tournament (see tournament.sql).
+--
+-- Run it from psql, connected to the tournament DB:
+-- \i migrations/03_versions.sql
+
+BEGIN;
+
+ALTER TABLE tournaments ADD COLUMN version integer NOT NULL DEFAULT 0;
+
+-- Increases the version of the tournament of a changed entry or match.
+CREATE OR REPLACE FUNCTION bump_tournament_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE tournaments SET version = version + 1 WHERE id = OLD.tournament;
+    ELSE
+        UPDATE tournaments SET version = version + 1 WHERE id = NEW.tournament;
+    END IF;
+    RETURN NULL;
+END;
+$$ language plpgsql;
+
+CREATE TRIGGER bump_version_on_registry
+    AFTER INSERT OR UPDATE OR DELETE ON registry
+    FOR EACH ROW EXECUTE PROCEDURE bump_tournament_version();
+CREATE TRIGGER bump_version_on_match AFTER INSERT OR DELETE ON matches
+    FOR EACH ROW EXECUTE PROCEDURE bump_tournament_version();
+
+COMMIT;
@@ -0,0 +1,40 @@
+-- Migration of an existing tournament DB to the schema that notifies the
+-- changes of the tournaments, for the standings cache (see tournament.sql).
+--
+-- Run it from psql, connected to the tournament DB:
+-- \i migrations/04_notify.sql
+
+BEGIN;
+
+-- Notifies the new version of a changed tournament to the processes that
+-- LISTEN to tournament_version (payload 'id:version'), so they can drop the
+-- standings they cached. A deleted tournament is notified as one version
+-- newer than its last one.
+CREATE OR REPLACE FUNCTION notify_tournament_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('tournament_version', OLD.id || ':' || (OLD.version + 1));
+    ELSE
+        PERFORM pg_notify('tournament_version', NEW.id || ':' || NEW.version);
+    END IF;
+    RETURN NULL;
+END;
+$$ language plpgsql;
+
+CREATE TRIGGER notify_tournament_version
+    AFTER UPDATE OF version OR DELETE ON tournaments
+    FOR EACH ROW EXECUTE PROCEDURE notify_tournament_version();
+
+CREATE OR REPLACE FUNCTION rebuild_scores(t integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM scores WHERE t IS NULL OR tournament = t;
+    INSERT INTO scores (tournament, player, wins, games, omw)
+        SELECT tournament, player, wins, games, omw
+        FROM playerScores
+        WHERE t IS NULL OR tournament = t;
+    -- The scores may have changed, so the standings cached are no longer valid
+    UPDATE tournaments SET version = version + 1 WHERE t IS NULL OR id = t;
+END;
+$$ language plpgsql;
+
+COMMIT;
@@ -0,0 +1,227 @@
+-- Migration of an existing tournament DB to the schema with configurable
+-- points for each result, that rank the standings (see tournament.sql).
+--
+-- Run it from psql, connected to the tournament DB:
+-- \i migrations/05_points.sql
+--
+-- The existing tournaments get the default points, so their standings don't
+-- change.
+
+BEGIN;
+
+ALTER TABLE tournaments
+    ADD COLUMN win_points integer NOT NULL DEFAULT 1,
+    ADD COLUMN draw_points integer NOT NULL DEFAULT 0,
+    ADD COLUMN loss_points integer NOT NULL DEFAULT 0,
+    ADD COLUMN bye_points integer NOT NULL DEFAULT 1;
+
+ALTER TABLE scores
+    ADD COLUMN points integer NOT NULL DEFAULT 0,
+    ADD COLUMN opp_points integer NOT NULL DEFAULT 0;
+
+DROP VIEW standings;
+DROP VIEW playerScores;
+CREATE VIEW playerScores AS
+WITH results AS (
+    SELECT tournament, player1 AS player, player2 AS opponent, winner
+    FROM matches
+    UNION ALL
+    SELECT tournament, player2 AS player, player1 AS opponent, winner
+    FROM matches
+),
+-- wins (a bye counts as a win), games and points of each player
+-- Note: The left join lets us have rows with 0 games, whereas an inner
+-- join would only output rows with players with at least 1 game.
+totals AS (
+    SELECT
+        r.tournament AS tournament,
+        r.player AS player,
+        r.bye + COUNT(CASE WHEN x.winner = r.player THEN 1 END) AS wins,
+        COUNT(x.opponent) AS games,
+        r.bye * t.bye_points + COALESCE(SUM(CASE
+            WHEN x.opponent IS NULL THEN 0
+            WHEN x.winner = r.player THEN t.win_points
+            WHEN x.winner IS NULL THEN t.draw_points
+            ELSE t.loss_points END), 0) AS points
+    FROM registry AS r
+    INNER JOIN tournaments AS t ON t.id = r.tournament
+    LEFT JOIN results AS x
+        ON x.tournament = r.tournament AND x.player = r.player
+    GROUP BY r.tournament, r.player, r.bye, t.bye_points
+)
+-- the omw of each player is the sum of the wins of his opponents, and the
+-- opp_points the sum of their points
+SELECT
+    t.tournament AS tournament,
+    t.player AS player,
+    t.wins AS wins,
+    t.games AS games,
+    COALESCE(SUM(o.wins), 0) AS omw,
+    t.points AS points,
+    COALESCE(SUM(o.points), 0) AS opp_points,
+    rank() OVER (PARTITION BY t.tournament
+        ORDER BY t.points DESC, COALESCE(SUM(o.points), 0) DESC, t.games ASC)
+        AS place
+FROM totals AS t
+LEFT JOIN results AS x
+    ON x.tournament = t.tournament AND x.player = t.player
+LEFT JOIN totals AS o
+    ON o.tournament = x.tournament AND o.player = x.opponent
+GROUP BY t.tournament, t.player, t.wins, t.games, t.points;
+
+-- Adds wins and points to a player, and to the omw and opp_points of all the
+-- players he played against, with a single update. The opponent of a match
+-- that isn't inserted yet is passed explicitly (or NULL). The opponents are
+-- looked up by each side of the matches, so both lookups use an index.
+CREATE OR REPLACE FUNCTION add_result(t integer, p integer, opponent integer,
+        dwins integer, dpoints integer) RETURNS void AS $$
+BEGIN
+    IF dwins = 0 AND dpoints = 0 THEN
+        RETURN;
+    END IF;
+    UPDATE scores AS s SET
+        wins = s.wins + o.wins,
+        points = s.points + o.points,
+        omw = s.omw + o.omw,
+        opp_points = s.opp_points + o.opp_points
+    FROM (
+        SELECT p AS player, dwins AS wins, dpoints AS points, 0 AS omw,
+            0 AS opp_points
+        UNION ALL
+        SELECT player2, 0, 0, dwins, dpoints FROM matches
+            WHERE tournament = t AND player1 = p
+        UNION ALL
+        SELECT player1, 0, 0, dwins, dpoints FROM matches
+            WHERE tournament = t AND player2 = p
+        UNION ALL
+        SELECT opponent, 0, 0, dwins, dpoints WHERE opponent IS NOT NULL
+    ) AS o
+    WHERE s.tournament = t AND s.player = o.player;
+END;
+$$ language plpgsql;
+
+CREATE OR REPLACE FUNCTION update_scores_on_registry() RETURNS trigger AS $$
+DECLARE
+    byePoints integer;
+BEGIN
+    SELECT bye_points INTO byePoints FROM tournaments
+        WHERE id = NEW.tournament;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO scores (tournament, player, wins, points)
+            VALUES (NEW.tournament, NEW.player, NEW.bye, NEW.bye * byePoints);
+    ELSIF NEW.bye != OLD.bye THEN
+        PERFORM add_result(NEW.tournament, NEW.player, NULL,
+            NEW.bye - OLD.bye, (NEW.bye - OLD.bye) * byePoints);
+    END IF;
+    RETURN NULL;
+END;
+$$ language plpgsql;
+
+CREATE OR REPLACE FUNCTION update_scores_on_match() RETURNS trigger AS $$
+DECLARE
+    m matches%ROWTYPE;
+    t tournaments%ROWTYPE;
+    wins1 integer := 0;
+    wins2 integer := 0;
+    points1 integer;
+    points2 integer;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        m := NEW;
+    ELSE
+        m := OLD;
+    END IF;
+
+    -- When the tournament is being deleted, its scores go away too
+    SELECT * INTO t FROM tournaments WHERE id = m.tournament;
+    IF NOT FOUND THEN
+        RETURN m;
+    END IF;
+
+    IF m.winner IS NULL THEN
+        points1 := t.draw_points;
+        points2 := t.draw_points;
+    ELSIF m.winner = m.player1 THEN
+        wins1 := 1;
+        points1 := t.win_points;
+        points2 := t.loss_points;
+    ELSE
+        wins2 := 1;
+        points1 := t.loss_points;
+        points2 := t.win_points;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        -- Each player adds the wins and points of the other to his omw and
+        -- opp_points, counted before the result of the match...
+        UPDATE scores AS s SET
+            games = s.games + 1,
+            omw = s.omw + o.wins,
+            opp_points = s.opp_points + o.points
+        FROM scores AS o
+        WHERE s.tournament = m.tournament AND o.tournament = m.tournament
+            AND ((s.player = m.player1 AND o.player = m.player2)
+                OR (s.player = m.player2 AND o.player = m.player1));
+
+        -- ... and then the result counts for all the opponents of each player
+        -- (this match isn't inserted yet, so the other player is passed).
+        PERFORM add_result(m.tournament, m.player1, m.player2, wins1, points1);
+        PERFORM add_result(m.tournament, m.player2, m.player1, wins2, points2);
+        RETURN m;
+    END IF;
+
+    -- A deleted match is subtracted in the reverse order: first the result,
+    -- from the players and all their opponents (this match included)...
+    PERFORM add_result(m.tournament, m.player1, NULL, -wins1, -points1);
+    PERFORM add_result(m.tournament, m.player2, NULL, -wins2, -points2);
+
+    -- ... and then the wins and points of each player from the other
+    UPDATE scores AS s SET
+        games = s.games - 1,
+        omw = s.omw - o.wins,
+        opp_points = s.opp_points - o.points
+    FROM scores AS o
+    WHERE s.tournament = m.tournament AND o.tournament = m.tournament
+        AND ((s.player = m.player1 AND o.player = m.player2)
+            OR (s.player = m.player2 AND o.player = m.player1));
+    RETURN m;
+END;
+$$ language plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_scores(t integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM scores WHERE t IS NULL OR tournament = t;
+    INSERT INTO scores (tournament, player, wins, games, omw, points,
+            opp_points)
+        SELECT tournament, player, wins, games, omw, points, opp_points
+        FROM playerScores
+        WHERE t IS NULL OR tournament = t;
+    -- The scores may have changed, so the standings cached are no longer valid
+    UPDATE tournaments SET version = version + 1 WHERE t IS NULL OR id = t;
+END;
+$$ language plpgsql;
+
+CREATE VIEW standings AS
+SELECT
+    s.player as player,
+    p.safe_name as name,
+    s.tournament AS tournament,
+    s.wins as wins,
+    s.games as games,
+    s.omw as omw,
+    s.points as points,
+    s.opp_points as opp_points
+FROM scores AS s
+INNER JOIN players AS p ON s.player = p.id
+ORDER BY
+    tournament ASC, -- this order is just for easier human-reading
+    points DESC, -- with the default points, the same as wins and omw
+    opp_points DESC,
+    games ASC, -- ASC improves the pairing heurestic (vs DESC) to avoid giving
+               -- a player 2 byes
+    player ASC; -- ties are always listed in the same order
+
+-- Fill the points of the existing scores
+SELECT rebuild_scores(NULL);
+
+COMMIT;
@@ -0,0 +1,145 @@
+-- Migration of an existing tournament DB to the schema that lets players be
+-- deleted with their matches (see tournament.sql).
+--
+-- Run it from psql, connected to the tournament DB:
+-- \i migrations/06_deleted_players.sql
+
+BEGIN;
+
+-- Subtracts a match from the scores of a player whose opponent is being
+-- deleted (see deletePlayers()): he loses the result of the match, which the
+-- opponents still registered also lose from their omw and opp_points, and
+-- the wins and points the deleted player had when he left the registry. The
+-- scores of the deleted player are left as they are, to be deleted with him.
+CREATE OR REPLACE FUNCTION remove_deleted_opponent(t integer, p integer,
+        deleted integer, dwins integer, dpoints integer) RETURNS void AS $$
+DECLARE
+    deletedWins integer;
+    deletedPoints integer;
+BEGIN
+    SELECT wins, points INTO deletedWins, deletedPoints FROM scores
+        WHERE tournament = t AND player = deleted;
+    UPDATE scores SET
+        wins = wins - dwins,
+        points = points - dpoints,
+        games = games - 1,
+        omw = omw - COALESCE(deletedWins, 0),
+        opp_points = opp_points - COALESCE(deletedPoints, 0)
+    WHERE tournament = t AND player = p;
+
+    IF dwins = 0 AND dpoints = 0 THEN
+        RETURN;
+    END IF;
+    UPDATE scores AS s SET
+        omw = s.omw - dwins,
+        opp_points = s.opp_points - dpoints
+    FROM (
+        SELECT player2 AS player FROM matches
+            WHERE tournament = t AND player1 = p
+        UNION ALL
+        SELECT player1 FROM matches
+            WHERE tournament = t AND player2 = p
+    ) AS o
+    WHERE s.tournament = t AND s.player = o.player AND o.player != deleted
+        AND EXISTS (SELECT 1 FROM registry AS r
+            WHERE r.tournament = t AND r.player = o.player);
+END;
+$$ language plpgsql;
+
+-- Updates the scores of the players of a match when it's added or removed.
+-- Matches are never updated, just inserted or deleted.
+-- It runs before the change, so each row of a multi-row statement sees the
+-- matches as if it was inserted or deleted alone: the ones before it in the
+-- statement are already changed, and the ones after it are not.
+CREATE OR REPLACE FUNCTION update_scores_on_match() RETURNS trigger AS $$
+DECLARE
+    m matches%ROWTYPE;
+    t tournaments%ROWTYPE;
+    registered1 boolean;
+    registered2 boolean;
+    wins1 integer := 0;
+    wins2 integer := 0;
+    points1 integer;
+    points2 integer;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        m := NEW;
+    ELSE
+        m := OLD;
+    END IF;
+
+    -- When the tournament is being deleted, its scores go away too
+    SELECT * INTO t FROM tournaments WHERE id = m.tournament;
+    IF NOT FOUND THEN
+        RETURN m;
+    END IF;
+
+    IF m.winner IS NULL THEN
+        points1 := t.draw_points;
+        points2 := t.draw_points;
+    ELSIF m.winner = m.player1 THEN
+        wins1 := 1;
+        points1 := t.win_points;
+        points2 := t.loss_points;
+    ELSE
+        wins2 := 1;
+        points1 := t.loss_points;
+        points2 := t.win_points;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        -- Each player adds the wins and points of the other to his omw and
+        -- opp_points, counted before the result of the match...
+        UPDATE scores AS s SET
+            games = s.games + 1,
+            omw = s.omw + o.wins,
+            opp_points = s.opp_points + o.points
+        FROM scores AS o
+        WHERE s.tournament = m.tournament AND o.tournament = m.tournament
+            AND ((s.player = m.player1 AND o.player = m.player2)
+                OR (s.player = m.player2 AND o.player = m.player1));
+
+        -- ... and then the result counts for all the opponents of each player
+        -- (this match isn't inserted yet, so the other player is passed).
+        PERFORM add_result(m.tournament, m.player1, m.player2, wins1, points1);
+        PERFORM add_result(m.tournament, m.player2, m.player1, wins2, points2);
+        RETURN m;
+    END IF;
+
+    -- A match deleted with one of its players only changes the scores of the
+    -- other one: the player deleted has already left the registry, and his
+    -- scores can't be updated anymore.
+    registered1 := EXISTS (SELECT 1 FROM registry
+        WHERE tournament = m.tournament AND player = m.player1);
+    registered2 := EXISTS (SELECT 1 FROM registry
+        WHERE tournament = m.tournament AND player = m.player2);
+    IF NOT registered1 OR NOT registered2 THEN
+        IF registered1 THEN
+            PERFORM remove_deleted_opponent(m.tournament, m.player1, m.player2,
+                wins1, points1);
+        ELSIF registered2 THEN
+            PERFORM remove_deleted_opponent(m.tournament, m.player2, m.player1,
+                wins2, points2);
+        END IF;
+        RETURN m;
+    END IF;
+
+    -- A deleted match is subtracted in the reverse order: first the result,
+    -- from the players and all their opponents (this match included)...
+    PERFORM add_result(m.tournament, m.player1, NULL, -wins1, -points1);
+    PERFORM add_result(m.tournament, m.player2, NULL, -wins2, -points2);
+
+    -- ... and then the wins and points of each player from the other
+    UPDATE scores AS s SET
+        games = s.games - 1,
+        omw = s.omw - o.wins,
+        opp_points = s.opp_points - o.points
+    FROM scores AS o
+    WHERE s.tournament = m.tournament AND o.tournament = m.tournament
+        AND ((s.player = m.player1 AND o.player = m.player2)
+            OR (s.player = m.player2 AND o.player = m.player1));
+    RETURN m;
+END;
+$$ language plpgsql;
+
+COMMIT;
@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+#
+# pairing.py -- Swiss pairing engine used by tournament.py
+#
+# The functions in this module work on plain lists of standings rows and a set
+# of already played pairs, so they don't need access to the database.
+#
+
+from blossom import maxWeightMatching
+
+
+# Number of following players a player can be paired with, and number of
+# positions the search can go back to undo a pairing when it gets stuck.
+PAIRING_WINDOW = 8
+
+# Maximum number of steps a single search can take before giving up.
+PAIRING_BUDGET = 200000
+
+# Number of following players in the standings (not counting the ones he
+# already played against) that a player can be paired with by matchingPairs().
+MATCHING_NEIGHBOURS = 16
+
+# Maximum number of players that matchingPairs() pairs with a single maximum
+# weight matching of the whole standings, optimal across the score groups.
+# The blossom algorithm is O(n^3), so bigger standings are matched a score
+# group at a time.
+MATCHING_GLOBAL_PLAYERS = 200
+
+# Marks a player that is moved down to the next score group.
+FLOAT = -1
+
+
+class PairingError(ValueError):
+    """Raised when the players can't be completely paired without rematches."""
+
+
+def pairKey(player1, player2):
+    """Returns the key of two players in a set of played pairs."""
+    if player1 < player2:
+        return (player1, player2)
+    return (player2, player1)
+
+def checkResults(results, played):
+    """Checks the results of a round before they're recorded.
+
+    Args:
+        results: list of (player1, player2, winner) tuples, where winner is the
+        id of one of the players, or None if a draw.
+        played: set of pairKey() of the players that already played.
+
+    Raises:
+        ValueError: if two results are for the same players, or a pair of
+        players already played, or a winner didn't play the match.
+    """
+    played = set(played)
+    for (player1, player2, winner) in results:
+        key = pairKey(player1, player2)
+        if key in played:
+            raise ValueError("Players %s and %s already played" %
+                             (player1, player2))
+        if winner not in (player1, player2, None):
+            raise ValueError("Winner %s didn't play the match between "
+                             "%s and %s" % (winner, player1, player2))
+        played.add(key)
+
+def scoreGroups(players):
+    """Splits the players, sorted by standings, into groups with the same
+    score.
+
+    Args:
+        players: list of standings rows (id, name, score, ...), sorted by
+        standings.
+
+    Returns:
+        A list of lists of rows, from the highest score group to the lowest.
+    """
+    groups = []
+    for player in players:
+        if groups and groups[-1][0][2] == player[2]:
+            groups[-1].append(player)
+        else:
+            groups.append([player])
+    return groups
+
+def swissPairs(players, played, window = PAIRING_WINDOW):
+    """Pairs the players for the next round of a Swiss tournament, avoiding
+    rematches.
+
+    The algorithm is:
+    1) Split the players into score groups (players with the same score).
+    2) From the highest group to the lowest, pair each player with one of the
+    next `window` players of the group he didn't play against yet. When the
+    search gets stuck, it only undoes the pairings of the last `window`
+    positions. Players who can't be paired inside their group float down
+    to the top of the next group.
+    3) If the lowest group can't be completely paired, the last pairs made are
+    undone and paired again together with it, with no window, doubling the
+    number of pairs undone until everything is paired. If that fails too, the
+    players are paired with matchingPairs().
+
+    Since every player only looks at a bounded number of candidates, the usual
+    cost is linear in the number of players.
+
+    Args:
+        players: list of standings rows (id, name, score, ...) sorted by
+        standings. The list must be even.
+        played: set of pairKey() of the players that already played.
+        window: number of candidates per player, and of positions to backtrack.
+
+    Returns:
+        A list of tuples (id1, name1, id2, name2), from the top of the
+        standings to the bottom.
+
+    Raises:
+        PairingError: if there's no complete pairing without rematches, or it
+        can't be found within PAIRING_BUDGET steps.
+    """
+    if len(players) % 2 != 0:
+        raise PairingError("Can't pair an odd number of players.")
+
+    pairs = _swissPairs(players, played, window)
+    if pairs is None:
+        # Last resort: an optimal matching, which raises PairingError
+        return matchingPairs(players, played)
+    return [(p[0], p[1], q[0], q[1]) for (p, q) in pairs]
+
+def matchingPairs(players, played, neighbours = MATCHING_NEIGHBOURS):
+    """Pairs the players for the next round of a Swiss tournament with
+    maximum matchings, so the pairing of each score group is optimal instead
+    of greedy.
+
+    Each player can be paired with the next `neighbours` players in the
+    standings he didn't play against yet. The pairing penalizes, in this
+    order of priority:
+    1) Leaving players unpaired: all the players are paired if possible.
+    2) The score difference: as few players as possible are moved down to
+    the next score group, and those are paired first.
+
+    The pairing of the Swiss engine is returned as is if it can be proved to
+    be optimal (which is the usual case). Otherwise the score groups are
+    matched one at a time, from the highest, each with the players that
+    couldn't be paired in the groups above (see groupMatchingPairs()), so the
+    blossom algorithm only deals with a group at a time. Standings of up to
+    MATCHING_GLOBAL_PLAYERS players are then matched again as a whole, unless
+    the pairing is already optimal, with a maximum weight matching that
+    minimizes the sum of squared score differences.
+
+    Args:
+        players: list of standings rows (id, name, score, ...) sorted by
+        standings. The list must be even.
+        played: set of pairKey() of the players that already played.
+        neighbours: number of candidates per player.
+
+    Returns:
+        A list of tuples (id1, name1, id2, name2), from the top of the
+        standings to the bottom.
+
+    Raises:
+        PairingError: if there's no complete pairing without rematches
+        between players at most `neighbours` positions away.
+    """
+    n = len(players)
+    if n % 2 != 0:
+        raise PairingError("Can't pair an odd number of players.")
+    if n == 0:
+        return []
+
+    # When the Swiss engine only pairs players with different scores where
+    # it's unavoidable, its pairing is already optimal.
+    minimum = _minimumCost(players)
+    pairs = _swissPairs(players, played, PAIRING_WINDOW)
+    if pairs is None or _cost(pairs) != minimum:
+        pairs = groupMatchingPairs(players, played, neighbours)
+        # Its pairs with no score difference are optimal anyway, so they're
+        # matched from the start of the matching of the whole standings.
+        if n <= MATCHING_GLOBAL_PLAYERS and _cost(pairs) != minimum:
+            pairs = _weightedMatching(players, played, neighbours,
+                                      [pair for pair in pairs
+                                       if pair[0][2] == pair[1][2]]) or pairs
+    return [(p[0], p[1], q[0], q[1]) for (p, q) in pairs]
+
+def groupMatchingPairs(players, played, neighbours = MATCHING_NEIGHBOURS):
+    """Pairs the players a score group at a time, from the highest, each with
+    the players that couldn't be paired in the groups above (see
+    _maximumMatching()). If players are left at the bottom, the last pairs
+    are undone and paired again with them with _weightedMatching(), doubling
+    the number of pairs undone until everything is paired.
+
+    It's the pairing of matchingPairs() for big standings, without trying the
+    Swiss engine first. Its cost doesn't depend on the size of the standings
+    as much as the one of a single matching of all of them.
+
+    Returns:
+        The list of pairs of rows.
+
+    Raises:
+        PairingError: as matchingPairs().
+    """
+    pairs = []
+    carried = []
+    for group in scoreGroups(players):
+        groupPairs, carried = _maximumMatching(carried + group, played,
+                                               neighbours)
+        pairs.extend(groupPairs)
+    if not carried:
+        return pairs
+
+    # The players left at the bottom are paired with the last pairs undone
+    rank = dict((p[0], i) for (i, p) in enumerate(players))
+    undo = 1
+    while True:
+        undo = min(undo, len(pairs))
+        kept, undone = pairs[:len(pairs) - undo], pairs[len(pairs) - undo:]
+        pool = carried + [p for pair in undone for p in pair]
+        pool.sort(key=lambda p: rank[p[0]])
+        result = _weightedMatching(pool, played, neighbours,
+                                   [pair for pair in undone
+                                    if pair[0][2] == pair[1][2]])
+        if result is not None:
+            return kept + result
+        if undo == len(pairs):
+            raise PairingError(
+                "Can't pair %d players without rematches." % len(players))
+        undo = undo * 2
+
+def _candidates(pool, played, neighbours):
+    """Returns the sorted list of (i, j) positions in the pool, i < j, of the
+    players that can be paired: each one with the next `neighbours` players
+    he didn't play against yet."""
+    n = len(pool)
+    candidates = []
+    for i in range(n):
+        found = 0
+        for j in range(i + 1, n):
+            if found == neighbours:
+                break
+            if pairKey(pool[i][0], pool[j][0]) not in played:
+                candidates.append((i, j))
+                found += 1
+    return candidates
+
+def _maximumMatching(pool, played, neighbours):
+    """Pairs as many players of a pool as possible: a score group, after the
+    players carried down from the groups above.
+
+    All the players of the group have the same score, so any maximum
+    matching has the same score differences, as long as the players carried
+    down are paired first. The players are paired greedily from the top, so
+    the ones carried down get a partner if they can, and the blossom
+    algorithm only looks for augmenting paths from the players left, which
+    never unpair anyone. Since all the pairs weigh the same, the greedy pairs
+    are valid as its initial matching.
+
+    Returns:
+        A tuple (pairs, unpaired), where pairs is a list of (row1, row2)
+        tuples and unpaired the list of rows left without a partner.
+    """
+    n = len(pool)
+    candidates = _candidates(pool, played, neighbours)
+    partner = [None] * n
+    initial = []
+    for (k, (i, j)) in enumerate(candidates):
+        if partner[i] is None and partner[j] is None:
+            partner[i], partner[j] = j, i
+            initial.append(k)
+
+    # With at most one player left (odd pool), the greedy pairing is maximum
+    if n - 2 * len(initial) > 1:
+        mate = maxWeightMatching([(i, j, 1) for (i, j) in candidates],
+                                 initial=initial)
+        partner = [None] * n
+        for (i, j) in enumerate(mate):
+            if j != -1:
+                partner[i] = j
+
+    pairs = [(pool[i], pool[j]) for (i, j) in enumerate(partner)
+             if j is not None and i < j]
+    unpaired = [pool[i] for i in range(n) if partner[i] is None]
+    return pairs, unpaired
+
+def _weightedMatching(pool, played, neighbours, initial):
+    """Pairs all the players of a pool with a maximum weight matching that
+    minimizes the sum of squared score differences.
+
+    Args:
+        pool: list of standings rows, sorted by standings.
+        played: set of pairKey() of the players that already played.
+        neighbours: number of candidates per player.
+        initial: list of (row1, row2) pairs with no score difference, which
+        are matched from the start.
+
+    Returns:
+        The list of pairs of rows, or None if they can't all be paired.
+    """
+    n = len(pool)
+    rank = dict((p[0], i) for (i, p) in enumerate(pool))
+    initial = set(tuple(sorted((rank[p[0]], rank[q[0]]))) for (p, q) in initial)
+    candidates = sorted(initial.union(_candidates(pool, played, neighbours)))
+    if not candidates:
+        return None
+
+    # Weights are integers, so the result is exact, and big enough for
+    # pairing everyone to outweigh the sum of all the score differences.
+    squares = [(pool[i][2] - pool[j][2]) ** 2 for (i, j) in candidates]
+    pairWeight = (max(squares) + 1) * n
+    edges = [(i, j, pairWeight - d) for ((i, j), d) in zip(candidates, squares)]
+    initial = [k for k in range(len(edges)) if candidates[k] in initial]
+
+    mate = maxWeightMatching(edges, initial=initial)
+    if len(mate) < n or -1 in mate:
+        return None
+    return [(pool[i], pool[j]) for (i, j) in enumerate(mate) if i < j]
+
+# Pairing functions that can be selected by name in tournament.swissPairings()
+STRATEGIES = {
+    'swiss': swissPairs,
+    'matching': matchingPairs,
+}
+
+def getStrategy(name):
+    """Returns the pairing function of one of the STRATEGIES.
+
+    Raises:
+        ValueError: if there's no strategy with that name.
+    """
+    if name not in STRATEGIES:
+        raise ValueError("Unknown pairing strategy '%s', use one of: %s" %
+                         (name, ", ".join(sorted(STRATEGIES))))
+    return STRATEGIES[name]
+
+def _swissPairs(players, played, window):
+    """Pairs the players as explained in swissPairs().
+
+    Returns:
+        The list of pairs of rows, or None if the search failed.
+    """
+    pairs = []
+    floaters = []
+    for group in scoreGroups(players):
+        group = floaters + group
+        groupPairs, floaters = pairGroup(group, played, window)
+        pairs.extend(groupPairs)
+
+    if floaters:
+        pairs = _repair(players, pairs, floaters, played)
+    return pairs
+
+def _cost(pairs):
+    """Returns the sum of the squared score differences of pairs of rows."""
+    return sum((p[2] - q[2]) ** 2 for (p, q) in pairs)
+
+def _minimumCost(players):
+    """Returns a lower bound of the _cost() of any pairing of the players.
+
+    Between two consecutive score groups with an odd number of players above,
+    at least one pair must have one player in each side. The squared score
+    difference of a pair is at least the sum of the squared gaps it crosses.
+    """
+    cost = 0
+    above = 0
+    groups = scoreGroups(players)
+    for (upper, lower) in zip(groups, groups[1:]):
+        above += len(upper)
+        if above % 2 != 0:
+            cost += (upper[0][2] - lower[0][2]) ** 2
+    return cost
+
+def pairGroup(group, played, window = PAIRING_WINDOW):
+    """Pairs the players of a score group, letting as few of them as possible
+    float down to the next group.
+
+    Args:
+        group: list of standings rows, sorted by standings.
+        played: set of pairKey() of the players that already played.
+        window: number of candidates per player, and of positions to backtrack.
+
+    Returns:
+        A tuple (pairs, floaters), where pairs is a list of (row1, row2)
+        tuples and floaters the list of rows that couldn't be paired.
+    """
+    # Try first with the minimum number of floaters, then allow more of them.
+    for floats in range(len(group) % 2, len(group) + 1, 2):
+        result = _search(group, played, window, floats)
+        if result is not None:
+            return result
+    return [], list(group)
+
+def _repair(players, pairs, floaters, played):
+    """Pairs the players left at the bottom of the standings by undoing the
+    last pairs made, and pairing all of them together without a window.
+
+    Returns:
+        The list of pairs of rows, or None if the search failed.
+    """
+    rank = dict((p[0], i) for (i, p) in enumerate(players))
+    undo = 1
+    while True:
+        undo = min(undo, len(pairs))
+        pool = floaters + [p for pair in pairs[len(pairs) - undo:] for p in pair]
+        pool.sort(key=lambda p: rank[p[0]])
+        result = _search(pool, played, len(pool), 0)
+        if result is not None:
+            return pairs[:len(pairs) - undo] + result[0]
+        if undo == len(pairs):
+            return None
+        undo = undo * 2
+
+def _search(group, played, window, floats):
+    """Backtracking search of a pairing of the group with `floats` floaters.
+
+    Args:
+        group: list of standings rows, sorted by standings.
+        played: set of pairKey() of the players that already played.
+        window: number of candidates per player, and of positions to backtrack.
+        floats: number of players that can be left without a pair.
+
+    Returns:
+        A tuple (pairs, floaters) as in pairGroup(), or None if not found.
+    """
+    n = len(group)
+    ids = [p[0] for p in group]
+    partner = [None] * n    # index of the partner of each player, or FLOAT
+    stack = []              # choices made: [index, options, chosen option]
+    floated = 0
+    steps = 0
+
+    i = 0
+    while True:
+        # Go to the next player without a partner
+        while i < n and partner[i] is not None:
+            i += 1
+        if i == n:
+            break
+
+        # Candidates are the next free players he didn't play against yet
+        options = []
+        seen = 0
+        j = i + 1
+        while j < n and seen < window:
+            if partner[j] is None:
+                seen += 1
+                if pairKey(ids[i], ids[j]) not in played:
+                    options.append(j)
+            j += 1
+        if floated < floats:
+            options.append(FLOAT)
+
+        if options:
+            stack.append([i, options, 0])
+            floated += _choose(partner, i, options[0])
+            continue
+
+        # Dead end: undo the last choices, but only inside the window
+        failed = i
+        while True:
+            if not stack or stack[-1][0] < failed - window:
+                return None
+            steps += 1
+            if steps > PAIRING_BUDGET:
+                return None
+            choice = stack[-1]
+            k, options, chosen = choice
+            floated -= _unchoose(partner, k, options[chosen])
+            if chosen + 1 < len(options):
+                choice[2] = chosen + 1
+                floated += _choose(partner, k, options[chosen + 1])
+                break
+            stack.pop()
+        i = k
+
+    pairs = [(group[k], group[options[chosen]])
+             for (k, options, chosen) in stack if options[chosen] != FLOAT]
+    floaters = [group[k] for k in range(n) if partner[k] == FLOAT]
+    return pairs, floaters
+
+def _choose(partner, i, option):
+    """Applies a choice of the search. Returns 1 if it floats a player."""
+    partner[i] = option
+    if option == FLOAT:
+        return 1
+    partner[option] = i
+    return 0
+
+def _unchoose(partner, i, option):
+    """Undoes a choice of the search. Returns 1 if it floated a player."""
+    partner[i] = None
+    if option == FLOAT:
+        return 1
+    partner[option] = None
+    return 0
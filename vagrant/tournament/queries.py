@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# queries.py -- SQL shared by tournament.py and tournament_async.py
+#
+# The queries use %s placeholders, as psycopg2 does. numbered() numbers them
+# ($1, $2, ...) for asyncpg and for the prepared statements of tournament.py.
+#
+
+import re
+
+
+COUNT_PLAYERS = "SELECT COUNT(*) FROM players;"
+
+COUNT_TOURNAMENTS = "SELECT COUNT(*) FROM tournaments;"
+
+REGISTER_PLAYER = """
+    INSERT INTO players (name, safe_name) VALUES (%s, %s) RETURNING id;
+"""
+
+REGISTER_TOURNAMENT = """
+    INSERT INTO tournaments (name, win_points, draw_points, loss_points,
+        bye_points)
+    VALUES (%s, %s, %s, %s, %s) RETURNING id;
+"""
+
+# Points of each result in a tournament, as (win, draw, loss, bye)
+TOURNAMENT_POINTS = """
+    SELECT win_points, draw_points, loss_points, bye_points
+    FROM tournaments WHERE id = %s;
+"""
+
+REGISTER_ENTRY = "INSERT INTO registry (player, tournament) VALUES (%s, %s);"
+
+# Refreshes the statistics of the planner after a bulk import. Until
+# autovacuum gets to them, the planner would still expect the tables to be
+# as small as before, and could pick nested loops over thousands of rows.
+ANALYZE_PLAYERS = "ANALYZE players, registry, scores;"
+
+REPORT_MATCH = """
+    INSERT INTO matches(tournament, player1, player2, winner)
+    VALUES(%s, %s, %s, %s);
+"""
+
+# The matches of a whole round in one INSERT, with the %s replaced by a row
+# of REPORT_MATCHES_ROW per match (see psycopg2.extras.execute_values()).
+REPORT_MATCHES = """
+    INSERT INTO matches(tournament, player1, player2, winner) VALUES %s;
+"""
+REPORT_MATCHES_ROW = "(%s, %s, %s, %s)"
+
+# We do a 'bye+1' to get an error from the DB in case the pairing algorithm
+# leaves the same player a second time without a match.
+# A bye=1 would work fine, but then that error would be silenced/missed.
+ASSIGN_BYE = "UPDATE registry SET bye=bye+1 WHERE tournament=%s AND player=%s;"
+
+# Standings of a tournament, as returned by playerStandings()
+STANDINGS = """
+    SELECT player, name, wins, games, omw
+    FROM standings as s
+    WHERE s.tournament = %s;
+"""
+
+# Standings rows used to pair the players, who are grouped by points
+PAIRING_STANDINGS = """
+    SELECT player, name, points, games
+    FROM standings WHERE tournament = %s;
+"""
+
+# Players of a tournament with their byes, and its matches, for computing the
+# tiebreakers
+TOURNAMENT_ENTRIES = """
+    SELECT r.player, p.safe_name, r.bye
+    FROM registry AS r
+    INNER JOIN players AS p ON r.player = p.id
+    WHERE r.tournament = %s;
+"""
+TOURNAMENT_MATCHES = """
+    SELECT player1, player2, winner FROM matches WHERE tournament = %s;
+"""
+
+# Pairs of players of a tournament that already played, as in pairKey()
+PLAYED_PAIRS = """
+    SELECT LEAST(player1, player2), GREATEST(player1, player2)
+    FROM matches WHERE tournament = %s;
+"""
+
+# Whether two players already played against each other in a tournament.
+# "Trick" to get a true/false result from the DB, extracted from:
+# http://www.postgresql.org/docs/current/interactive/functions-subquery.html#FUNCTIONS-SUBQUERY-EXISTS
+PLAYED_AGAINST = """
+    SELECT EXISTS(
+        SELECT 1 FROM matches WHERE
+        tournament = %s
+        AND player1 IN (%s, %s)
+        AND player2 IN (%s, %s)
+    );
+"""
+
+# Lock of a tournament until the end of the transaction. The first key keeps
+# these locks apart from other advisory locks of the DB.
+TOURNAMENT_LOCK = 1
+LOCK_TOURNAMENT = "SELECT pg_advisory_xact_lock(%s, %s);"
+
+TOURNAMENT_VERSION = "SELECT version FROM tournaments WHERE id = %s;"
+
+# Standings of a tournament with the version they belong to, in a single
+# statement so both are read from the same snapshot. No rows if the
+# tournament has no players.
+VERSIONED_STANDINGS = """
+    SELECT player, name, wins, games, omw,
+        (SELECT version FROM tournaments WHERE id = %s)
+    FROM standings as s
+    WHERE s.tournament = %s;
+"""
+
+# Channel where the DB notifies the new versions of the tournaments, with
+# 'id:version' payloads.
+LISTEN_VERSIONS = "LISTEN tournament_version;"
+
+# Queries that tournament.py runs as server-side prepared statements, so each
+# connection of the pool parses and plans them only once.
+PREPARED_QUERIES = (
+    COUNT_PLAYERS, COUNT_TOURNAMENTS, REGISTER_PLAYER, REGISTER_TOURNAMENT,
+    TOURNAMENT_POINTS, REGISTER_ENTRY, REPORT_MATCH, ASSIGN_BYE, STANDINGS,
+    PAIRING_STANDINGS, TOURNAMENT_ENTRIES, TOURNAMENT_MATCHES, PLAYED_PAIRS,
+    PLAYED_AGAINST, LOCK_TOURNAMENT, TOURNAMENT_VERSION, VERSIONED_STANDINGS,
+)
+
+_numberedQueries = {}   # query with %s -> query with $1, $2...
+
+def numbered(query):
+    """Returns a query with the %s placeholders numbered ($1, $2...), as
+    asyncpg and PREPARE expect."""
+    if query not in _numberedQueries:
+        count = iter(range(1, query.count("%s") + 1))
+        _numberedQueries[query] = re.sub(
+            "%s", lambda match: "$%d" % next(count), query)
+    return _numberedQueries[query]
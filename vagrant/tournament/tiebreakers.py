@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# tiebreakers.py -- tiebreakers of the standings, used by tournament.py
+#
+# The results of a tournament are aggregated in a single pass over its
+# matches, and every tiebreaker is computed from those aggregates, so adding
+# a tiebreaker doesn't need another scan of the matches (or another view).
+#
+
+from __future__ import division
+
+
+# Points of each result, by default the same as the standings: a win (or a
+# bye) is a point, and draws and losses score nothing. Tournaments can have
+# others, see tournament.registerTournament().
+WIN_POINTS = 1
+DRAW_POINTS = 0
+LOSS_POINTS = 0
+BYE_POINTS = 1
+DEFAULT_POINTS = (WIN_POINTS, DRAW_POINTS, LOSS_POINTS, BYE_POINTS)
+
+# Tiebreakers used by tiebreakStandings() when none are given.
+DEFAULT_TIEBREAKERS = ('buchholz', 'sonneborn-berger')
+
+
+class Results(object):
+    """Aggregated results of a tournament.
+
+    Args:
+        players: iterable of (id, byes) tuples of the registered players.
+        matches: iterable of (player1, player2, winner) tuples, where winner is
+        None for a draw.
+        points: tuple (win, draw, loss, bye) with the points of each result.
+    """
+
+    def __init__(self, players, matches, points = None):
+        win, draw, loss, bye = points or DEFAULT_POINTS
+        self.score = {}         # id -> points
+        self.wins = {}          # id -> wins, not counting byes
+        self.games = {}         # id -> matches played
+        self.opponents = {}     # id -> list of (opponent, points obtained)
+        for (player, byes) in players:
+            self.score[player] = byes * bye
+            self.wins[player] = 0
+            self.games[player] = 0
+            self.opponents[player] = []
+
+        # The only pass over the matches
+        for (player1, player2, winner) in matches:
+            if winner is None:
+                points1 = points2 = draw
+            elif winner == player1:
+                points1, points2 = win, loss
+                self.wins[player1] += 1
+            else:
+                points1, points2 = loss, win
+                self.wins[player2] += 1
+            self.score[player1] += points1
+            self.score[player2] += points2
+            self.games[player1] += 1
+            self.games[player2] += 1
+            self.opponents[player1].append((player2, points1))
+            self.opponents[player2].append((player1, points2))
+
+        self.win = win
+        self.winPercent = dict(
+            (p, self.wins[p] / self.games[p] if self.games[p] else 0.0)
+            for p in self.score)
+        self.opponentsWinPercent = dict(
+            (p, _mean([self.winPercent[o] for (o, points) in self.opponents[p]]))
+            for p in self.score)
+
+
+def _mean(values):
+    """Returns the mean of a list of numbers, or 0 if it's empty."""
+    if not values:
+        return 0.0
+    return sum(values) / len(values)
+
+def buchholz(results, player):
+    """Sum of the scores of the opponents of the player. With the default
+    points, it's the same as the omw of the standings."""
+    return sum(results.score[o] for (o, points) in results.opponents[player])
+
+def medianBuchholz(results, player):
+    """Buchholz without the best and the worst opponent, when the player had
+    more than two."""
+    scores = sorted(results.score[o] for (o, points) in results.opponents[player])
+    if len(scores) > 2:
+        scores = scores[1:-1]
+    return sum(scores)
+
+def sonnebornBerger(results, player):
+    """Sum of the scores of the opponents the player beat, plus the part of the
+    scores of the opponents he drew with, in proportion to the points of the
+    draw."""
+    if not results.win:
+        return 0
+    return sum(results.score[o] * points / results.win
+               for (o, points) in results.opponents[player])
+
+def opponentsOpponentsWinPercent(results, player):
+    """Mean of the win percent of the opponents of each opponent of the player
+    (OOW%)."""
+    return _mean([results.opponentsWinPercent[o]
+                  for (o, points) in results.opponents[player]])
+
+# Tiebreakers that can be selected by name in tiebreakStandings()
+TIEBREAKERS = {
+    'buchholz': buchholz,
+    'median-buchholz': medianBuchholz,
+    'sonneborn-berger': sonnebornBerger,
+    'oow%': opponentsOpponentsWinPercent,
+}
+
+def getTiebreaker(name):
+    """Returns the function of one of the TIEBREAKERS.
+
+    Raises:
+        ValueError: if there's no tiebreaker with that name.
+    """
+    if name not in TIEBREAKERS:
+        raise ValueError("Unknown tiebreaker '%s', use one of: %s" %
+                         (name, ", ".join(sorted(TIEBREAKERS))))
+    return TIEBREAKERS[name]
+
+def tiebreakRows(players, matches, tiebreakers = DEFAULT_TIEBREAKERS,
+                 points = None):
+    """Computes the standings of a tournament with the given tiebreakers.
+
+    Args:
+        players: iterable of (id, name, byes) tuples of the registered players.
+        matches: iterable of (player1, player2, winner) tuples.
+        tiebreakers: names of the TIEBREAKERS, in order of priority.
+        points: tuple (win, draw, loss, bye) with the points of each result.
+
+    Returns:
+        A list of tuples (id, name, score, matches, tiebreaker1, ...), sorted
+        by score, then by each tiebreaker, then by fewer matches and id.
+
+    Raises:
+        ValueError: if a tiebreaker doesn't exist.
+    """
+    functions = [getTiebreaker(name) for name in tiebreakers]
+    players = list(players)
+    results = Results([(p[0], p[2]) for p in players], matches, points)
+    rows = [(player, name, results.score[player], results.games[player]) +
+            tuple(f(results, player) for f in functions)
+            for (player, name, byes) in players]
+    rows.sort(key=lambda row: tuple(-v for v in row[2:3] + row[4:]) +
+              (row[3], row[0]))
+    return rows
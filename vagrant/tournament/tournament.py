@@ -3,21 +3,336 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import atexit
+import csv
+import logging
+import re
+import threading
+import time
+import timeit
+from contextlib import contextmanager
+from itertools import islice
+try:
+    from StringIO import StringIO
+except ImportError: # Python 3
+    from io import StringIO
+
 import bleach
 import psycopg2
-
-
-# The following functions implement reusable code to interact with the DB.
+from psycopg2 import extensions
+from psycopg2 import extras
+from psycopg2 import pool
+
+from export import writeStandings
+from metrics import Metrics
+from pairing import checkResults, getStrategy
+from queries import *
+from tiebreakers import DEFAULT_POINTS, DEFAULT_TIEBREAKERS, tiebreakRows
+
+
+# Settings of the pool of DB connections shared by all the module functions.
+# They can be changed before the first query, or by calling openPool().
+DSN = "dbname=tournament"
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+POOL_PING_AFTER = 30    # seconds a connection can idle before being pinged
+
+# Number of players sent to the DB in each COPY by importPlayers().
+IMPORT_BATCH_SIZE = 1000
+
+# Number of rows fetched from the DB at once by allStandings().
+STANDINGS_BATCH_SIZE = 1000
+
+# Default pairing strategy of swissPairings(), see pairing.STRATEGIES.
+PAIRING_STRATEGY = 'swiss'
+
+# Whether playerStandings() keeps the standings in memory until the DB
+# notifies that their tournament changed.
+STANDINGS_CACHE = True
+
+# Whether the PREPARED_QUERIES of queries.py run as server-side prepared
+# statements, parsed and planned once per connection of the pool.
+PREPARE_QUERIES = True
+
+# Statements that take at least these seconds are logged as warnings to the
+# 'tournament' logger, with their time and rows (not their values). None
+# disables the log.
+SLOW_QUERY_SECONDS = None
+
+# Raised when a change breaks the rules of the DB schema, like a rematch.
+IntegrityError = psycopg2.IntegrityError
+
+# Names of printable ASCII characters, other than < > and &, that bleach
+# returns unchanged, so sanitize() doesn't need to parse them.
+_PLAIN_NAME = re.compile(r"[ -%'-;=?-~]*\Z")
+
+
+class VersionError(ValueError):
+    """Raised when a tournament changed since the version the caller expected,
+    for example because another operator already reported the round."""
+
+
+class MeasuredCursor(extensions.cursor):
+    """Cursor of the pool connections, that adds the time and rows of every
+    statement it sends to the DB to the metrics (see queryMetrics()). As
+    execute() and fetch() use it, so does every function of this module."""
+
+    label = None    # query measured instead of the statements executed
+
+    def execute(self, query, vars = None):
+        start = timeit.default_timer()
+        try:
+            if (PREPARE_QUERIES and self.name is None and
+                    query in _preparedStatements):
+                return self.executePrepared(query, vars)
+            return super(MeasuredCursor, self).execute(query, vars)
+        finally:
+            _measure(self.label or query, timeit.default_timer() - start,
+                     self.rowcount)
+
+    def executeValues(self, query, argslist, template = None):
+        """Executes a query with a VALUES %s for all the argslist at once,
+        with extras.execute_values(). The statement sent has the values
+        inlined, so it's measured (and logged if slow) as the query instead,
+        like the statements with their values bound by the DB."""
+        self.label = query
+        try:
+            extras.execute_values(self, query, argslist, template,
+                                  max(1, len(argslist)))
+        finally:
+            self.label = None
+
+    def executePrepared(self, query, vars = None):
+        """Executes one of the PREPARED_QUERIES with EXECUTE, preparing it
+        first if the connection didn't yet. A prepared statement survives the
+        rollback of its transaction, so it's prepared once per connection."""
+        name, prepare, statement = _preparedStatements[query]
+        prepared = getattr(self.connection, 'prepared', None)
+        if prepared is None:
+            return super(MeasuredCursor, self).execute(query, vars)
+        if name not in prepared:
+            super(MeasuredCursor, self).execute(prepare)
+            prepared.add(name)
+        return super(MeasuredCursor, self).execute(statement, vars)
+
+    def copy_expert(self, sql, file, size = 8192):
+        start = timeit.default_timer()
+        try:
+            return super(MeasuredCursor, self).copy_expert(sql, file, size)
+        finally:
+            _measure(sql, timeit.default_timer() - start, self.rowcount)
+
+
+class PreparingConnection(extensions.connection):
+    """Connection of the pool, that knows which PREPARED_QUERIES it already
+    prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super(PreparingConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class MeasuredPool(pool.ThreadedConnectionPool):
+    """Pool of connections that adds the time to open each of them to the
+    metrics."""
+
+    def _connect(self, key = None):
+        start = timeit.default_timer()
+        conn = super(MeasuredPool, self)._connect(key)
+        _metrics.addConnection(timeit.default_timer() - start)
+        return conn
+
+_pool = None
+_poolSlots = None
+_poolLock = threading.Lock()
+_checkedOut = {}    # id(conn) -> (pool, slots) the connection belongs to
+_lastUsed = {}      # id(conn) -> time the connection was last released
+
+_metrics = Metrics()    # statements sent to the DB by the pool connections
+_log = logging.getLogger(__name__)
+
+def _prepareStatements():
+    """Returns a dict query -> (name, PREPARE statement, EXECUTE statement)
+    with the PREPARED_QUERIES."""
+    statements = {}
+    for (i, query) in enumerate(PREPARED_QUERIES):
+        name = "tournament_%d" % i
+        execute = "EXECUTE " + name
+        if "%s" in query:
+            execute += "(%s)" % ", ".join(["%s"] * query.count("%s"))
+        statements[query] = (name, "PREPARE %s AS %s" % (name, numbered(query)),
+                             execute)
+    return statements
+
+_preparedStatements = _prepareStatements()
+
+_cacheLock = threading.Lock()
+_standingsCache = {}    # tournament -> (version, standings)
+_latestVersions = {}    # tournament -> latest version notified by the DB
+_invalidations = 0      # number of changes made by this process
+_listener = None        # connection listening to the versions notified
+
+
+# The following functions manage the pool of connections to the DB.
 
 def connect():
     """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    return psycopg2.connect(DSN)
+
+def openPool(minSize = None, maxSize = None):
+    """Opens the pool of connections, closing the current one if any.
+
+    It's not required to call this function: the pool is opened on demand
+    with POOL_MIN_SIZE and POOL_MAX_SIZE the first time it's needed.
+
+    Args:
+        minSize: connections opened right away and kept open while idle.
+        maxSize: maximum number of connections open at the same time.
+    """
+    with _poolLock:
+        _closePool()
+        _openPool(minSize or POOL_MIN_SIZE, maxSize or POOL_MAX_SIZE)
+
+def closePool():
+    """Closes all the connections of the pool. The next query reopens it."""
+    with _poolLock:
+        _closePool()
+
+atexit.register(closePool)
+
+def _openPool(minSize, maxSize):
+    """Opens the pool. The caller must hold _poolLock."""
+    global _pool, _poolSlots
+    _pool = MeasuredPool(minSize, maxSize, DSN,
+                         connection_factory=PreparingConnection,
+                         cursor_factory=MeasuredCursor)
+    # psycopg2 raises an error when the pool is exhausted; the semaphore
+    # makes the threads wait for a free connection instead.
+    _poolSlots = threading.BoundedSemaphore(maxSize)
+
+def _closePool():
+    """Closes the pool. The caller must hold _poolLock."""
+    global _pool, _poolSlots
+    if _pool is not None:
+        _pool.closeall()
+    _pool = None
+    _poolSlots = None
+    _checkedOut.clear()
+    _lastUsed.clear()
+
+def getConnection():
+    """Checks out a healthy connection from the pool, waiting for one to be
+    released if all of them are in use.
+
+    Every connection obtained must be given back with releaseConnection().
+
+    Returns:
+        An open connection to the database, with no transaction in progress.
+    """
+    with _poolLock:
+        if _pool is None:
+            _openPool(POOL_MIN_SIZE, POOL_MAX_SIZE)
+        connPool, slots = _pool, _poolSlots
+
+    slots.acquire()
+    try:
+        # Discarded connections are replaced by new ones, so this ends as soon
+        # as the DB is reachable; if it isn't, connect() raises the error.
+        while True:
+            conn = connPool.getconn()
+            if _isHealthy(conn):
+                _checkedOut[id(conn)] = (connPool, slots)
+                return conn
+            _lastUsed.pop(id(conn), None)
+            connPool.putconn(conn, close=True)
+    except:
+        slots.release()
+        raise
+
+def releaseConnection(conn, broken = False):
+    """Gives back to the pool a connection obtained with getConnection().
+
+    Any transaction left open is rolled back.
+
+    Args:
+        conn: the connection to release.
+        broken: whether the connection must be closed instead of reused.
+    """
+    owner = _checkedOut.pop(id(conn), None)
+    if owner is None:
+        # The pool was closed while the connection was in use
+        if not conn.closed:
+            conn.close()
+        return
+
+    connPool, slots = owner
+    try:
+        if broken or conn.closed:
+            _lastUsed.pop(id(conn), None)
+            connPool.putconn(conn, close=True)
+        else:
+            if (conn.get_transaction_status() !=
+                    extensions.TRANSACTION_STATUS_IDLE):
+                conn.rollback()
+            _lastUsed[id(conn)] = time.time()
+            connPool.putconn(conn)
+    except (psycopg2.Error, pool.PoolError):
+        if not conn.closed:
+            conn.close()
+    finally:
+        slots.release()
+
+def _isHealthy(conn):
+    """Checks that a connection of the pool can still be used.
+
+    Connections that idled for more than POOL_PING_AFTER seconds are pinged,
+    since the server may have closed them in the meanwhile.
+    """
+    if conn.closed:
+        return False
+    status = conn.get_transaction_status()
+    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    try:
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        lastUsed = _lastUsed.get(id(conn))
+        if lastUsed is not None and time.time() - lastUsed > POOL_PING_AFTER:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+            conn.rollback()
+    except psycopg2.Error:
+        return False
+    return True
+
+@contextmanager
+def pooledConnection():
+    """Context manager that checks out a connection from the pool and releases
+    it at the end of the block, rolling back whatever wasn't committed.
+
+    Example:
+        with pooledConnection() as conn:
+            cursor = conn.cursor()
+    """
+    conn = getConnection()
+    try:
+        yield conn
+    except:
+        releaseConnection(conn, conn.closed != 0)
+        raise
+    else:
+        releaseConnection(conn)
+
+
+# The following functions implement reusable code to interact with the DB.
 
 def execute(query, values, returning = False):
     """Does an Insert or an Update into the database.
 
-    This function helps to avoid repeating code and ensures we don't forget
-    to bleach any field that goes into the database.
+    This function helps to avoid repeating code. The values are passed as
+    query parameters, so they don't need any escaping; the names that are
+    shown to users are sanitized once when registered (see sanitize()).
 
     Args:
         query: insert or update to execute
@@ -28,27 +343,19 @@ def execute(query, values, returning = False):
         If and only if returning=True, returns the value of the Returning
         operator. When returning=False, doesn't return anything
     """
-    # Connect to the database and open a cursor to perform the operation
-    conn = connect()
-    cursor = conn.cursor()
+    # Get a connection from the pool and open a cursor to perform the operation
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
 
-    # Execute the command, bleaching the passed values (f any)
-    if values is None:
-        cursor.execute(query)
-    else:
-        for value in values:
-            value = bleach.clean(value)
+        # Execute the command, with the passed values (if any)
         cursor.execute(query, values)
 
-    if returning:
-        value = cursor.fetchone()[0]
-
-    # Make the changes persistent
-    conn.commit()
+        if returning:
+            value = cursor.fetchone()[0]
 
-    # Close communication with the database
-    cursor.close()
-    conn.close()
+        # Make the changes persistent
+        conn.commit()
+        cursor.close()
 
     # Return the result of the Returning operator
     if returning:
@@ -61,8 +368,7 @@ def fetchone(query, values):
 def fetch(query, values, singlerow = False):
     """Does a SELECT or COUNT to the database.
 
-    This function helps to avoid repeating code and ensures we don not forget
-    to bleach any field.
+    This function helps to avoid repeating code.
 
     Args:
         query: select or count to execute
@@ -73,29 +379,160 @@ def fetch(query, values, singlerow = False):
         The result of the query. If singlerow=True, returns only the first
         matched row.
     """
-    # Connect to the database and open a cursor to perform the operation
-    conn = connect()
-    cursor = conn.cursor()
+    # Get a connection from the pool and open a cursor to perform the operation
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
 
-    # Execute the command, bleaching the passed values (if any)
-    if values is None:
-        cursor.execute(query)
-    else:
-        for value in values:
-            value = bleach.clean(value)
+        # Execute the command, with the passed values (if any)
         cursor.execute(query, values)
 
-    # Get the results of the query
-    if singlerow:
-        rows = cursor.fetchone()
-    else:
-        rows = cursor.fetchall()
+        # Get the results of the query
+        if singlerow:
+            rows = cursor.fetchone()
+        else:
+            rows = cursor.fetchall()
+        cursor.close()
 
-    # Close communication with the database and return the result
-    cursor.close()
-    conn.close()
+    # The connection goes back to the pool, return the result
     return rows
 
+@contextmanager
+def tournamentTransaction(tournament, version = None):
+    """Context manager for a transaction that changes a tournament, like
+    generating or reporting a round. It's committed at the end of the block,
+    or rolled back if there's an exception.
+
+    The transaction holds an advisory lock on the tournament, so changes to
+    the same tournament are made one at a time, while other tournaments are
+    not blocked. If a version is given, the block only runs if the tournament
+    is still at that version (see tournamentVersion()).
+
+    Example:
+        with tournamentTransaction(tournament, version) as cursor:
+            cursor.execute(...)
+
+    Raises:
+        VersionError: if the tournament is not at the expected version.
+    """
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(LOCK_TOURNAMENT, [TOURNAMENT_LOCK, tournament])
+        if version is not None:
+            cursor.execute(TOURNAMENT_VERSION, [tournament])
+            row = cursor.fetchone()
+            if row is None or row[0] != version:
+                raise VersionError(
+                    "Tournament %s is at version %s instead of %s" %
+                    (tournament, row and row[0], version))
+        yield cursor
+        conn.commit()
+        cursor.close()
+
+
+# The following functions measure the statements sent to the DB.
+
+def queryCount():
+    """Returns the number of statements sent to the DB through the pool since
+    the process started. The difference between two calls is the number of
+    round trips made in between, by all the threads."""
+    return _metrics.queries()
+
+def queryMetrics():
+    """Returns the metrics of the statements sent to the DB through the pool
+    since the process started (or the last resetMetrics()).
+
+    Returns:
+        A list of dicts, one per statement with its 'statement' text (with
+        %s placeholders), number of 'calls', total 'seconds', 'maxSeconds' of
+        a call and 'rows' returned or changed, slowest first. The last one,
+        of kind 'connect' instead of 'query', has the connections opened.
+    """
+    return _metrics.records()
+
+def exportMetrics(outfile):
+    """Writes the queryMetrics() to a file as JSON lines. Returns the number
+    of lines written."""
+    return _metrics.write(outfile)
+
+def resetMetrics():
+    """Forgets the queryMetrics() gathered so far."""
+    _metrics.reset()
+
+def _measure(query, seconds, rows):
+    """Adds a statement to the metrics, and to the log if it's slow."""
+    _metrics.addQuery(query, seconds, rows)
+    if SLOW_QUERY_SECONDS is not None and seconds >= SLOW_QUERY_SECONDS:
+        _log.warning("Slow query (%.3f s, %s rows): %s", seconds, rows,
+                     " ".join(query.split()))
+
+
+# The following functions cache the standings of the tournaments.
+
+def invalidateStandings(tournament = None):
+    """Drops the cached standings of a tournament, or of all of them if None.
+
+    The functions of this module that change a tournament already call it.
+    Changes made by other processes are notified by the DB instead.
+    """
+    global _invalidations
+    with _cacheLock:
+        _invalidations += 1
+        if tournament is None:
+            _standingsCache.clear()
+        else:
+            _standingsCache.pop(tournament, None)
+
+def closeStandingsCache():
+    """Drops all the cached standings and closes the connection listening to
+    the changes of the tournaments. The next call to playerStandings() opens
+    it again."""
+    with _cacheLock:
+        _closeListener()
+
+atexit.register(closeStandingsCache)
+
+def _pollVersions():
+    """Drops the cached standings of the tournaments that changed, as notified
+    by the DB, opening the connection that listens to them if needed. The
+    caller must hold _cacheLock.
+
+    Returns:
+        Whether the changes are being listened to, so the cache can be used.
+    """
+    global _listener
+    try:
+        if _listener is None:
+            conn = connect()
+            _listener = conn
+            conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor()
+            cursor.execute(LISTEN_VERSIONS)
+            cursor.close()
+        _listener.poll()
+    except psycopg2.Error:
+        _closeListener()
+        return False
+
+    while _listener.notifies:
+        notify = _listener.notifies.pop(0)
+        tournament, version = [int(n) for n in notify.payload.split(":")]
+        if version > _latestVersions.get(tournament, version - 1):
+            _latestVersions[tournament] = version
+            cached = _standingsCache.get(tournament)
+            if cached is not None and cached[0] < version:
+                del _standingsCache[tournament]
+    return True
+
+def _closeListener():
+    """Closes the listener connection and drops the cache, whose changes can't
+    be tracked without it. The caller must hold _cacheLock."""
+    global _listener, _invalidations
+    if _listener is not None and not _listener.closed:
+        _listener.close()
+    _listener = None
+    _standingsCache.clear()
+    _invalidations += 1
+
 
 # The following functions clean tables from the DB.
 
@@ -103,21 +540,25 @@ def deletePlayers():
     """Remove all the player records from the database."""
     query = "DELETE FROM players;"
     execute(query, None)
+    invalidateStandings()
 
 def deleteTournaments():
     """Remove all the tournament records from the database."""
     query = "DELETE FROM tournaments;"
     execute(query, None)
+    invalidateStandings()
 
 def deleteRegistry():
     """Remove all the registry records from the database."""
     query = "DELETE FROM registry;"
     execute(query, None)
+    invalidateStandings()
 
 def deleteMatches():
     """Remove all the match records from the database."""
     query = "DELETE FROM matches;"
     execute(query, None)
+    invalidateStandings()
 
 
 # The following functions count elements in tables.
@@ -128,8 +569,7 @@ def countPlayers():
     Returns:
         The number of players currently registered.
     """
-    query = "SELECT COUNT(*) FROM players";
-    return fetch(query, None, True)[0]
+    return fetch(COUNT_PLAYERS, None, True)[0]
 
 def countTournaments():
     """Counts the number of tournaments currently registered.
@@ -137,12 +577,24 @@ def countTournaments():
     Returns:
         The number of tournaments currently registered.
     """
-    query = "SELECT COUNT(*) FROM tournaments";
-    return fetch(query, None, True)[0]
+    return fetch(COUNT_TOURNAMENTS, None, True)[0]
 
 
 # The following functions register (insert/update) things in the DB.
 
+def sanitize(name):
+    """Returns a name safe to be shown in HTML.
+
+    Names are sanitized once, when the player is registered, and stored in
+    the safe_name column, so reading them doesn't need to sanitize them again.
+    Most names have no markup at all, and are returned as they are instead of
+    being parsed by bleach, which is slow enough to dominate importPlayers().
+    """
+    if _PLAIN_NAME.match(name):
+        return str(name)
+    return str(bleach.clean(name))
+
+
 def registerPlayer(name):
     """Adds a player to the players database.
 
@@ -154,22 +606,24 @@ def registerPlayer(name):
     Returns:
         The id of the player created.
     """
-    query = "INSERT INTO players (name) VALUES (%s) RETURNING id;"
-    return execute(query, [name], True)
+    return execute(REGISTER_PLAYER, [name, sanitize(name)], True)
 
-def registerTournament(name):
+def registerTournament(name, points = None):
     """Adds a tournament to the tournaments database.
 
     The database assigns a unique serial id number for the tournament.
 
     Args:
         name: the tournaments's name.
+        points: tuple (win, draw, loss, bye) with the points of each result,
+        which rank the standings. The default, (1, 0, 0, 1), ranks them by
+        wins. Points are integers: for half points, double all of them.
 
     Returns:
         The id of the tournament created.
     """
-    query = "INSERT INTO tournaments (name) VALUES (%s) RETURNING id;"
-    return execute(query, [name], True)
+    return execute(REGISTER_TOURNAMENT, [name] + list(points or DEFAULT_POINTS),
+                   True)
 
 def registerEntry(player, tournament):
     """Adds a player to a tournament.
@@ -180,8 +634,85 @@ def registerEntry(player, tournament):
         player: the id of the player
         tournament: the id of the tournament
     """
-    query = "INSERT INTO registry (player, tournament) VALUES (%s, %s);"
-    execute(query, [player, tournament])
+    execute(REGISTER_ENTRY, [player, tournament])
+    invalidateStandings(tournament)
+
+def importPlayers(names, tournament = None, batchSize = IMPORT_BATCH_SIZE):
+    """Adds many players to the players database, and optionally to a
+    tournament, in a single transaction.
+
+    The names are read and sent to the DB with COPY in batches of batchSize,
+    so they never need to be all in memory at the same time. The ids are
+    taken from the players sequence before copying each batch. The tables are
+    analyzed after the import, so the planner knows their new sizes.
+
+    Args:
+        names: iterable with the players' full names, for example a list or
+        readPlayersCsv(csvfile).
+        tournament: the id of the tournament the players enter, or None.
+        batchSize: number of players copied at once.
+
+    Returns:
+        The list of ids of the players created, in the same order as names.
+    """
+    ids = []
+    names = iter(names)
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        while True:
+            batch = list(islice(names, batchSize))
+            if not batch:
+                break
+
+            # Reserve the ids of the batch
+            cursor.execute("""
+                SELECT nextval(pg_get_serial_sequence('players', 'id'))
+                FROM generate_series(1, %s);
+            """, [len(batch)])
+            batchIds = [row[0] for row in cursor.fetchall()]
+
+            players = StringIO()
+            csv.writer(players).writerows(
+                (player, name, sanitize(name))
+                for (player, name) in zip(batchIds, batch))
+            players.seek(0)
+            # An empty name is an empty string, like in registerPlayer(), not
+            # the NULL of an unquoted empty CSV field
+            cursor.copy_expert(
+                "COPY players (id, name, safe_name) FROM STDIN WITH CSV "
+                "FORCE NOT NULL name, safe_name;", players)
+
+            if tournament is not None:
+                registry = StringIO()
+                csv.writer(registry).writerows(
+                    (player, tournament) for player in batchIds)
+                registry.seek(0)
+                cursor.copy_expert(
+                    "COPY registry (player, tournament) FROM STDIN WITH CSV;",
+                    registry)
+
+            ids.extend(batchIds)
+        conn.commit()
+        if ids:
+            cursor.execute(ANALYZE_PLAYERS)
+            conn.commit()
+        cursor.close()
+    if tournament is not None:
+        invalidateStandings(tournament)
+    return ids
+
+def readPlayersCsv(csvfile):
+    """Reads the names of players from a CSV file, one at a time.
+
+    Args:
+        csvfile: an open file (or any iterable of lines) in CSV format, with a
+        header row that has a 'name' column.
+
+    Returns:
+        A generator of the players' names, to use with importPlayers().
+    """
+    for row in csv.DictReader(csvfile):
+        yield row['name']
 
 def reportMatch(tournament, player1, player2, winner):
     """Records the outcome of a single match between two players.
@@ -195,11 +726,45 @@ def reportMatch(tournament, player1, player2, winner):
         player2: the id number of the other player
         winner:  the id number of the player who won, or None if a draw
     """
-    query = """
-        INSERT INTO matches(tournament, player1, player2, winner)
-        VALUES(%s, %s, %s, %s);
+    execute(REPORT_MATCH, [tournament, player1, player2, winner])
+    invalidateStandings(tournament)
+
+def reportMatches(tournament, results, version = None):
+    """Records the outcome of all the matches of a round at once, in a single
+    transaction and INSERT statement.
+
+    The results are checked before inserting anything: if any match is wrong,
+    no match is recorded.
+
+    Args:
+        tournament: the id of the tournament
+        results: list of (player1, player2, winner) tuples, where winner is the
+        id of one of the players, or None if a draw.
+        version: if given, the results are only recorded if the tournament is
+        still at this version (see tournamentVersion()).
+
+    Raises:
+        ValueError: if two results are for the same players, or a pair of
+        players already played, or a winner didn't play the match.
+        VersionError: if the tournament is not at the given version.
     """
-    execute(query, [tournament, player1, player2, winner])
+    results = list(results)
+    if not results:
+        return
+
+    with tournamentTransaction(tournament, version) as cursor:
+        # Check the results against each other and the matches already played
+        cursor.execute(PLAYED_PAIRS, [tournament])
+        played = set((row[0], row[1]) for row in cursor.fetchall())
+        checkResults(results, played)
+
+        # Insert all of them with a multi-row INSERT
+        cursor.executeValues(
+            REPORT_MATCHES,
+            [(tournament, player1, player2, winner)
+             for (player1, player2, winner) in results],
+            REPORT_MATCHES_ROW)
+    invalidateStandings(tournament)
 
 def assignBye(tournament, player):
     """Assigns a bye to a player (a bye counts as a free win).
@@ -211,18 +776,50 @@ def assignBye(tournament, player):
         tournament: the id of the tournament
         player: the id number of the players
     """
-    # We do a 'bye+1' to get an error from the DB in case the pairing algorithm
-    # leaves the same player a second time without a match.
-    # A bye=1 would work fine, but then that error would be silenced/missed.
-    query = "UPDATE registry SET bye=bye+1 WHERE tournament=%s AND player=%s;"
-    execute(query, [tournament, player])
+    execute(ASSIGN_BYE, [tournament, player])
+    invalidateStandings(tournament)
+
+
+def rebuildStandings(tournament = None):
+    """Recomputes the scores table, that keeps the standings, from the
+    registry and the matches.
+
+    The scores are kept up to date by triggers, so this is only needed to
+    recover from a manual change of the table.
+
+    Args:
+        tournament: the id of the tournament, or None to rebuild all of them.
+    """
+    query = "SELECT rebuild_scores(%s);"
+    execute(query, [tournament])
+    invalidateStandings(tournament)
+
+def sanitizePlayers():
+    """Fills the safe_name of the players that don't have one, like the ones
+    registered before the column existed (see migrations/02_safe_names.sql).
+
+    Returns:
+        The number of players sanitized.
+    """
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name FROM players WHERE safe_name IS NULL;")
+        rows = [(sanitize(name), player) for (player, name) in cursor.fetchall()]
+        cursor.executemany(
+            "UPDATE players SET safe_name = %s WHERE id = %s;", rows)
+        conn.commit()
+        cursor.close()
+    invalidateStandings()
+    return len(rows)
 
 
 # The following functions read (select) info from the database.
 
 def playerStandings(tournament):
     """Returns, for the given tournament, a list of the players and their win
-    records, sorted by wins, then omw, then number of games.
+    records, sorted by points, then points of their opponents, then number of
+    games. With the default points of registerTournament(), it's the same as
+    by wins, then omw.
 
     The first entry in the list is the player in first place, or a player tied
     for first place if there is currently a tie.
@@ -233,26 +830,144 @@ def playerStandings(tournament):
     Returns:
         A list of tuples, each of which contains (id, name, wins, matches, omw):
             id: the player's unique id (assigned by the database).
-            name: the player's full name (as registered).
+            name: the player's full name (as registered, sanitized).
             wins: the number of matches the player has won.
             matches: the number of matches the player has played.
             omw: opponent match wins, #wins by players they have played against.
+
+    With STANDINGS_CACHE, the standings are kept in memory with the version
+    of the tournament they were read at, until the DB notifies a newer one
+    (see invalidateStandings()), so repeated calls don't query the DB.
     """
-    query = """
-        SELECT player, name, wins, games, omw
-        FROM standings as s
-        WHERE s.tournament = %s;
-    """
-    rows = fetch(query, [tournament])
-    return [(
+    listening = False
+    if STANDINGS_CACHE:
+        with _cacheLock:
+            listening = _pollVersions()
+            if listening and tournament in _standingsCache:
+                return list(_standingsCache[tournament][1])
+            invalidations = _invalidations
+
+    rows = fetch(VERSIONED_STANDINGS, [tournament, tournament])
+    standings = [(
             int(row[0]),
-            str(bleach.clean(row[1])),
+            str(row[1]),
             int(row[2]),
             int(row[3]),
             int(row[4])
             ) for row in rows]
 
-def swissPairings(tournament):
+    # Keep them unless there was a change since they were read
+    if listening and rows:
+        version = rows[0][5]
+        with _cacheLock:
+            if (invalidations == _invalidations and
+                    version >= _latestVersions.get(tournament, version)):
+                _standingsCache[tournament] = (version, standings)
+    return list(standings)
+
+def tiebreakStandings(tournament, tiebreakers = DEFAULT_TIEBREAKERS):
+    """Returns the standings of a tournament ranked with the given tiebreakers
+    after the points (see registerTournament()).
+
+    The registry and the matches are read at once, and all the tiebreakers
+    are computed in Python from a single pass over the matches (see
+    tiebreakers.py).
+
+    Args:
+        tournament: the id of the tournament
+        tiebreakers: names of the tiebreakers, in order of priority: any of
+        'buchholz', 'median-buchholz', 'sonneborn-berger' and 'oow%'.
+
+    Returns:
+        A list of tuples (id, name, points, matches, tiebreaker1, ...), sorted
+        by points, then by each tiebreaker, then by fewer matches.
+
+    Raises:
+        ValueError: if a tiebreaker doesn't exist.
+    """
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        # Both queries see the same snapshot of the tournament
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        cursor.execute(TOURNAMENT_ENTRIES, [tournament])
+        players = cursor.fetchall()
+        cursor.execute(TOURNAMENT_MATCHES, [tournament])
+        matches = cursor.fetchall()
+        cursor.execute(TOURNAMENT_POINTS, [tournament])
+        points = cursor.fetchone()
+        conn.rollback()
+        cursor.close()
+    return tiebreakRows(players, matches, tiebreakers, points)
+
+def allStandings(tournaments = None):
+    """Generates the standings of many tournaments, read with a single query.
+
+    The rows are read from the DB in batches of STANDINGS_BATCH_SIZE as they
+    are consumed, with a server-side cursor, so the standings of any number
+    of tournaments don't need to be all in memory at the same time. The pool
+    connection is in use until the generator ends (or is closed).
+
+    Args:
+        tournaments: iterable with the ids of the tournaments, or None for
+        all of them.
+
+    Yields:
+        Tuples (tournament, id, name, wins, matches, omw), sorted by
+        tournament id and then as in playerStandings().
+    """
+    query = """
+        SELECT tournament, player, name, wins, games, omw
+        FROM standings as s
+    """
+    values = None
+    if tournaments is not None:
+        values = [list(tournaments)]
+        if not values[0]:
+            return
+        query += "WHERE s.tournament = ANY(%s);"
+
+    with pooledConnection() as conn:
+        cursor = conn.cursor("standings")
+        cursor.itersize = STANDINGS_BATCH_SIZE
+        cursor.execute(query, values)
+        for row in cursor:
+            yield (int(row[0]), int(row[1]), str(row[2]), int(row[3]),
+                   int(row[4]), int(row[5]))
+        cursor.close()
+
+def exportStandings(outfile, tournaments = None, format = 'csv'):
+    """Writes the standings of many tournaments to a file (see allStandings()
+    and export.writeStandings()).
+
+    Args:
+        outfile: file open for writing.
+        tournaments: iterable with the ids of the tournaments, or None for
+        all of them.
+        format: 'csv' or 'jsonl' (JSON lines).
+
+    Returns:
+        The number of rows written.
+    """
+    return writeStandings(allStandings(tournaments), outfile, format)
+
+def tournamentVersion(tournament):
+    """Returns the version of a tournament: a counter that increases with
+    every change of its registry or matches.
+
+    It can be passed to swissPairings() or reportMatches() to make sure the
+    tournament didn't change since it was read (for example, from another
+    terminal).
+
+    Args:
+        tournament: the id of the tournament
+
+    Returns:
+        The version of the tournament, or None if it doesn't exist.
+    """
+    row = fetchone(TOURNAMENT_VERSION, [tournament])
+    return row and row[0]
+
+def swissPairings(tournament, strategy = PAIRING_STRATEGY, version = None):
     """Returns a list of pairs of players for the next round of a match.
 
     Assuming that there are an even number of players registered, each player
@@ -263,8 +978,17 @@ def swissPairings(tournament):
     When there is an odd number of players, the last one is granted a free bye
     instead of being paired with another player to play with.
 
+    The standings and matches are read, and the bye assigned, in a single
+    transaction that holds the lock of the tournament, so two terminals
+    can't pair the same standings or give two byes in the same round.
+
     Args:
         tournament: the id of the tournament
+        strategy: how to pair the players. 'swiss' (the default) pairs them
+        with the Swiss pairing engine, and 'matching' with a maximum weight
+        matching, which minimizes the score differences of the pairs.
+        version: if given, the round is only generated if the tournament is
+        still at this version (see tournamentVersion()).
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -272,21 +996,37 @@ def swissPairings(tournament):
         name1: the first player's name
         id2: the second player's unique id
         name2: the second player's name
+
+    Raises:
+        PairingError: if the players can't be completely paired without
+        rematches. No bye is assigned in that case.
+        ValueError: if the strategy doesn't exist.
+        VersionError: if the tournament is not at the given version.
     """
-    query = """
-        SELECT player, name, wins, games
-        FROM standings WHERE tournament = %s;
-    """
-    rows = fetch(query, [tournament])
+    pairPlayers = getStrategy(strategy)
+    with tournamentTransaction(tournament, version) as cursor:
+        cursor.execute(PAIRING_STANDINGS, [tournament])
+        rows = cursor.fetchall()
+        cursor.execute(PLAYED_PAIRS, [tournament])
+        played = set((row[0], row[1]) for row in cursor.fetchall())
+
+        # Leave out the last player if number of players is odd
+        lastPlayer = None
+        if len(rows) % 2 != 0:
+            lastPlayer = rows[-1]
+            del rows[-1] # remove it from the list
 
-    # Assign a bye to last player if number of players is odd
-    if len(rows) % 2 != 0:
-        lastPlayer = rows[-1]
-        del rows[-1] # remove it from the list
-        assignBye(tournament, lastPlayer[0])
+        # Pair the players first, so no bye is assigned if the pairing fails
+        result = pairPlayers(rows, played)
+
+        # Assign a bye to the player left out
+        if lastPlayer is not None:
+            cursor.execute(ASSIGN_BYE, [tournament, lastPlayer[0]])
+    if lastPlayer is not None:
+        invalidateStandings(tournament)
 
     # Return the matching pairs
-    return pairs(tournament, rows)
+    return result
 
 def playedAgainst(tournament, player1, player2):
     """Checks if two players have already played against each other in the given
@@ -300,71 +1040,45 @@ def playedAgainst(tournament, player1, player2):
     Returns:
         True if the players already matched, False if not.
     """
-    # "Trick" to get a true/false result from the DB, extracted from:
-    # http://www.postgresql.org/docs/current/interactive/functions-subquery.html#FUNCTIONS-SUBQUERY-EXISTS
-    query = """
-        SELECT EXISTS(
-            SELECT 1 FROM matches WHERE
-            tournament = %s
-            AND player1 IN (%s, %s)
-            AND player2 IN (%s, %s)
-        );
-        """
-    row = fetch(query, [tournament, player1, player2, player2, player1], True)
+    row = fetch(PLAYED_AGAINST,
+                [tournament, player1, player2, player2, player1], True)
     return row[0]
 
-def pairs(tournament, players):
+def playedPairs(tournament):
+    """Gets, in a single query, all the pairs of players that already played
+    against each other in the given tournament.
+
+    Args:
+        tournament: the id of the tournament.
+
+    Returns:
+        A set of (id1, id2) tuples, with id1 < id2, so it can be checked with
+        pairKey(player1, player2) in O(1).
+    """
+    return set((row[0], row[1]) for row in fetch(PLAYED_PAIRS, [tournament]))
+
+def pairs(tournament, players, strategy = PAIRING_STRATEGY):
     """Pairs the players avoiding match repetitions; that is, two players can
     only play once versus the other in the same tournament.
 
-    The pairing heuristic is O(n log(n)) and is variation of heapsort (see:
-    https://en.wikipedia.org/wiki/Heapsort). In concrete, the algorithm used
-    is (example with a list of 6 players):
-    0) Given an input list, create an empty pairs list.
-        players = [A,B,C,D,E,F]
-        pairs = []
-    1) While players is not empty, get the first player (highest standing) of
-    the current list:
-        first = A
-    2) Starting at players[1] (second player of the players list), linearly
-    search (that is, from highest to lowest score) for a player that hasn't
-    played against first:
-        first = A
-        i = 1  [A,-->B<--,C,D,E,F]   (example: already played)
-        i = 2  [A,B,-->C<--,D,E,F]   (example: already played)
-        i = 3  [A,B,C,-->D<--,E,F]   (example: match!)
-    3) Add the two players to the pairs list, and remove them from players list
-        pairs = [{A,D}]
-        players = [B,C,E,F]
-    4) Go to 1.
+    The pairing is done by the functions in pairing.py: by default, the Swiss
+    pairing engine, which groups the players by score and pairs each one with
+    the closest players in the standings he didn't play against yet. The match
+    history is loaded at once and checked in memory.
 
     Args:
         tournament: id of the tournament for which we're grouping players.
         players: list of players to match. The list must be even: to accept odd
         lists, the function should return the pairs plus the remaining player.
+        strategy: name of the pairing strategy, see pairing.STRATEGIES.
 
     Returns:
         A list of the paired players for the next round of matches.
-    """
-    # The numbers in the comments refer to the algorithm steps explained in
-    # the function description.
 
-    pairs = []                                          # 0
-    i = 0
-    while i < len(players):                             # 1
-        p = players[i]                                  # 1
-
-        i = i + 1                                       # 2
-        for j in range(i, len(players)):                # 2
-            q = players[j]                              # 2
-            if playedAgainst(tournament, p[0], q[0]):   # 2
-                continue                                # 2
-
-            players.remove(p)                           # 3
-            players.remove(q)                           # 3
-            #            ( id1, name1, id2, name2)
-            pairs.append((p[0], p[1], q[0], q[1]))      # 3
-
-            i = 0                                       # 4
-            break;                                      # 4
-    return pairs
+    Raises:
+        PairingError: if the players can't be completely paired without
+        rematches.
+        ValueError: if the strategy doesn't exist.
+    """
+    pairPlayers = getStrategy(strategy)
+    return pairPlayers(players, playedPairs(tournament))
@@ -14,16 +14,28 @@ DROP TABLE IF EXISTS players CASCADE;
 DROP TABLE IF EXISTS tournaments CASCADE;
 DROP TABLE IF EXISTS registry CASCADE;
 DROP TABLE IF EXISTS matches CASCADE;
+DROP TABLE IF EXISTS scores CASCADE;
 
 -- CREATE the tables we need;
 CREATE TABLE players (
     id          serial PRIMARY KEY,
-    name        varchar(20) NOT NULL
+    name        varchar(20) NOT NULL,
+    -- The name sanitized to be shown in HTML, see tournament.sanitize()
+    safe_name   text NOT NULL
 );
 
 CREATE TABLE tournaments (
     id          serial PRIMARY KEY,
-    name        varchar(20)
+    name        varchar(20),
+    -- Increased on every change of the registry or the matches of the
+    -- tournament, for optimistic concurrency checks (see tournament.py)
+    version     integer NOT NULL DEFAULT 0,
+    -- Points of each result, that rank the standings. For half points, like
+    -- chess, double all of them (2 for a win, 1 for a draw).
+    win_points  integer NOT NULL DEFAULT 1,
+    draw_points integer NOT NULL DEFAULT 0,
+    loss_points integer NOT NULL DEFAULT 0,
+    bye_points  integer NOT NULL DEFAULT 1
 );
 
 CREATE TABLE registry (
@@ -35,7 +47,7 @@ CREATE TABLE registry (
 );
 
 
--- !! This table has a trigger just after it
+-- !! This table has indexes just after it
 CREATE TABLE matches (
     tournament  integer NOT NULL REFERENCES tournaments(id) ON DELETE CASCADE,
     player1     integer NOT NULL REFERENCES players(id) ON DELETE CASCADE,
@@ -49,7 +61,7 @@ CREATE TABLE matches (
     CHECK (winner = player1 OR winner = player2 OR winner = NULL),
 
     -- compund key avoids repeating (T+P1+P2), but not inserting (T+P2+P1)
-    -- we avoid this second case with the trigger below
+    -- we avoid this second case with the unique index below
     PRIMARY KEY (tournament, player1, player2),
 
     -- These compound FK make sure players are registered into the tournament
@@ -57,103 +69,357 @@ CREATE TABLE matches (
     FOREIGN KEY (tournament, player2) REFERENCES registry(tournament, player)
 );
 
--- Trigger checks that a match between same players in different order doesn't
--- exist
--- Trigger info: http://www.postgresql.org/docs/9.2/static/plpgsql-trigger.html
-CREATE OR REPLACE FUNCTION check_match() RETURNS trigger AS $$
-BEGIN
-    -- Throw unique key violation if a match between the players, in different
-    -- order, alredy exists
-    IF EXISTS(SELECT * FROM matches
-            WHERE tournament = NEW.tournament
-            AND player1=NEW.player2 AND player2=NEW.player1)
-        THEN RAISE 'Players % and % already played in tournament %',
-            NEW.player2, NEW.player1, NEW.tournament
-        USING ERRCODE = 'unique_violation';
-    END IF;
-    RETURN NEW;
-END;
-$$ language plpgsql;
+-- A pair of players can only play once in a tournament, in any order: the
+-- index is on the normalized pair (lowest id, highest id)
+CREATE UNIQUE INDEX matches_pair ON matches
+    (tournament, LEAST(player1, player2), GREATEST(player1, player2));
 
-CREATE TRIGGER check_match BEFORE INSERT ON matches
-    FOR EACH ROW EXECUTE PROCEDURE check_match();
+-- The matches of a player are looked up by both sides (the primary key serves
+-- player1) and by winner
+CREATE INDEX matches_player2 ON matches (tournament, player2);
+CREATE INDEX matches_winner ON matches (tournament, winner);
 
 
 -- VIEWS
 
--- number of wins by player-tournament
-CREATE VIEW playerWins AS
-    -- for each player/tournament...
+-- wins, games, omw (opponent match wins), points and opp_points (points of
+-- the opponents) by player-tournament, computed from scratch with a single
+-- pass over the matches: each match is seen once from the side of each of
+-- its players.
+CREATE VIEW playerScores AS
+WITH results AS (
+    SELECT tournament, player1 AS player, player2 AS opponent, winner
+    FROM matches
+    UNION ALL
+    SELECT tournament, player2 AS player, player1 AS opponent, winner
+    FROM matches
+),
+-- wins (a bye counts as a win), games and points of each player
+-- Note: The left join lets us have rows with 0 games, whereas an inner
+-- join would only output rows with players with at least 1 game.
+totals AS (
     SELECT
-        r.player AS player,
         r.tournament AS tournament,
-        (r.bye + COUNT(m)) AS wins
-    FROM registry AS r
--- ...match the matches (ha!) he won
--- Note: The left join lets us have rows with 0 wins, whereas an inner
--- join would only output rows with players with at least 1 win.
-    LEFT JOIN matches AS m ON
-        r.tournament = m.tournament
-        AND m.winner = r.player
-    GROUP BY player, r.tournament, r.bye
-    ORDER BY r.tournament, player;
-
-
--- number of games by player-tournament
--- very similar to playerWins = not commented
-CREATE VIEW playerGames AS
-    SELECT
         r.player AS player,
-        r.tournament AS tournament,
-        COUNT(m) AS games
+        r.bye + COUNT(CASE WHEN x.winner = r.player THEN 1 END) AS wins,
+        COUNT(x.opponent) AS games,
+        r.bye * t.bye_points + COALESCE(SUM(CASE
+            WHEN x.opponent IS NULL THEN 0
+            WHEN x.winner = r.player THEN t.win_points
+            WHEN x.winner IS NULL THEN t.draw_points
+            ELSE t.loss_points END), 0) AS points
     FROM registry AS r
-    LEFT JOIN matches as m ON
-        r.tournament = m.tournament
-        AND (m.player1 = r.player OR m.player2 = r.player)
-    GROUP BY player, r.tournament
-    ORDER BY r.tournament, player;
+    INNER JOIN tournaments AS t ON t.id = r.tournament
+    LEFT JOIN results AS x
+        ON x.tournament = r.tournament AND x.player = r.player
+    GROUP BY r.tournament, r.player, r.bye, t.bye_points
+)
+-- the omw of each player is the sum of the wins of his opponents, and the
+-- opp_points the sum of their points
+SELECT
+    t.tournament AS tournament,
+    t.player AS player,
+    t.wins AS wins,
+    t.games AS games,
+    COALESCE(SUM(o.wins), 0) AS omw,
+    t.points AS points,
+    COALESCE(SUM(o.points), 0) AS opp_points,
+    rank() OVER (PARTITION BY t.tournament
+        ORDER BY t.points DESC, COALESCE(SUM(o.points), 0) DESC, t.games ASC)
+        AS place
+FROM totals AS t
+LEFT JOIN results AS x
+    ON x.tournament = t.tournament AND x.player = t.player
+LEFT JOIN totals AS o
+    ON o.tournament = x.tournament AND o.player = x.opponent
+GROUP BY t.tournament, t.player, t.wins, t.games, t.points;
 
 
--- number of OMW by player-tournament
-CREATE VIEW playerOMWs AS
-    -- for each player/tournament...
-    SELECT
-        r.player AS player,
-        r.tournament AS tournament,
-        COALESCE(SUM(pw.wins), 0) AS omws
-        -- note: coalesce puts a 0 when there'd be no pw.wins(sum=null)
-    FROM registry AS r
-    -- ... get matches where s/he played ...
-    LEFT JOIN matches AS m
-        ON r.tournament = m.tournament
-        AND r.player IN (m.player1, m.player2)
-    -- ... and match the opponent,so we SUM its .wins in the SELECT operator
-    LEFT JOIN playerWins AS pw
-        ON pw.tournament = m.tournament
-        AND pw.player IN (m.player1, m.player2)
-        AND pw.player != r.player
-    GROUP BY r.player, r.tournament
-    ORDER BY r.tournament, player;
-
-
--- This view just puts together the numbers from the 3 views that extract the
--- number of wins, games and omw.
+-- SCORES
+
+-- Materialized standings: wins, games, omw, points and opp_points of each
+-- player/tournament. The triggers below keep it up to date on every change
+-- of the registry and the matches, so reading the standings doesn't need to
+-- aggregate the matches.
+-- The playerScores view computes the same numbers from scratch, and is only
+-- used by rebuild_scores() to recover the table if it ever gets out of sync.
+CREATE TABLE scores (
+    tournament  integer NOT NULL,
+    player      integer NOT NULL,
+    wins        integer NOT NULL DEFAULT 0,
+    games       integer NOT NULL DEFAULT 0,
+    omw         integer NOT NULL DEFAULT 0,
+    points      integer NOT NULL DEFAULT 0,
+    opp_points  integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (tournament, player),
+    FOREIGN KEY (tournament, player) REFERENCES registry(tournament, player)
+        ON DELETE CASCADE
+);
+
+-- Adds wins and points to a player, and to the omw and opp_points of all the
+-- players he played against, with a single update. The opponent of a match
+-- that isn't inserted yet is passed explicitly (or NULL). The opponents are
+-- looked up by each side of the matches, so both lookups use an index.
+CREATE OR REPLACE FUNCTION add_result(t integer, p integer, opponent integer,
+        dwins integer, dpoints integer) RETURNS void AS $$
+BEGIN
+    IF dwins = 0 AND dpoints = 0 THEN
+        RETURN;
+    END IF;
+    UPDATE scores AS s SET
+        wins = s.wins + o.wins,
+        points = s.points + o.points,
+        omw = s.omw + o.omw,
+        opp_points = s.opp_points + o.opp_points
+    FROM (
+        SELECT p AS player, dwins AS wins, dpoints AS points, 0 AS omw,
+            0 AS opp_points
+        UNION ALL
+        SELECT player2, 0, 0, dwins, dpoints FROM matches
+            WHERE tournament = t AND player1 = p
+        UNION ALL
+        SELECT player1, 0, 0, dwins, dpoints FROM matches
+            WHERE tournament = t AND player2 = p
+        UNION ALL
+        SELECT opponent, 0, 0, dwins, dpoints WHERE opponent IS NOT NULL
+    ) AS o
+    WHERE s.tournament = t AND s.player = o.player;
+END;
+$$ language plpgsql;
+
+-- Subtracts a match from the scores of a player whose opponent is being
+-- deleted (see deletePlayers()): he loses the result of the match, which the
+-- opponents still registered also lose from their omw and opp_points, and
+-- the wins and points the deleted player had when he left the registry. The
+-- scores of the deleted player are left as they are, to be deleted with him.
+CREATE OR REPLACE FUNCTION remove_deleted_opponent(t integer, p integer,
+        deleted integer, dwins integer, dpoints integer) RETURNS void AS $$
+DECLARE
+    deletedWins integer;
+    deletedPoints integer;
+BEGIN
+    SELECT wins, points INTO deletedWins, deletedPoints FROM scores
+        WHERE tournament = t AND player = deleted;
+    UPDATE scores SET
+        wins = wins - dwins,
+        points = points - dpoints,
+        games = games - 1,
+        omw = omw - COALESCE(deletedWins, 0),
+        opp_points = opp_points - COALESCE(deletedPoints, 0)
+    WHERE tournament = t AND player = p;
+
+    IF dwins = 0 AND dpoints = 0 THEN
+        RETURN;
+    END IF;
+    UPDATE scores AS s SET
+        omw = s.omw - dwins,
+        opp_points = s.opp_points - dpoints
+    FROM (
+        SELECT player2 AS player FROM matches
+            WHERE tournament = t AND player1 = p
+        UNION ALL
+        SELECT player1 FROM matches
+            WHERE tournament = t AND player2 = p
+    ) AS o
+    WHERE s.tournament = t AND s.player = o.player AND o.player != deleted
+        AND EXISTS (SELECT 1 FROM registry AS r
+            WHERE r.tournament = t AND r.player = o.player);
+END;
+$$ language plpgsql;
+
+-- Adds the players to the scores when they enter a tournament, and updates
+-- their wins and points (and the omw and opp_points of their opponents) when
+-- they get a bye.
+CREATE OR REPLACE FUNCTION update_scores_on_registry() RETURNS trigger AS $$
+DECLARE
+    byePoints integer;
+BEGIN
+    SELECT bye_points INTO byePoints FROM tournaments
+        WHERE id = NEW.tournament;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO scores (tournament, player, wins, points)
+            VALUES (NEW.tournament, NEW.player, NEW.bye, NEW.bye * byePoints);
+    ELSIF NEW.bye != OLD.bye THEN
+        PERFORM add_result(NEW.tournament, NEW.player, NULL,
+            NEW.bye - OLD.bye, (NEW.bye - OLD.bye) * byePoints);
+    END IF;
+    RETURN NULL;
+END;
+$$ language plpgsql;
+
+CREATE TRIGGER update_scores_on_registry AFTER INSERT OR UPDATE ON registry
+    FOR EACH ROW EXECUTE PROCEDURE update_scores_on_registry();
+
+-- Updates the scores of the players of a match when it's added or removed.
+-- Matches are never updated, just inserted or deleted.
+-- It runs before the change, so each row of a multi-row statement sees the
+-- matches as if it was inserted or deleted alone: the ones before it in the
+-- statement are already changed, and the ones after it are not.
+CREATE OR REPLACE FUNCTION update_scores_on_match() RETURNS trigger AS $$
+DECLARE
+    m matches%ROWTYPE;
+    t tournaments%ROWTYPE;
+    registered1 boolean;
+    registered2 boolean;
+    wins1 integer := 0;
+    wins2 integer := 0;
+    points1 integer;
+    points2 integer;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        m := NEW;
+    ELSE
+        m := OLD;
+    END IF;
+
+    -- When the tournament is being deleted, its scores go away too
+    SELECT * INTO t FROM tournaments WHERE id = m.tournament;
+    IF NOT FOUND THEN
+        RETURN m;
+    END IF;
+
+    IF m.winner IS NULL THEN
+        points1 := t.draw_points;
+        points2 := t.draw_points;
+    ELSIF m.winner = m.player1 THEN
+        wins1 := 1;
+        points1 := t.win_points;
+        points2 := t.loss_points;
+    ELSE
+        wins2 := 1;
+        points1 := t.loss_points;
+        points2 := t.win_points;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        -- Each player adds the wins and points of the other to his omw and
+        -- opp_points, counted before the result of the match...
+        UPDATE scores AS s SET
+            games = s.games + 1,
+            omw = s.omw + o.wins,
+            opp_points = s.opp_points + o.points
+        FROM scores AS o
+        WHERE s.tournament = m.tournament AND o.tournament = m.tournament
+            AND ((s.player = m.player1 AND o.player = m.player2)
+                OR (s.player = m.player2 AND o.player = m.player1));
+
+        -- ... and then the result counts for all the opponents of each player
+        -- (this match isn't inserted yet, so the other player is passed).
+        PERFORM add_result(m.tournament, m.player1, m.player2, wins1, points1);
+        PERFORM add_result(m.tournament, m.player2, m.player1, wins2, points2);
+        RETURN m;
+    END IF;
+
+    -- A match deleted with one of its players only changes the scores of the
+    -- other one: the player deleted has already left the registry, and his
+    -- scores can't be updated anymore.
+    registered1 := EXISTS (SELECT 1 FROM registry
+        WHERE tournament = m.tournament AND player = m.player1);
+    registered2 := EXISTS (SELECT 1 FROM registry
+        WHERE tournament = m.tournament AND player = m.player2);
+    IF NOT registered1 OR NOT registered2 THEN
+        IF registered1 THEN
+            PERFORM remove_deleted_opponent(m.tournament, m.player1, m.player2,
+                wins1, points1);
+        ELSIF registered2 THEN
+            PERFORM remove_deleted_opponent(m.tournament, m.player2, m.player1,
+                wins2, points2);
+        END IF;
+        RETURN m;
+    END IF;
+
+    -- A deleted match is subtracted in the reverse order: first the result,
+    -- from the players and all their opponents (this match included)...
+    PERFORM add_result(m.tournament, m.player1, NULL, -wins1, -points1);
+    PERFORM add_result(m.tournament, m.player2, NULL, -wins2, -points2);
+
+    -- ... and then the wins and points of each player from the other
+    UPDATE scores AS s SET
+        games = s.games - 1,
+        omw = s.omw - o.wins,
+        opp_points = s.opp_points - o.points
+    FROM scores AS o
+    WHERE s.tournament = m.tournament AND o.tournament = m.tournament
+        AND ((s.player = m.player1 AND o.player = m.player2)
+            OR (s.player = m.player2 AND o.player = m.player1));
+    RETURN m;
+END;
+$$ language plpgsql;
+
+CREATE TRIGGER update_scores_on_match BEFORE INSERT OR DELETE ON matches
+    FOR EACH ROW EXECUTE PROCEDURE update_scores_on_match();
+
+-- Increases the version of the tournament of a changed entry or match.
+CREATE OR REPLACE FUNCTION bump_tournament_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE tournaments SET version = version + 1 WHERE id = OLD.tournament;
+    ELSE
+        UPDATE tournaments SET version = version + 1 WHERE id = NEW.tournament;
+    END IF;
+    RETURN NULL;
+END;
+$$ language plpgsql;
+
+CREATE TRIGGER bump_version_on_registry
+    AFTER INSERT OR UPDATE OR DELETE ON registry
+    FOR EACH ROW EXECUTE PROCEDURE bump_tournament_version();
+CREATE TRIGGER bump_version_on_match AFTER INSERT OR DELETE ON matches
+    FOR EACH ROW EXECUTE PROCEDURE bump_tournament_version();
+
+-- Notifies the new version of a changed tournament to the processes that
+-- LISTEN to tournament_version (payload 'id:version'), so they can drop the
+-- standings they cached. A deleted tournament is notified as one version
+-- newer than its last one.
+CREATE OR REPLACE FUNCTION notify_tournament_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('tournament_version', OLD.id || ':' || (OLD.version + 1));
+    ELSE
+        PERFORM pg_notify('tournament_version', NEW.id || ':' || NEW.version);
+    END IF;
+    RETURN NULL;
+END;
+$$ language plpgsql;
+
+CREATE TRIGGER notify_tournament_version
+    AFTER UPDATE OF version OR DELETE ON tournaments
+    FOR EACH ROW EXECUTE PROCEDURE notify_tournament_version();
+
+-- Recomputes the scores of a tournament (or of all of them, if NULL) from
+-- the registry and the matches
+CREATE OR REPLACE FUNCTION rebuild_scores(t integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM scores WHERE t IS NULL OR tournament = t;
+    INSERT INTO scores (tournament, player, wins, games, omw, points,
+            opp_points)
+        SELECT tournament, player, wins, games, omw, points, opp_points
+        FROM playerScores
+        WHERE t IS NULL OR tournament = t;
+    -- The scores may have changed, so the standings cached are no longer valid
+    UPDATE tournaments SET version = version + 1 WHERE t IS NULL OR id = t;
+END;
+$$ language plpgsql;
+
+
+-- This view just puts together the scores and the names of the players, in
+-- the order of the standings.
 CREATE VIEW standings AS
 SELECT
-    r.player as player,
-    p.name as name,
-    r.tournament AS tournament,
-    (SELECT wins FROM playerWins AS pw WHERE
-        r.player = pw.player AND r.tournament = pw.tournament) as wins,
-    (SELECT games FROM playerGames AS pg WHERE
-        r.player = pg.player AND r.tournament = pg.tournament) as games,
-    (SELECT omws FROM playerOMWs AS po WHERE
-        r.player = po.player AND r.tournament = po.tournament) as omw
-FROM registry AS r
-INNER JOIN players AS p ON r.player = p.id
+    s.player as player,
+    p.safe_name as name,
+    s.tournament AS tournament,
+    s.wins as wins,
+    s.games as games,
+    s.omw as omw,
+    s.points as points,
+    s.opp_points as opp_points
+FROM scores AS s
+INNER JOIN players AS p ON s.player = p.id
 ORDER BY
     tournament ASC, -- this order is just for easier human-reading
-    wins DESC,
-    omw DESC,
-    games ASC; -- ASC improves the pairing heurestic (vs DESC) to avoid giving
+    points DESC, -- with the default points, the same as wins and omw
+    opp_points DESC,
+    games ASC, -- ASC improves the pairing heurestic (vs DESC) to avoid giving
                -- a player 2 byes
+    player ASC; -- ties are always listed in the same order
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio version of tournament.py
+#
+# It has the same functions as tournament.py, as coroutines that use a pool of
+# asyncpg connections, so asyncio services can call them without a thread per
+# call. The SQL (queries.py) and the pairing (pairing.py) are the same as in
+# tournament.py. It requires Python 3.7+ and asyncpg. For example:
+#
+#     standings = await tournament_async.playerStandings(tournament)
+#
+
+import asyncio
+import re
+from contextlib import asynccontextmanager
+
+import asyncpg
+import bleach
+
+from pairing import checkResults, getStrategy
+from queries import *
+from tiebreakers import DEFAULT_POINTS
+
+
+# Settings of the pool of DB connections shared by all the module functions.
+# They can be changed before the first query, or by calling openPool().
+DSN = "postgresql:///tournament"
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+
+# Default pairing strategy of swissPairings(), see pairing.STRATEGIES.
+PAIRING_STRATEGY = 'swiss'
+
+# Raised when a change breaks the rules of the DB schema, like a rematch.
+IntegrityError = asyncpg.IntegrityConstraintViolationError
+
+# Names that bleach returns unchanged, see tournament.sanitize().
+_PLAIN_NAME = re.compile(r"[ -%'-;=?-~]*\Z")
+
+_pool = None
+_poolLock = None
+
+
+class VersionError(ValueError):
+    """Raised when a tournament changed since the version the caller expected
+    (the same cases as tournament.VersionError)."""
+
+
+# The following functions manage the pool of connections to the DB.
+
+async def openPool(minSize = None, maxSize = None):
+    """Opens the pool of connections, closing the current one if any.
+
+    It's not required to call this function: the pool is opened on demand
+    with POOL_MIN_SIZE and POOL_MAX_SIZE the first time it's needed.
+
+    Args:
+        minSize: connections opened right away and kept open while idle.
+        maxSize: maximum number of connections open at the same time.
+    """
+    global _pool
+    async with _getPoolLock():
+        if _pool is not None:
+            await _pool.close()
+        _pool = await asyncpg.create_pool(
+            DSN,
+            min_size=POOL_MIN_SIZE if minSize is None else minSize,
+            max_size=POOL_MAX_SIZE if maxSize is None else maxSize)
+
+async def closePool():
+    """Closes all the connections of the pool. The next query reopens it."""
+    global _pool
+    async with _getPoolLock():
+        if _pool is not None:
+            pool, _pool = _pool, None
+            await pool.close()
+
+async def getPool():
+    """Returns the pool of connections, opening it if needed."""
+    global _pool
+    if _pool is None:
+        async with _getPoolLock():
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    DSN, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE)
+    return _pool
+
+def _getPoolLock():
+    """Returns the lock of the pool. It's created on first use, so it belongs
+    to the running event loop."""
+    global _poolLock
+    if _poolLock is None:
+        _poolLock = asyncio.Lock()
+    return _poolLock
+
+
+# The following functions implement reusable code to interact with the DB.
+
+async def execute(query, values = (), returning = False):
+    """Does an Insert or an Update into the database.
+
+    Args:
+        query: insert or update to execute, with %s placeholders
+        values: sequence with the values that go into the query
+        returning: whether the query has a Returning operator
+
+    Returns:
+        If and only if returning=True, returns the value of the Returning
+        operator.
+    """
+    pool = await getPool()
+    async with pool.acquire() as conn:
+        if returning:
+            return await conn.fetchval(numbered(query), *values)
+        await conn.execute(numbered(query), *values)
+
+async def fetchone(query, values = ()):
+    """Alias to call the fetch function when we want only 1 resulting row"""
+    return await fetch(query, values, True)
+
+async def fetch(query, values = (), singlerow = False):
+    """Does a SELECT or COUNT to the database.
+
+    Args:
+        query: select or count to execute, with %s placeholders
+        values: sequence with the values that go into the query
+        singlerow: whether we want only one row or an arbitrary number
+
+    Returns:
+        The result of the query, as asyncpg records (which can be indexed
+        like tuples). If singlerow=True, returns only the first matched row.
+    """
+    pool = await getPool()
+    async with pool.acquire() as conn:
+        if singlerow:
+            return await conn.fetchrow(numbered(query), *values)
+        return await conn.fetch(numbered(query), *values)
+
+@asynccontextmanager
+async def tournamentTransaction(tournament, version = None):
+    """Async context manager for a transaction that changes a tournament, with
+    the same lock and version check as tournament.tournamentTransaction().
+
+    Example:
+        async with tournamentTransaction(tournament, version) as conn:
+            await conn.execute(...)
+
+    Raises:
+        VersionError: if the tournament is not at the expected version.
+    """
+    pool = await getPool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(numbered(LOCK_TOURNAMENT), TOURNAMENT_LOCK,
+                               tournament)
+            if version is not None:
+                current = await conn.fetchval(numbered(TOURNAMENT_VERSION),
+                                              tournament)
+                if current != version:
+                    raise VersionError(
+                        "Tournament %s is at version %s instead of %s" %
+                        (tournament, current, version))
+            yield conn
+
+
+# The following functions clean tables from the DB.
+
+async def deletePlayers():
+    """Remove all the player records from the database."""
+    await execute("DELETE FROM players;")
+
+async def deleteTournaments():
+    """Remove all the tournament records from the database."""
+    await execute("DELETE FROM tournaments;")
+
+async def deleteRegistry():
+    """Remove all the registry records from the database."""
+    await execute("DELETE FROM registry;")
+
+async def deleteMatches():
+    """Remove all the match records from the database."""
+    await execute("DELETE FROM matches;")
+
+
+# The following functions count elements in tables.
+
+async def countPlayers():
+    """Returns the number of players currently registered."""
+    return (await fetchone(COUNT_PLAYERS))[0]
+
+async def countTournaments():
+    """Returns the number of tournaments currently registered."""
+    return (await fetchone(COUNT_TOURNAMENTS))[0]
+
+
+# The following functions register (insert/update) things in the DB.
+
+def sanitize(name):
+    """Returns a name safe to be shown in HTML, as tournament.sanitize()."""
+    if _PLAIN_NAME.match(name):
+        return name
+    return str(bleach.clean(name))
+
+async def registerPlayer(name):
+    """Adds a player, and returns its id."""
+    return await execute(REGISTER_PLAYER, [name, sanitize(name)], True)
+
+async def registerTournament(name, points = None):
+    """Adds a tournament, and returns its id. points is a tuple (win, draw,
+    loss, bye) with the points of each result, see
+    tournament.registerTournament()."""
+    return await execute(REGISTER_TOURNAMENT,
+                         [name] + list(points or DEFAULT_POINTS), True)
+
+async def registerEntry(player, tournament):
+    """Adds a player to a tournament."""
+    await execute(REGISTER_ENTRY, [player, tournament])
+
+async def importPlayers(names, tournament = None):
+    """Adds many players, and optionally enters them in a tournament, with
+    COPY in a single transaction.
+
+    Args:
+        names: iterable with the players' full names.
+        tournament: the id of the tournament the players enter, or None.
+
+    Returns:
+        The list of ids of the players created, in the same order as names.
+    """
+    names = list(names)
+    pool = await getPool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            ids = [row[0] for row in await conn.fetch("""
+                SELECT nextval(pg_get_serial_sequence('players', 'id'))
+                FROM generate_series(1, $1);
+            """, len(names))]
+            await conn.copy_records_to_table(
+                'players', columns=('id', 'name', 'safe_name'),
+                records=[(player, name, sanitize(name))
+                         for (player, name) in zip(ids, names)])
+            if tournament is not None:
+                await conn.copy_records_to_table(
+                    'registry', columns=('player', 'tournament'),
+                    records=[(player, tournament) for player in ids])
+        if ids:
+            await conn.execute(ANALYZE_PLAYERS)
+    return ids
+
+async def reportMatch(tournament, player1, player2, winner):
+    """Records the outcome of a single match between two players (winner is
+    None if a draw)."""
+    await execute(REPORT_MATCH, [tournament, player1, player2, winner])
+
+async def reportMatches(tournament, results, version = None):
+    """Records the outcome of all the matches of a round at once, in a single
+    transaction. If any match is wrong, no match is recorded.
+
+    Args:
+        tournament: the id of the tournament
+        results: list of (player1, player2, winner) tuples.
+        version: if given, the results are only recorded if the tournament is
+        still at this version (see tournamentVersion()).
+
+    Raises:
+        ValueError: if two results are for the same players, or a pair of
+        players already played, or a winner didn't play the match.
+        VersionError: if the tournament is not at the given version.
+    """
+    results = list(results)
+    if not results:
+        return
+
+    async with tournamentTransaction(tournament, version) as conn:
+        played = set((row[0], row[1]) for row in
+                     await conn.fetch(numbered(PLAYED_PAIRS), tournament))
+        checkResults(results, played)
+        await conn.executemany(
+            numbered(REPORT_MATCH),
+            [(tournament, player1, player2, winner)
+             for (player1, player2, winner) in results])
+
+async def assignBye(tournament, player):
+    """Assigns a bye to a player (a bye counts as a free win)."""
+    await execute(ASSIGN_BYE, [tournament, player])
+
+async def rebuildStandings(tournament = None):
+    """Recomputes the scores of a tournament, or all of them if None."""
+    await execute("SELECT rebuild_scores(%s);", [tournament])
+
+
+# The following functions read (select) info from the database.
+
+async def playerStandings(tournament):
+    """Returns, for the given tournament, a list of tuples (id, name, wins,
+    matches, omw) sorted by points, then points of the opponents, then number
+    of games."""
+    return [tuple(row) for row in await fetch(STANDINGS, [tournament])]
+
+async def tournamentVersion(tournament):
+    """Returns the version of a tournament (see tournament.tournamentVersion()),
+    or None if it doesn't exist."""
+    row = await fetchone(TOURNAMENT_VERSION, [tournament])
+    return row and row[0]
+
+async def swissPairings(tournament, strategy = PAIRING_STRATEGY,
+                        version = None):
+    """Returns a list of pairs (id1, name1, id2, name2) of players for the next
+    round of a match, in a transaction with the lock of the tournament. With
+    an odd number of players, the last one is granted a free bye.
+
+    The pairing itself runs in the default executor, so pairing a big
+    tournament doesn't block the event loop.
+
+    Raises:
+        PairingError: if the players can't be completely paired without
+        rematches. No bye is assigned in that case.
+        ValueError: if the strategy doesn't exist.
+        VersionError: if the tournament is not at the given version.
+    """
+    pairPlayers = getStrategy(strategy)
+    async with tournamentTransaction(tournament, version) as conn:
+        rows = [tuple(row) for row in
+                await conn.fetch(numbered(PAIRING_STANDINGS), tournament)]
+        played = set((row[0], row[1]) for row in
+                     await conn.fetch(numbered(PLAYED_PAIRS), tournament))
+
+        # Leave out the last player if number of players is odd
+        lastPlayer = None
+        if len(rows) % 2 != 0:
+            lastPlayer = rows.pop()
+
+        # Pair the players first, so no bye is assigned if the pairing fails
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, pairPlayers, rows, played)
+
+        if lastPlayer is not None:
+            await conn.execute(numbered(ASSIGN_BYE), tournament, lastPlayer[0])
+    return result
+
+async def playedAgainst(tournament, player1, player2):
+    """Checks if two players have already played against each other in the
+    given tournament."""
+    row = await fetchone(PLAYED_AGAINST,
+                         [tournament, player1, player2, player2, player1])
+    return row[0]
+
+async def playedPairs(tournament):
+    """Returns the set of pairKey() of the players that already played in the
+    given tournament."""
+    return set((row[0], row[1]) for row in
+               await fetch(PLAYED_PAIRS, [tournament]))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Test cases for tournament_async.py
+#
+# They need Python 3.7+ and asyncpg, and are skipped without them. They use
+# the same DB as tournament_test.py (see tournament.sql).
+
+import asyncio
+import sys
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+if asyncpg is not None:
+    from tournament_async import *
+
+
+async def testImportPlayers():
+    tid = await registerTournament("Test Async Import")
+    players = await countPlayers()
+    names = ["Ana", "Bruno", "<script>Carla", ""]
+    ids = await importPlayers(names, tid)
+    if len(ids) != 4 or len(set(ids)) != 4:
+        raise ValueError("importPlayers() should return an id per player.")
+    if await countPlayers() != players + 4:
+        raise ValueError("importPlayers() should add all the players.")
+    standings = await playerStandings(tid)
+    safeNames = dict((row[0], row[1]) for row in standings)
+    if [safeNames.get(i) for i in ids] != [sanitize(name) for name in names]:
+        raise ValueError("Imported players should enter the tournament.")
+    if "<script>" in safeNames[ids[2]]:
+        raise ValueError("Imported names should be sanitized.")
+    if [row[2:4] for row in standings] != [(0, 0)] * 4:
+        raise ValueError("Imported players should have no matches.")
+    if await importPlayers([], tid) != []:
+        raise ValueError("Importing no players should do nothing.")
+    print("1. Players can be imported in bulk into a tournament.")
+
+
+async def testReportMatches():
+    tid = await registerTournament("Test Async Round")
+    [id1, id2, id3, id4, id5, id6] = await importPlayers(
+        ["R1", "R2", "R3", "R4", "R5", "R6"], tid)
+    await reportMatches(tid, [(id1, id2, id1), (id3, id4, None),
+                              (id5, id6, id6)])
+    standings = dict((row[0], row[2:4]) for row in await playerStandings(tid))
+    if standings != {id1: (1, 1), id2: (0, 1), id3: (0, 1), id4: (0, 1),
+                     id5: (0, 1), id6: (1, 1)}:
+        raise ValueError("After a round, players should have their wins and "
+                         "matches updated.")
+
+    # A rematch in the next round rejects the whole round
+    try:
+        await reportMatches(tid, [(id1, id3, id1), (id6, id5, id5)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A rematch should be rejected.")
+    if len(await playedPairs(tid)) != 3:
+        raise ValueError("A rejected round should not record any match.")
+    print("2. A whole round can be reported at once, and rematches rejected.")
+
+
+async def testOddPlayers():
+    tid = await registerTournament("Test Async Odd")
+    ids = await importPlayers(["O%d" % i for i in range(5)], tid)
+    pairings = await swissPairings(tid)
+    paired = [p[0] for p in pairings] + [p[2] for p in pairings]
+    if len(pairings) != 2 or len(set(paired)) != 4:
+        raise ValueError("With 5 players, there should be 2 pairs.")
+    [bye] = set(ids) - set(paired)
+    standings = dict((row[0], row[2:4]) for row in await playerStandings(tid))
+    if standings[bye][0] != 1:
+        raise ValueError("The player left out should get a bye.")
+    print("3. With odd #players, the player left out receives a bye.")
+
+
+async def testVersions():
+    tid = await registerTournament("Test Async Version")
+    await importPlayers(["V%d" % i for i in range(5)], tid)
+    version = await tournamentVersion(tid)
+    try:
+        async with tournamentTransaction(tid, version + 1):
+            pass
+    except VersionError:
+        pass
+    else:
+        raise ValueError("A transaction of another version should fail.")
+
+    # The bye of the pairing changes the version of the tournament
+    pairings = await swissPairings(tid, version=version)
+    results = [(id1, id2, id1) for (id1, n1, id2, n2) in pairings]
+    try:
+        await reportMatches(tid, results, version)
+    except VersionError:
+        pass
+    else:
+        raise ValueError("Results of an old version should be rejected.")
+    if await playedPairs(tid):
+        raise ValueError("Rejected results should not be recorded.")
+    await reportMatches(tid, results, await tournamentVersion(tid))
+    print("4. Rounds of an old version fail with VersionError.")
+
+
+async def main():
+    try:
+        await testImportPlayers()
+        await testReportMatches()
+        await testOddPlayers()
+        await testVersions()
+    finally:
+        await closePool()
+
+
+if __name__ == '__main__':
+    if asyncpg is None:
+        print("Skipped: tournament_async.py needs asyncpg.")
+        sys.exit(0)
+    asyncio.run(main())
+    print("Success!  All tests pass!")
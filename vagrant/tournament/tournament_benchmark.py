@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#
+# tournament_benchmark.py -- benchmark of the tournament functions
+#
+# Plays synthetic tournaments (players, rounds and random results) and times
+# each phase of them. The results are printed as JSON lines, one per size and
+# phase, so they can be compared across changes. For example:
+#
+#     python tournament_benchmark.py --sizes 64,1000 --backend memory
+#
+# With --played-against, a playedAgainst phase checks every pair of each
+# round, like a pairing loop that asks the DB about each candidate pair.
+# Compared with --no-prepare, it shows the time saved by the prepared
+# statements. It's not part of a round, so it's left out of the 'total'.
+#
+
+import argparse
+import json
+import math
+import random
+import sys
+import timeit
+from collections import OrderedDict
+
+from backend import BACKENDS, getBackend
+
+
+# Number of players of the tournaments benchmarked by default.
+BENCHMARK_SIZES = [64, 1000, 10000]
+
+# Probability of a draw in the random results.
+DRAW_PROBABILITY = 0.1
+
+FIRST_NAMES = ["Ana", "Bruno", "Carla", "Dario", "Elena", "Fabio", "Gala",
+               "Hugo", "Irene", "Jon", "Karen", "Luis", "Marta", "Nico"]
+LAST_NAMES = ["Walton", "Chandra", "Adams", "Ortiz", "Novak", "Sato",
+              "Keller", "Moreau", "Silva", "Rossi", "Berg", "Costa"]
+
+
+class Timer(object):
+    """Accumulates the time and number of calls of each phase."""
+
+    def __init__(self):
+        self.phases = OrderedDict()
+
+    def time(self, phase, function, *args):
+        """Calls a function, adding its time to the phase. Returns its result."""
+        start = timeit.default_timer()
+        result = function(*args)
+        elapsed = timeit.default_timer() - start
+        calls, seconds = self.phases.get(phase, (0, 0.0))
+        self.phases[phase] = (calls + 1, seconds + elapsed)
+        return result
+
+
+class SyntheticEvent(object):
+    """Random but reproducible tournament: names of the players, number of
+    rounds and results of the matches.
+
+    Args:
+        players: number of players.
+        rounds: number of rounds, or None for the usual number in a Swiss
+        tournament (log2 of the number of players, rounded up).
+        seed: seed of the random generator.
+    """
+
+    def __init__(self, players, rounds = None, seed = 0):
+        self.players = players
+        self.rounds = rounds or max(1, int(math.ceil(math.log(players, 2))))
+        self.random = random.Random(seed)
+
+    def names(self):
+        """Generates the names of the players."""
+        for i in range(self.players):
+            yield "%s %s" % (self.random.choice(FIRST_NAMES),
+                             self.random.choice(LAST_NAMES))
+
+    def result(self, player1, player2):
+        """Returns the winner of a match between two players, None if draw."""
+        if self.random.random() < DRAW_PROBABILITY:
+            return None
+        return self.random.choice([player1, player2])
+
+
+def runBenchmark(tournament, event, bulk = False, playedAgainst = False):
+    """Plays a synthetic event, timing each phase.
+
+    Args:
+        tournament: the tournament backend (see backend.getBackend()).
+        event: the SyntheticEvent to play.
+        bulk: register the players with importPlayers() and report the
+        rounds with reportMatches(), instead of one by one.
+        playedAgainst: also time playedAgainst() for every pair of each
+        round, in a phase that is not counted in the 'total'.
+
+    Returns:
+        A Timer with the time of each phase, and the 'total' of all of them
+        but playedAgainst.
+    """
+    timer = Timer()
+    start = timeit.default_timer()
+    tid = tournament.registerTournament("Benchmark")
+
+    if bulk:
+        timer.time('importPlayers', tournament.importPlayers, event.names(), tid)
+    else:
+        for name in event.names():
+            player = timer.time('registerPlayer', tournament.registerPlayer,
+                                name)
+            timer.time('registerEntry', tournament.registerEntry, player, tid)
+
+    for r in range(event.rounds):
+        pairs = timer.time('swissPairings', tournament.swissPairings, tid)
+        if playedAgainst:
+            checking = timeit.default_timer()
+            for (id1, name1, id2, name2) in pairs:
+                timer.time('playedAgainst', tournament.playedAgainst, tid,
+                           id1, id2)
+            start += timeit.default_timer() - checking
+        results = [(id1, id2, event.result(id1, id2))
+                   for (id1, name1, id2, name2) in pairs]
+        if bulk:
+            timer.time('reportMatches', tournament.reportMatches, tid, results)
+        else:
+            for (player1, player2, winner) in results:
+                timer.time('reportMatch', tournament.reportMatch, tid,
+                           player1, player2, winner)
+        timer.time('playerStandings', tournament.playerStandings, tid)
+
+    timer.phases['total'] = (1, timeit.default_timer() - start)
+    return timer
+
+def results(timer, backend, event, bulk, prepared = None):
+    """Generates the records of the results of a benchmark. prepared is
+    whether the backend used prepared statements (None if it has no DB)."""
+    for (phase, (calls, seconds)) in timer.phases.items():
+        yield OrderedDict([
+            ('backend', backend),
+            ('players', event.players),
+            ('rounds', event.rounds),
+            ('bulk', bulk),
+            ('prepared', prepared),
+            ('phase', phase),
+            ('calls', calls),
+            ('seconds', round(seconds, 6)),
+            ('perCall', round(seconds / calls, 9)),
+        ])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the tournament functions.")
+    parser.add_argument('--sizes', default=",".join(map(str, BENCHMARK_SIZES)),
+                        help="comma separated numbers of players")
+    parser.add_argument('--rounds', type=int, default=None,
+                        help="number of rounds (default: log2 of players)")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=None,
+                        help="tournament backend (default: TOURNAMENT_BACKEND)")
+    parser.add_argument('--bulk', action='store_true',
+                        help="use importPlayers() and reportMatches()")
+    parser.add_argument('--no-prepare', action='store_true',
+                        help="don't use prepared statements")
+    parser.add_argument('--played-against', action='store_true',
+                        help="also time playedAgainst() for every pair")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout, help="file of the JSON lines")
+    args = parser.parse_args(argv)
+
+    tournament = getBackend(args.backend)
+    backend = [name for (name, module) in BACKENDS.items()
+               if module == tournament.__name__][0]
+    if args.no_prepare and hasattr(tournament, 'PREPARE_QUERIES'):
+        tournament.PREPARE_QUERIES = False
+    prepared = getattr(tournament, 'PREPARE_QUERIES', None)
+    for size in [int(s) for s in args.sizes.split(",")]:
+        event = SyntheticEvent(size, args.rounds, args.seed)
+        timer = runBenchmark(tournament, event, args.bulk,
+                             args.played_against)
+        for record in results(timer, backend, event, args.bulk, prepared):
+            args.output.write(json.dumps(record) + "\n")
+        args.output.flush()
+
+
+if __name__ == '__main__':
+    main()
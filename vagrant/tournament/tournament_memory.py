@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+#
+# tournament_memory.py -- in-memory implementation of tournament.py
+#
+# It has the same functions as tournament.py, but keeps everything in memory
+# instead of a PostgreSQL database, so it's suitable for simulations and
+# what-if pairings. The rules enforced by the DB schema are checked here, and
+# their violations raise IntegrityError.
+#
+
+import csv
+import threading
+from array import array
+
+import bleach
+
+from export import writeStandings
+from pairing import checkResults, getStrategy, pairKey
+from tiebreakers import DEFAULT_POINTS, DEFAULT_TIEBREAKERS, tiebreakRows
+
+
+# Default pairing strategy of swissPairings(), see pairing.STRATEGIES.
+PAIRING_STRATEGY = 'swiss'
+
+
+class IntegrityError(ValueError):
+    """Raised when a change would break the rules of the DB schema (the same
+    cases where tournament.py raises psycopg2.IntegrityError)."""
+
+
+class VersionError(ValueError):
+    """Raised when a tournament changed since the version the caller expected
+    (the same cases as tournament.VersionError)."""
+
+
+class Tournament(object):
+    """Registry, matches and scores of a tournament.
+
+    The registered players are numbered by their order of entry (their slot),
+    and their byes and scores are kept in arrays indexed by slot. The scores
+    are updated on every change, like the scores table of tournament.sql.
+
+    Args:
+        name: the tournament's name.
+        points: tuple (win, draw, loss, bye) with the points of each result.
+    """
+
+    def __init__(self, name, points = None):
+        self.name = name
+        self.points = tuple(points or DEFAULT_POINTS)
+        self.version = 0            # increased on every change
+        self.reset()
+
+    def reset(self):
+        """Sets the tournament without players nor matches."""
+        self.slots = {}             # player id -> slot
+        self.players = array('l')   # slot -> player id
+        self.byes = array('l')
+        self.wins = array('l')
+        self.games = array('l')
+        self.omw = array('l')
+        self.score = array('l')     # points
+        self.oppPoints = array('l')
+        self.opponents = []         # slot -> array of the slots he played
+        self.matches = []           # (player1, player2, winner) by player id
+        self.played = set()         # pairKey() of the players that played
+        self.standings = None       # sorted slots, until the next change
+
+    def clearRegistry(self):
+        """Removes all the players from the tournament, with their matches."""
+        self.reset()
+        self.version += 1
+
+    def register(self, player):
+        """Adds a player to the tournament."""
+        if player in self.slots:
+            raise IntegrityError("Player %s is already registered" % player)
+        self.slots[player] = len(self.players)
+        self.players.append(player)
+        for scores in (self.byes, self.wins, self.games, self.omw,
+                       self.score, self.oppPoints):
+            scores.append(0)
+        self.opponents.append(array('l'))
+        self.standings = None
+        self.version += 1
+
+    def slot(self, player):
+        """Returns the slot of a player, who must be registered."""
+        if player not in self.slots:
+            raise IntegrityError("Player %s is not registered" % player)
+        return self.slots[player]
+
+    def checkMatch(self, player1, player2, winner):
+        """Checks that a match can be added."""
+        self.slot(player1)
+        self.slot(player2)
+        if player1 == player2:
+            raise IntegrityError("Player %s can't play against himself" %
+                                 player1)
+        if winner not in (player1, player2, None):
+            raise IntegrityError("Winner %s didn't play the match" % winner)
+        if pairKey(player1, player2) in self.played:
+            raise IntegrityError("Players %s and %s already played" %
+                                 (player1, player2))
+
+    def addMatch(self, player1, player2, winner):
+        """Adds a match, updating the scores of the players."""
+        self.checkMatch(player1, player2, winner)
+        s1 = self.slots[player1]
+        s2 = self.slots[player2]
+        self.matches.append((player1, player2, winner))
+        self.played.add(pairKey(player1, player2))
+
+        # Each player adds the wins and points of the other to his omw and
+        # opp points, and then the result counts for all the opponents of
+        # each player.
+        self.omw[s1] += self.wins[s2]
+        self.omw[s2] += self.wins[s1]
+        self.oppPoints[s1] += self.score[s2]
+        self.oppPoints[s2] += self.score[s1]
+        self.games[s1] += 1
+        self.games[s2] += 1
+        self.opponents[s1].append(s2)
+        self.opponents[s2].append(s1)
+        win, draw, loss, bye = self.points
+        if winner is None:
+            self.addResult(s1, 0, draw)
+            self.addResult(s2, 0, draw)
+        else:
+            self.addResult(self.slots[winner], 1, win)
+            self.addResult(s2 if winner == player1 else s1, 0, loss)
+        self.standings = None
+        self.version += 1
+
+    def addResult(self, slot, wins, points):
+        """Adds wins (or byes) and points to a player, and to the omw and opp
+        points of his opponents."""
+        if not wins and not points:
+            return
+        self.wins[slot] += wins
+        self.score[slot] += points
+        for opponent in self.opponents[slot]:
+            self.omw[opponent] += wins
+            self.oppPoints[opponent] += points
+        self.standings = None
+
+    def clearMatches(self):
+        """Removes all the matches, leaving just the byes as scores."""
+        self.matches = []
+        self.played = set()
+        for slot in range(len(self.players)):
+            self.wins[slot] = self.byes[slot]
+            self.score[slot] = self.byes[slot] * self.points[3]
+            self.games[slot] = 0
+            self.omw[slot] = 0
+            self.oppPoints[slot] = 0
+            self.opponents[slot] = array('l')
+        self.standings = None
+        self.version += 1
+
+    def rebuild(self):
+        """Recomputes the scores from the byes and the matches."""
+        matches, version = self.matches, self.version
+        self.clearMatches()
+        for (player1, player2, winner) in matches:
+            self.addMatch(player1, player2, winner)
+        self.version = version
+
+    def checkVersion(self, version):
+        """Checks that the tournament is at the version, if not None."""
+        if version is not None and version != self.version:
+            raise VersionError("Tournament %s is at version %s instead of %s" %
+                               (self.name, self.version, version))
+
+    def sortedSlots(self):
+        """Returns the slots sorted by standings: points, then opp points,
+        then number of games, then id. The result is kept until the next
+        change."""
+        if self.standings is None:
+            score, oppPoints, games, players = (self.score, self.oppPoints,
+                                                self.games, self.players)
+            self.standings = sorted(
+                range(len(players)),
+                key=lambda s: (-score[s], -oppPoints[s], games[s], players[s]))
+        return self.standings
+
+
+# All the data, as the tables of tournament.sql
+_lock = threading.RLock()
+_players = {}           # id -> name
+_tournaments = {}       # id -> Tournament
+_sequences = {'players': 0, 'tournaments': 0}
+
+
+def _nextId(table):
+    """Returns the next id of a table, as a serial column would."""
+    _sequences[table] += 1
+    return _sequences[table]
+
+def _tournament(tournament):
+    """Returns the Tournament with the given id."""
+    if tournament not in _tournaments:
+        raise IntegrityError("Tournament %s doesn't exist" % tournament)
+    return _tournaments[tournament]
+
+
+# The following functions clean the data.
+
+def deletePlayers():
+    """Remove all the player records, with their entries and matches."""
+    with _lock:
+        _players.clear()
+        for t in _tournaments.values():
+            t.clearRegistry()
+
+def deleteTournaments():
+    """Remove all the tournament records, with their entries and matches."""
+    with _lock:
+        _tournaments.clear()
+
+def deleteRegistry():
+    """Remove all the registry records. It fails if there are matches."""
+    with _lock:
+        if any(t.matches for t in _tournaments.values()):
+            raise IntegrityError("Players with matches can't be unregistered")
+        for t in _tournaments.values():
+            t.clearRegistry()
+
+def deleteMatches():
+    """Remove all the match records."""
+    with _lock:
+        for t in _tournaments.values():
+            t.clearMatches()
+
+
+# The following functions count elements.
+
+def countPlayers():
+    """Returns the number of players currently registered."""
+    return len(_players)
+
+def countTournaments():
+    """Returns the number of tournaments currently registered."""
+    return len(_tournaments)
+
+
+# The following functions register things.
+
+def registerPlayer(name):
+    """Adds a player, and returns its id. The name is bleached."""
+    with _lock:
+        player = _nextId('players')
+        _players[player] = str(bleach.clean(name))
+        return player
+
+def registerTournament(name, points = None):
+    """Adds a tournament, and returns its id. points is a tuple (win, draw,
+    loss, bye) with the points of each result, see
+    tournament.registerTournament()."""
+    with _lock:
+        tournament = _nextId('tournaments')
+        _tournaments[tournament] = Tournament(name, points)
+        return tournament
+
+def registerEntry(player, tournament):
+    """Adds a player to a tournament."""
+    with _lock:
+        if player not in _players:
+            raise IntegrityError("Player %s doesn't exist" % player)
+        _tournament(tournament).register(player)
+
+def importPlayers(names, tournament = None, batchSize = None):
+    """Adds many players, and optionally enters them in a tournament.
+
+    Args:
+        names: iterable with the players' full names.
+        tournament: the id of the tournament the players enter, or None.
+        batchSize: ignored, kept for compatibility with tournament.py.
+
+    Returns:
+        The list of ids of the players created, in the same order as names.
+    """
+    with _lock:
+        ids = [registerPlayer(name) for name in names]
+        if tournament is not None:
+            for player in ids:
+                registerEntry(player, tournament)
+        return ids
+
+def readPlayersCsv(csvfile):
+    """Reads the names of players from a CSV file with a 'name' column."""
+    for row in csv.DictReader(csvfile):
+        yield row['name']
+
+def reportMatch(tournament, player1, player2, winner):
+    """Records the outcome of a single match between two players.
+
+    Raises:
+        IntegrityError: if the winner is not one of the players, or they
+        already played, or they're not registered in the tournament.
+    """
+    with _lock:
+        _tournament(tournament).addMatch(player1, player2, winner)
+
+def reportMatches(tournament, results, version = None):
+    """Records the outcome of all the matches of a round at once. If any
+    match is wrong, no match is recorded.
+
+    Args:
+        tournament: the id of the tournament
+        results: list of (player1, player2, winner) tuples.
+
+    Raises:
+        ValueError: if two results are for the same players, or a pair of
+        players already played, or a winner didn't play the match.
+        VersionError: if the tournament is not at the given version.
+    """
+    with _lock:
+        t = _tournament(tournament)
+        t.checkVersion(version)
+        results = list(results)
+        checkResults(results, t.played)
+        for (player1, player2, winner) in results:
+            t.checkMatch(player1, player2, winner)
+        for (player1, player2, winner) in results:
+            t.addMatch(player1, player2, winner)
+
+def assignBye(tournament, player):
+    """Assigns a bye to a player (a bye counts as a free win).
+
+    Raises:
+        IntegrityError: if the player already had a bye in the tournament.
+    """
+    with _lock:
+        t = _tournament(tournament)
+        if player not in t.slots:
+            return
+        slot = t.slots[player]
+        if t.byes[slot] > 0:
+            raise IntegrityError("Player %s already had a bye" % player)
+        t.byes[slot] += 1
+        t.addResult(slot, 1, t.points[3])
+        t.version += 1
+
+def rebuildStandings(tournament = None):
+    """Recomputes the scores of a tournament, or all of them if None."""
+    with _lock:
+        if tournament is None:
+            tournaments = list(_tournaments.values())
+        else:
+            tournaments = [_tournament(tournament)]
+        for t in tournaments:
+            t.rebuild()
+
+
+# The following functions read info.
+
+def playerStandings(tournament):
+    """Returns, for the given tournament, a list of tuples (id, name, wins,
+    matches, omw) sorted by points, then points of the opponents, then number
+    of games."""
+    with _lock:
+        t = _tournament(tournament)
+        return [(t.players[s], _players[t.players[s]], t.wins[s], t.games[s],
+                 t.omw[s]) for s in t.sortedSlots()]
+
+def tiebreakStandings(tournament, tiebreakers = DEFAULT_TIEBREAKERS):
+    """Returns the standings of a tournament as tuples (id, name, points,
+    matches, tiebreaker1, ...), ranked with the given tiebreakers after the
+    points (see tiebreakers.TIEBREAKERS)."""
+    with _lock:
+        t = _tournament(tournament)
+        players = [(t.players[s], _players[t.players[s]], t.byes[s])
+                   for s in range(len(t.players))]
+        matches = list(t.matches)
+    return tiebreakRows(players, matches, tiebreakers, t.points)
+
+def allStandings(tournaments = None):
+    """Generates the standings of many tournaments, as tuples (tournament, id,
+    name, wins, matches, omw) sorted by tournament id and then by standings.
+    If tournaments is None, the standings of all of them."""
+    if tournaments is None:
+        tournaments = list(_tournaments)
+    for tournament in sorted(set(tournaments) & set(_tournaments)):
+        for row in playerStandings(tournament):
+            yield (tournament,) + row
+
+def exportStandings(outfile, tournaments = None, format = 'csv'):
+    """Writes the standings of many tournaments to a file, in 'csv' or 'jsonl'
+    format. Returns the number of rows written."""
+    return writeStandings(allStandings(tournaments), outfile, format)
+
+def tournamentVersion(tournament):
+    """Returns the version of a tournament, which increases with every change
+    of its registry or matches, or None if it doesn't exist."""
+    if tournament not in _tournaments:
+        return None
+    return _tournaments[tournament].version
+
+def swissPairings(tournament, strategy = PAIRING_STRATEGY, version = None):
+    """Returns a list of pairs (id1, name1, id2, name2) of players for the next
+    round of a match. With an odd number of players, the last one is granted
+    a free bye.
+
+    Raises:
+        PairingError: if the players can't be completely paired without
+        rematches. No bye is assigned in that case.
+        ValueError: if the strategy doesn't exist.
+        VersionError: if the tournament is not at the given version.
+    """
+    with _lock:
+        t = _tournament(tournament)
+        t.checkVersion(version)
+        rows = [(t.players[s], _players[t.players[s]], t.score[s], t.games[s])
+                for s in t.sortedSlots()]
+
+        # Leave out the last player if number of players is odd
+        lastPlayer = None
+        if len(rows) % 2 != 0:
+            lastPlayer = rows.pop()
+
+        # Pair the players first, so no bye is assigned if the pairing fails
+        result = pairs(tournament, rows, strategy)
+        if lastPlayer is not None:
+            assignBye(tournament, lastPlayer[0])
+        return result
+
+def playedAgainst(tournament, player1, player2):
+    """Checks if two players have already played against each other in the
+    given tournament."""
+    return pairKey(player1, player2) in _tournament(tournament).played
+
+def playedPairs(tournament):
+    """Returns the set of pairKey() of the players that already played in the
+    given tournament."""
+    with _lock:
+        return set(_tournament(tournament).played)
+
+def pairs(tournament, players, strategy = PAIRING_STRATEGY):
+    """Pairs the players avoiding match repetitions, with the given strategy
+    (see pairing.STRATEGIES)."""
+    pairPlayers = getStrategy(strategy)
+    return pairPlayers(players, _tournament(tournament).played)
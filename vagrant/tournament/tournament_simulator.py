@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+# tournament_simulator.py -- simulator of whole Swiss events
+#
+# Plays out events with the tournament functions (players, rounds and results
+# given by a result model), and reports for each round its time, number of
+# queries, rematches and bye, plus a summary of each event. The results are
+# printed as JSON lines, so pairing strategies can be compared on realistic
+# sizes before a live event. For example:
+#
+#     python tournament_simulator.py --players 500 --model elo \
+#         --strategies swiss,matching
+#
+
+import argparse
+import json
+import math
+import sys
+import timeit
+from collections import OrderedDict
+
+from backend import BACKENDS, getBackend
+from pairing import PairingError, STRATEGIES, pairKey
+from tournament_benchmark import SyntheticEvent
+
+
+# Probability of a draw in every result model.
+DRAW_PROBABILITY = 0.1
+
+# Ratings of the players in the 'elo' and 'favorite' models: they follow a
+# normal distribution with this mean and standard deviation.
+RATING_MEAN = 1500
+RATING_DEVIATION = 200
+
+
+class SimulatedEvent(SyntheticEvent):
+    """Reproducible Swiss event: names and ratings of the players, number of
+    rounds and results of the matches, according to a result model.
+
+    Args:
+        players: number of players.
+        rounds: number of rounds, or None for log2 of the number of players.
+        model: name of the result model, one of MODELS.
+        draws: probability of a draw.
+        seed: seed of the random generator.
+    """
+
+    def __init__(self, players, rounds = None, model = 'random',
+                 draws = DRAW_PROBABILITY, seed = 0):
+        super(SimulatedEvent, self).__init__(players, rounds, seed)
+        self.model = getModel(model)
+        self.modelName = model
+        self.draws = draws
+        self.seed = seed
+        self.ratings = {}   # player id -> rating, set by addPlayers()
+
+    def addPlayers(self, ids):
+        """Rates the players of the event, once they're registered."""
+        for player in ids:
+            self.ratings[player] = self.random.gauss(RATING_MEAN,
+                                                     RATING_DEVIATION)
+
+    def result(self, player1, player2):
+        """Returns the winner of a match between two players, None if draw."""
+        if self.random.random() < self.draws:
+            return None
+        return self.model(self, player1, player2)
+
+
+def randomResult(event, player1, player2):
+    """Both players have the same chances to win."""
+    return event.random.choice([player1, player2])
+
+def eloResult(event, player1, player2):
+    """The players win with the probability given by the Elo formula."""
+    difference = event.ratings[player2] - event.ratings[player1]
+    expected = 1.0 / (1 + math.pow(10, difference / 400.0))
+    return player1 if event.random.random() < expected else player2
+
+def favoriteResult(event, player1, player2):
+    """The player with the higher rating always wins."""
+    if event.ratings[player1] >= event.ratings[player2]:
+        return player1
+    return player2
+
+# Result models that can be selected by name
+MODELS = {
+    'random': randomResult,
+    'elo': eloResult,
+    'favorite': favoriteResult,
+}
+
+def getModel(name):
+    """Returns the function of one of the result MODELS.
+
+    Raises:
+        ValueError: if there's no model with that name.
+    """
+    if name not in MODELS:
+        raise ValueError("Unknown result model '%s', use one of: %s" %
+                         (name, ", ".join(sorted(MODELS))))
+    return MODELS[name]
+
+
+def simulate(tournament, event, strategy = 'swiss'):
+    """Plays out a simulated event with a pairing strategy.
+
+    The event stops at the first round that can't be paired, either because
+    the strategy fails or because the bye would break the rules of the
+    tournament (like a second bye for a player). Rematches, which no strategy
+    should make, are counted and not reported.
+
+    Args:
+        tournament: the tournament backend (see backend.getBackend()).
+        event: the SimulatedEvent to play.
+        strategy: name of the pairing strategy, one of pairing.STRATEGIES.
+
+    Returns:
+        A tuple (rounds, summary) of records: one per round played, and the
+        summary of the event.
+    """
+    queryCount = getattr(tournament, 'queryCount', None)
+    start = timeit.default_timer()
+    startQueries = queryCount and queryCount()
+    tid = tournament.registerTournament("Simulation")
+    ids = tournament.importPlayers(event.names(), tid)
+    event.addPlayers(ids)
+
+    played = set()
+    byes = dict((player, 0) for player in ids)
+    rounds = []
+    rematches = failures = matches = 0
+    for r in range(event.rounds):
+        roundStart = timeit.default_timer()
+        roundQueries = queryCount and queryCount()
+        record = OrderedDict([
+            ('strategy', strategy),
+            ('round', r + 1),
+        ])
+        try:
+            pairs = tournament.swissPairings(tid, strategy)
+        except (PairingError, tournament.IntegrityError) as e:
+            failures += 1
+            record['failed'] = True
+            record['error'] = str(e).splitlines()[0]
+            record['seconds'] = round(timeit.default_timer() - roundStart, 6)
+            rounds.append(record)
+            break
+        pairingEnd = timeit.default_timer()
+
+        results = []
+        paired = set()
+        roundRematches = 0
+        for (id1, name1, id2, name2) in pairs:
+            paired.update([id1, id2])
+            if pairKey(id1, id2) in played:
+                roundRematches += 1
+                continue
+            played.add(pairKey(id1, id2))
+            results.append((id1, id2, event.result(id1, id2)))
+        tournament.reportMatches(tid, results)
+        reportEnd = timeit.default_timer()
+        tournament.playerStandings(tid)
+        end = timeit.default_timer()
+
+        bye = [player for player in ids if player not in paired]
+        for player in bye:
+            byes[player] += 1
+        rematches += roundRematches
+        matches += len(pairs)
+        record['failed'] = False
+        record['seconds'] = round(end - roundStart, 6)
+        record['pairingSeconds'] = round(pairingEnd - roundStart, 6)
+        record['reportSeconds'] = round(reportEnd - pairingEnd, 6)
+        record['standingsSeconds'] = round(end - reportEnd, 6)
+        record['queries'] = queryCount and queryCount() - roundQueries
+        record['pairs'] = len(pairs)
+        record['rematches'] = roundRematches
+        record['bye'] = bye[0] if bye else None
+        rounds.append(record)
+
+    distribution = {}
+    for count in byes.values():
+        distribution[count] = distribution.get(count, 0) + 1
+    summary = OrderedDict([
+        ('strategy', strategy),
+        ('model', event.modelName),
+        ('players', event.players),
+        ('seed', event.seed),
+        ('rounds', event.rounds),
+        ('roundsPlayed', len(rounds) - failures),
+        ('failures', failures),
+        ('seconds', round(timeit.default_timer() - start, 6)),
+        ('queries', queryCount and queryCount() - startQueries),
+        ('rematches', rematches),
+        ('rematchRate', round(float(rematches) / matches, 6)
+                        if matches else 0.0),
+        ('byes', OrderedDict((str(k), distribution[k])
+                             for k in sorted(distribution))),
+    ])
+    return rounds, summary
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description="Simulator of whole Swiss events.")
+    parser.add_argument('--players', type=int, default=64,
+                        help="number of players of each event")
+    parser.add_argument('--rounds', type=int, default=None,
+                        help="number of rounds (default: log2 of players)")
+    parser.add_argument('--model', choices=sorted(MODELS), default='random',
+                        help="result model of the matches")
+    parser.add_argument('--draws', type=float, default=DRAW_PROBABILITY,
+                        help="probability of a draw")
+    parser.add_argument('--strategies', default='swiss',
+                        help="comma separated pairing strategies, of: %s" %
+                        ", ".join(sorted(STRATEGIES)))
+    parser.add_argument('--events', type=int, default=1,
+                        help="number of events played with each strategy")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=None,
+                        help="tournament backend (default: TOURNAMENT_BACKEND)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--summary', action='store_true',
+                        help="print only the summary of each event")
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout, help="file of the JSON lines")
+    args = parser.parse_args(argv)
+
+    strategies = args.strategies.split(",")
+    for strategy in strategies:
+        if strategy not in STRATEGIES:
+            parser.error("unknown pairing strategy '%s'" % strategy)
+
+    tournament = getBackend(args.backend)
+    for strategy in strategies:
+        for i in range(args.events):
+            # The same seeds for every strategy, so they pair the same players
+            event = SimulatedEvent(args.players, args.rounds, args.model,
+                                   args.draws, args.seed + i)
+            rounds, summary = simulate(tournament, event, strategy)
+            records = [summary] if args.summary else rounds + [summary]
+            for record in records:
+                args.output.write(json.dumps(record) + "\n")
+            args.output.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@
 # Test cases for tournament.py
 
 from tournament import *
+from pairing import *
 
 def resetTables():
     # Since the point where we support multiple tournaments, there's no longer
@@ -291,6 +292,680 @@ def testMultipleTournaments():
         raise ValueError ("Player must by registered in a tournament to play.")
 
 
+def testConnectionPool():
+    resetTables()
+    openPool(1, 2)
+
+    # A released connection is handed out again instead of opening a new one
+    conn = getConnection()
+    releaseConnection(conn)
+    if getConnection() is not conn:
+        raise ValueError("Released connections should be reused.")
+    releaseConnection(conn)
+
+    # Broken connections are replaced on checkout
+    conn.close()
+    conn = getConnection()
+    if conn.closed:
+        raise ValueError("The pool shouldn't hand out closed connections.")
+    releaseConnection(conn)
+
+    # More threads than connections wait for their turn instead of failing
+    errors = []
+    def count():
+        try:
+            countPlayers()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=count) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise ValueError("Concurrent queries shouldn't exhaust the pool.")
+
+    # After closing the pool, the next query opens it again
+    closePool()
+    countPlayers()
+    print "14. Connections are pooled, thread-safe and can be closed."
+
+
+def testPlayedPairs():
+    resetTables()
+    tid = registerTournament("Test Played Pairs")
+    [pid1, pid2, pid3] = [registerPlayer(name) for name in ("A", "B", "C")]
+    for pid in (pid1, pid2, pid3):
+        registerEntry(pid, tid)
+    reportMatch(tid, pid2, pid1, pid2)
+
+    played = playedPairs(tid)
+    if played != set([pairKey(pid1, pid2)]):
+        raise ValueError("playedPairs() should return the normalized pairs.")
+    for (p1, p2) in ((pid1, pid2), (pid1, pid3), (pid2, pid3)):
+        if (pairKey(p1, p2) in played) != playedAgainst(tid, p1, p2):
+            raise ValueError("playedPairs() should agree with playedAgainst().")
+    print "15. Match history for pairing is loaded in a single query."
+
+
+def testPairingEngine():
+    # Greedy pairing would pair A-B, C-D and get stuck with E-F (rematch)
+    players = [(i, name, 0) for (i, name) in enumerate("ABCDEF")]
+    played = set([pairKey(4, 5)])
+    result = swissPairs(players, played)
+    paired = sorted(p for (id1, n1, id2, n2) in result for p in (id1, id2))
+    if paired != range(6):
+        raise ValueError("Every player should be paired exactly once.")
+    for (id1, name1, id2, name2) in result:
+        if pairKey(id1, id2) in played:
+            raise ValueError("The pairing engine shouldn't make rematches.")
+
+    # When no complete pairing exists, it fails instead of leaving players out
+    try:
+        swissPairs(players[:2], set([pairKey(0, 1)]))
+    except PairingError:
+        print "16. Pairings are complete, or fail explicitly if impossible."
+    else:
+        raise ValueError("Impossible pairings should raise PairingError.")
+
+
+def testMatchingStrategy():
+    resetTables()
+    tid = registerTournament("Test Matching")
+    for i in range(8):
+        registerEntry(registerPlayer("M%d" % i), tid)
+
+    for round in range(3):
+        pairings = swissPairings(tid, strategy='matching')
+        paired = set(p for (id1, n1, id2, n2) in pairings for p in (id1, id2))
+        if len(pairings) != 4 or len(paired) != 8:
+            raise ValueError("The matching should pair every player once.")
+        for (id1, name1, id2, name2) in pairings:
+            reportMatch(tid, id1, id2, id1)
+
+    # Its pairings are never worse than the Swiss engine ones
+    players = [(p[0], p[1], p[2]) for p in playerStandings(tid)]
+    played = playedPairs(tid)
+    wins = dict((p[0], p[2]) for p in players)
+    cost = lambda pairs: sum((wins[p1] - wins[p2]) ** 2
+                             for (p1, n1, p2, n2) in pairs)
+    if cost(matchingPairs(players, played)) > cost(swissPairs(players, played)):
+        raise ValueError("The matching should minimize the score differences.")
+
+    try:
+        swissPairings(tid, strategy='random')
+    except ValueError:
+        print "17. Pairings can be made with a maximum weight matching."
+    else:
+        raise ValueError("Unknown pairing strategies should raise ValueError.")
+
+
+def testStandingsTable():
+    resetTables()
+    tid = registerTournament("Test Scores")
+    for i in range(5):
+        registerEntry(registerPlayer("S%d" % i), tid)
+    for round in range(2):
+        for (id1, name1, id2, name2) in swissPairings(tid):
+            reportMatch(tid, id1, id2, id1)
+    standings = playerStandings(tid)
+
+    # The scores kept by the triggers are the same computed from scratch
+    execute("UPDATE scores SET wins = 0, omw = 0 WHERE tournament = %s;", [tid])
+    rebuildStandings(tid)
+    if playerStandings(tid) != standings:
+        raise ValueError("Standings should match the ones rebuilt.")
+    print "18. Standings are kept in a table, and can be rebuilt."
+
+
+def testReportRound():
+    resetTables()
+    tid = registerTournament("Test Round")
+    for i in range(8):
+        registerEntry(registerPlayer("R%d" % i), tid)
+
+    results = [(id1, id2, id1) for (id1, n1, id2, n2) in swissPairings(tid)]
+    reportMatches(tid, results)
+    for (i, n, w, m, o) in playerStandings(tid):
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if w != (1 if i in [r[2] for r in results] else 0):
+            raise ValueError("Each match winner should have one win recorded.")
+
+    # A rematch inside the round makes the whole round fail
+    [(id1, n1, id2, n2), (id3, n3, id4, n4)] = swissPairings(tid)[:2]
+    try:
+        reportMatches(tid, [(id3, id4, None), (id1, id2, id1), (id2, id1, id1)])
+    except ValueError:
+        if playedAgainst(tid, id3, id4):
+            raise ValueError("No match of a wrong round should be recorded.")
+        print "19. A whole round can be reported at once."
+    else:
+        raise ValueError("Repeated matches in a round should be rejected.")
+
+
+def testImportPlayers():
+    resetTables()
+    tid = registerTournament("Test Import")
+    csvfile = StringIO("id,name\n1,Ann\n2,\"Smith, Bob\"\n3,Carl\n")
+    ids = importPlayers(readPlayersCsv(csvfile), tid, batchSize=2)
+    names = dict((row[0], row[1]) for row in playerStandings(tid))
+    if [names.get(i) for i in ids] != ["Ann", "Smith, Bob", "Carl"]:
+        raise ValueError("Imported players should get ids in input order.")
+
+    # Players can also be imported from any iterable, without a tournament
+    count = countPlayers()
+    ids = importPlayers("P%d" % i for i in range(5))
+    if len(ids) != 5 or countPlayers() != count + 5:
+        raise ValueError("All the imported players should be registered.")
+
+    # They accept the same names as registerPlayer(), even an empty one
+    registerPlayer("")
+    ids = importPlayers(["", "x"], tid)
+    names = dict((row[0], row[1]) for row in playerStandings(tid))
+    if [names.get(i) for i in ids] != ["", "x"]:
+        raise ValueError("Imported players can have empty names.")
+    print "20. Players can be imported in bulk from a CSV or an iterator."
+
+
+def explain(query, values):
+    """Returns the plan of a query, as if the tables were big enough for the
+    DB to prefer an index over a sequential scan whenever there's one."""
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SET LOCAL enable_seqscan = off;")
+        cursor.execute("EXPLAIN " + query, values)
+        return "\n".join(row[0] for row in cursor.fetchall())
+
+def testIndexes():
+    resetTables()
+    tid = registerTournament("Test Indexes")
+    [pid1, pid2] = [registerPlayer(name) for name in ("I1", "I2")]
+    registerEntry(pid1, tid)
+    registerEntry(pid2, tid)
+    reportMatch(tid, pid1, pid2, pid1)
+
+    queries = [
+        # Standings
+        ("SELECT player, name, wins, games, omw FROM standings "
+         "WHERE tournament = %s;", [tid]),
+        # Match history, and matches of a player by each side and as winner
+        (PLAYED_PAIRS, [tid]),
+        ("SELECT 1 FROM matches WHERE tournament = %s AND player1 = %s;",
+         [tid, pid1]),
+        ("SELECT 1 FROM matches WHERE tournament = %s AND player2 = %s;",
+         [tid, pid1]),
+        ("SELECT 1 FROM matches WHERE tournament = %s AND winner = %s;",
+         [tid, pid1]),
+    ]
+    for (query, values) in queries:
+        if "Seq Scan" in explain(query, values):
+            raise ValueError("Query should use an index: " + query)
+
+    # The unordered pair index is what prevents rematches
+    if "matches_pair" not in explain(
+            "SELECT 1 FROM matches WHERE tournament = %s AND "
+            "LEAST(player1, player2) = %s AND GREATEST(player1, player2) = %s;",
+            [tid, pid1, pid2]):
+        raise ValueError("Matches should have an index on the pair of players.")
+    print "21. Queries on standings and matches use indexes."
+
+
+def playEvent(backend, players, rounds):
+    # Plays a tournament where the player registered first wins each match,
+    # except every third match, which is a draw. Returns the standings and
+    # pairings by order of registration.
+    tid = backend.registerTournament("Test Backends")
+    ids = backend.importPlayers(["B%d" % i for i in range(players)], tid)
+    order = dict((pid, i) for (i, pid) in enumerate(ids))
+    pairings = []
+    for r in range(rounds):
+        results = []
+        for (k, (id1, n1, id2, n2)) in enumerate(backend.swissPairings(tid)):
+            pairings.append((order[id1], order[id2]))
+            results.append((id1, id2, None if k % 3 == 2 else min(id1, id2)))
+        backend.reportMatches(tid, results)
+    standings = [(order[i], n, w, m, o)
+                 for (i, n, w, m, o) in backend.playerStandings(tid)]
+    return tid, ids, standings, pairings
+
+def testMemoryBackend():
+    import backend
+    memory = backend.getBackend('memory')
+    if backend.getBackend('postgres').playerStandings is not playerStandings:
+        raise ValueError("The postgres backend should be tournament.py.")
+
+    dbEvent = playEvent(backend.getBackend('postgres'), 13, 5)
+    memoryEvent = playEvent(memory, 13, 5)
+    if dbEvent[2:] != memoryEvent[2:]:
+        raise ValueError("Both backends should give the same pairings and "
+                         "standings.")
+
+    # The memory backend enforces the same rules as the DB
+    tid, ids = memoryEvent[:2]
+    (id1, n1, id2, n2) = memory.swissPairings(tid)[0]
+    memory.reportMatch(tid, id1, id2, id1)
+    for wrong in [lambda: memory.reportMatch(tid, id2, id1, None),
+                  lambda: memory.reportMatch(tid, id1, ids[-1], -1),
+                  lambda: memory.registerEntry(id1, tid),
+                  lambda: memory.deleteRegistry()]:
+        try:
+            wrong()
+        except memory.IntegrityError:
+            pass
+        else:
+            raise ValueError("The memory backend should enforce the DB rules.")
+    standings = memory.playerStandings(tid)
+    memory.rebuildStandings(tid)
+    if memory.playerStandings(tid) != standings:
+        raise ValueError("Rebuilding the standings should not change them.")
+    print "22. The in-memory backend works like the DB one."
+
+
+def testBenchmark():
+    import backend
+    from tournament_benchmark import SyntheticEvent, runBenchmark, results
+    event = SyntheticEvent(17, seed=1)
+    if list(event.names()) != list(SyntheticEvent(17, seed=1).names()):
+        raise ValueError("Synthetic events should be reproducible.")
+    timer = runBenchmark(backend.getBackend('memory'), event, bulk=True)
+    phases = dict((r['phase'], r) for r in
+                  results(timer, 'memory', event, True))
+    if event.rounds != 5 or phases['swissPairings']['calls'] != 5 or \
+            phases['reportMatches']['calls'] != 5 or 'total' not in phases:
+        raise ValueError("The benchmark should time every phase of an event.")
+    if 'playedAgainst' in phases:
+        raise ValueError("playedAgainst should only be timed if asked.")
+    timer = runBenchmark(backend.getBackend('memory'), SyntheticEvent(16),
+                         bulk=True, playedAgainst=True)
+    if timer.phases['playedAgainst'][0] != 4 * 8:
+        raise ValueError("playedAgainst should be timed for every pair.")
+    print "23. The benchmark times every phase of a synthetic event."
+
+
+def testSafeNames():
+    import tournament_memory
+    resetTables()
+    tid = registerTournament("Test Safe Names")
+    name = "<script>B</script>&"
+    [pid1] = importPlayers([name], tid)
+    pid2 = registerPlayer(name)
+    registerEntry(pid2, tid)
+    if fetchone("SELECT name FROM players WHERE id = %s;", [pid1])[0] != name:
+        raise ValueError("Players should keep the name as registered.")
+    safeNames = [n for (i, n, w, m, o) in playerStandings(tid)]
+    if safeNames != [sanitize(name)] * 2 or "<script>" in safeNames[0]:
+        raise ValueError("Standings should have the names sanitized.")
+
+    mid = tournament_memory.registerTournament("Test Safe Names")
+    tournament_memory.registerEntry(
+        tournament_memory.registerPlayer(name), mid)
+    if tournament_memory.playerStandings(mid)[0][1] != safeNames[0]:
+        raise ValueError("Both backends should sanitize names the same way.")
+
+    print "24. Names are sanitized once, when registered."
+
+
+def testExportStandings():
+    import csv, json
+    from StringIO import StringIO
+    resetTables()
+    tids = [registerTournament("Test Export %d" % i) for i in range(3)]
+    for (i, tid) in enumerate(tids):
+        importPlayers(["E%d" % j for j in range(2 * i + 2)], tid)
+        reportMatches(tid, [(id1, id2, id1)
+                            for (id1, n1, id2, n2) in swissPairings(tid)])
+
+    rows = list(allStandings(reversed(tids[1:])))
+    expected = [(tid,) + row for tid in tids[1:] for row in playerStandings(tid)]
+    if rows != expected:
+        raise ValueError("allStandings() should have the standings of every "
+                         "tournament, in order.")
+    if list(allStandings([])) or tids[0] not in [r[0] for r in allStandings()]:
+        raise ValueError("allStandings() should read the tournaments given.")
+
+    for format in ('csv', 'jsonl'):
+        outfile = StringIO()
+        if exportStandings(outfile, tids[1:], format) != len(rows):
+            raise ValueError("Every standings row should be exported.")
+        lines = outfile.getvalue().splitlines()
+        if format == 'csv':
+            exported = list(csv.DictReader(lines))
+        else:
+            exported = [json.loads(line) for line in lines]
+        if [(int(r['tournament']), int(r['player']), r['name'])
+                for r in exported] != [row[:3] for row in rows]:
+            raise ValueError("Exported standings should match the rows.")
+    print "25. Standings of many tournaments can be read and exported at once."
+
+
+def testRoundVersions():
+    import threading
+    import tournament, tournament_memory
+    for backend in (tournament, tournament_memory):
+        tid = backend.registerTournament("Test Versions")
+        backend.importPlayers(["V%d" % i for i in range(5)], tid)
+        version = backend.tournamentVersion(tid)
+
+        # Two terminals pair the same standings: only the first one succeeds
+        pairings = backend.swissPairings(tid, version=version)
+        try:
+            backend.swissPairings(tid, version=version)
+        except backend.VersionError:
+            pass
+        else:
+            raise ValueError("A round of an old version should be rejected.")
+        if backend.tournamentVersion(tid) <= version:
+            raise ValueError("The version should increase with every change.")
+
+        results = [(id1, id2, id1) for (id1, n1, id2, n2) in pairings]
+        version = backend.tournamentVersion(tid)
+        backend.reportMatches(tid, results[:1], version)
+        try:
+            backend.reportMatches(tid, results[1:], version)
+        except backend.VersionError:
+            pass
+        else:
+            raise ValueError("Results of an old version should be rejected.")
+        if len(backend.playedPairs(tid)) != 1:
+            raise ValueError("Rejected results should not be recorded.")
+
+    # Concurrent pairings of a tournament are made one at a time, so each
+    # one sees the bye of the previous one
+    tid = registerTournament("Test Versions")
+    importPlayers(["V%d" % i for i in range(7)], tid)
+    errors = []
+    def pairRound():
+        try:
+            swissPairings(tid)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=pairRound) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    byes = fetchone("SELECT COUNT(*) FROM registry WHERE tournament = %s "
+                    "AND bye = 1;", [tid])[0]
+    if errors or byes != 3:
+        raise ValueError("Concurrent pairings should give byes to different "
+                         "players.")
+    print "26. Rounds are made in locked and versioned transactions."
+
+
+def testStandingsCache():
+    import time
+    resetTables()
+    tid = registerTournament("Test Cache")
+    [id1, id2, id3, id4] = importPlayers(["C1", "C2", "C3", "C4"], tid)
+    standings = playerStandings(tid)
+
+    # Cached standings are read from memory: a change of the scores that
+    # doesn't change the version of the tournament is not seen
+    other = connect()
+    cursor = other.cursor()
+    cursor.execute("UPDATE scores SET wins = 9 WHERE player = %s;", [id1])
+    other.commit()
+    if playerStandings(tid) != standings:
+        raise ValueError("Standings should be read from the cache.")
+    rebuildStandings(tid)
+    if playerStandings(tid) != standings:
+        raise ValueError("Rebuilt standings should replace the cached ones.")
+
+    # Changes made by this process are seen right away...
+    reportMatch(tid, id1, id2, id1)
+    if playerStandings(tid)[0][0] != id1:
+        raise ValueError("Standings should change after reporting a match.")
+
+    # ... and the ones of other processes as soon as they're notified
+    cursor.execute("INSERT INTO matches (tournament, player1, player2, winner)"
+                   " VALUES (%s, %s, %s, %s);", [tid, id3, id4, id4])
+    other.commit()
+    other.close()
+    for i in range(50):
+        if playerStandings(tid)[1][0] == id4:
+            break
+        time.sleep(0.1)
+    else:
+        raise ValueError("Standings should change when the DB notifies it.")
+    print "27. Standings are cached until their tournament changes."
+
+
+def testTiebreakers():
+    import tournament, tournament_memory
+    for backend in (tournament, tournament_memory):
+        tid = backend.registerTournament("Test Tiebreakers")
+        [a, b, c, d] = backend.importPlayers(["A", "B", "C", "D"], tid)
+        backend.reportMatches(tid, [(a, b, a), (c, d, None)])
+        backend.reportMatches(tid, [(a, c, a), (b, d, b)])
+
+        rows = backend.tiebreakStandings(
+            tid, ['buchholz', 'median-buchholz', 'sonneborn-berger', 'oow%'])
+        if rows != [(a, "A", 2, 2, 1, 1, 1, 0.5),
+                    (b, "B", 1, 2, 2, 2, 0, 0.25),
+                    (c, "C", 0, 2, 2, 2, 0, 0.25),
+                    (d, "D", 0, 2, 1, 1, 0, 0.5)]:
+            raise ValueError("Tiebreakers should be computed from the matches.")
+
+        # With the default points, Buchholz is the omw of the standings
+        omw = dict((row[0], row[4]) for row in backend.playerStandings(tid))
+        if any(omw[row[0]] != row[4] for row in
+               backend.tiebreakStandings(tid, ['buchholz'])):
+            raise ValueError("Buchholz should be the omw of the standings.")
+        try:
+            backend.tiebreakStandings(tid, ['coin'])
+        except ValueError:
+            pass
+        else:
+            raise ValueError("Unknown tiebreakers should be rejected.")
+    print "28. Standings can be ranked with Buchholz, median Buchholz, " \
+          "Sonneborn-Berger and OOW%."
+
+
+def testPoints():
+    import tournament, tournament_memory
+    for backend in (tournament, tournament_memory):
+        # Points of chess: 2 for a win or a bye, 1 for a draw
+        tid = backend.registerTournament("Test Points", (2, 1, 0, 2))
+        [a, b, c, d, e] = backend.importPlayers(["A", "B", "C", "D", "E"], tid)
+        backend.reportMatches(tid, [(a, b, None), (c, d, c)])
+        backend.reportMatches(tid, [(a, c, None), (b, d, None)])
+        backend.assignBye(tid, e)
+
+        # By wins, D would be ahead of B and E would lead
+        standings = backend.playerStandings(tid)
+        if [row[0] for row in standings] != [c, a, b, e, d]:
+            raise ValueError("Standings should be ranked by points, then by "
+                             "points of the opponents.")
+        if [row[2] for row in standings] != [1, 0, 0, 1, 0]:
+            raise ValueError("Standings should still show the wins.")
+        backend.rebuildStandings(tid)
+        if backend.playerStandings(tid) != standings:
+            raise ValueError("Rebuilt standings should have the same points.")
+
+        rows = backend.tiebreakStandings(tid, [])
+        if dict((row[0], row[2]) for row in rows) != {a: 2, b: 2, c: 3, d: 1,
+                                                      e: 2}:
+            raise ValueError("Tiebreak standings should score the points.")
+    print "29. Standings are ranked by the points of each tournament."
+
+
+def testSimulator():
+    import backend
+    from tournament_simulator import SimulatedEvent, getModel, simulate
+    for name in ('postgres', 'memory'):
+        event = SimulatedEvent(12, 4, 'elo', seed=3)
+        rounds, summary = simulate(backend.getBackend(name), event, 'matching')
+        if len(rounds) != summary['roundsPlayed'] + summary['failures'] or \
+                summary['rounds'] != 4 or summary['rematches'] != 0:
+            raise ValueError("The simulator should play all the rounds.")
+        if summary['byes'] != {'0': 12} or \
+                any(r['pairs'] != 6 or r['bye'] is not None for r in rounds):
+            raise ValueError("The simulator should report the byes.")
+        queries = [r['queries'] for r in rounds]
+        if name == 'postgres' and not all(queries) or \
+                name == 'memory' and any(queries):
+            raise ValueError("The simulator should count the queries.")
+
+    event = SimulatedEvent(8, 3, 'favorite', draws=0)
+    simulate(backend.getBackend('memory'), event)
+    players = sorted(event.ratings)[:2]
+    if event.result(*players) != max(players, key=event.ratings.get):
+        raise ValueError("The favorite should win with the favorite model.")
+    try:
+        getModel('coin')
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Unknown result models should be rejected.")
+    print "30. The simulator plays whole events and reports on the pairings."
+
+
+def testMetrics():
+    import json
+    import logging
+    import tournament
+    from StringIO import StringIO
+    closePool()
+    resetMetrics()
+    tid = registerTournament("Test Metrics")
+    importPlayers(["P%d" % i for i in range(5)], tid)
+    queries = queryCount()
+    pairings = swissPairings(tid)
+    if queryCount() - queries < 3:
+        raise ValueError("Every statement of swissPairings() should count.")
+    reportMatches(tid, [(p[0], p[2], p[0]) for p in pairings])
+
+    outfile = StringIO()
+    exportMetrics(outfile)
+    records = [json.loads(line) for line in outfile.getvalue().splitlines()]
+    statements = dict((r['statement'], r) for r in records
+                      if r['kind'] == 'query')
+    pairing = statements[" ".join(PAIRING_STANDINGS.split())]
+    if pairing['calls'] != 1 or pairing['rows'] != 5 or \
+            pairing['seconds'] <= 0:
+        raise ValueError("Statements should be measured with their rows.")
+    if records[-1]['kind'] != 'connect' or records[-1]['calls'] < 1:
+        raise ValueError("The connections opened should be measured.")
+    # The round is inserted with its values inlined, but measured without them
+    round = statements.get(" ".join(REPORT_MATCHES.split()))
+    if round is None or round['calls'] != 1 or round['rows'] != 2 or \
+            [s for s in statements if "VALUES (%d," % tid in s]:
+        raise ValueError("Statements should be measured without values.")
+
+    # With a threshold, slow queries are logged without their values
+    class Handler(logging.Handler):
+        def emit(self, record):
+            messages.append(record.getMessage())
+    messages = []
+    handler = Handler()
+    logging.getLogger('tournament').addHandler(handler)
+    tournament.SLOW_QUERY_SECONDS = 0
+    try:
+        playedAgainst(tid, 123456, 654321)
+    finally:
+        tournament.SLOW_QUERY_SECONDS = None
+        logging.getLogger('tournament').removeHandler(handler)
+    if len(messages) != 1 or "EXISTS" not in messages[0] or \
+            "123456" in messages[0]:
+        raise ValueError("Slow queries should be logged.")
+    resetMetrics()
+    if queryMetrics()[0]['kind'] != 'connect':
+        raise ValueError("The metrics should be reset.")
+    print "31. Statements sent to the DB are counted, timed and logged if slow."
+
+
+def testPreparedStatements():
+    import tournament
+    openPool(1, 1)
+    try:
+        tid = registerTournament("Test Prepared")
+        [id1, id2, id3] = importPlayers(["A", "B", "C"], tid)
+        reportMatch(tid, id1, id2, id1)
+        if not playedAgainst(tid, id2, id1) or playedAgainst(tid, id1, id3):
+            raise ValueError("Prepared statements should give the same result.")
+
+        # Rolled back transactions keep them prepared
+        try:
+            reportMatch(tid, id2, id1, id2)
+        except IntegrityError:
+            pass
+        with pooledConnection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT statement FROM pg_prepared_statements;")
+            prepared = [row[0] for row in cursor.fetchall()]
+        for query in (PLAYED_AGAINST, REPORT_MATCH):
+            if prepared.count("PREPARE %s AS %s" % (
+                    tournament._preparedStatements[query][0],
+                    numbered(query))) != 1:
+                raise ValueError("Queries should be prepared once.")
+
+        tournament.PREPARE_QUERIES = False
+        if not playedAgainst(tid, id1, id2):
+            raise ValueError("Queries should also run without preparing.")
+    finally:
+        tournament.PREPARE_QUERIES = True
+        closePool()
+    print "32. Queries are prepared once per connection of the pool."
+
+
+def testDeletePlayersWithMatches():
+    import tournament, tournament_memory
+    tid = registerTournament("Test Delete", (3, 1, 0, 3))
+    [a, b, c, d, e] = importPlayers(["D1", "D2", "D3", "D4", "D5"], tid)
+    reportMatches(tid, [(a, b, a), (c, d, None)])
+    reportMatches(tid, [(a, c, c), (b, e, b)])
+    assignBye(tid, d)
+
+    # The scores of the others are left as if the deleted player never played
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM players WHERE id = %s;", [a])
+    cursor.execute("SELECT tournament, player, wins, games, omw, points, "
+                   "opp_points FROM scores ORDER BY tournament, player;")
+    scores = cursor.fetchall()
+    cursor.execute("SELECT tournament, player, wins, games, omw, points, "
+                   "opp_points FROM playerScores ORDER BY tournament, player;")
+    if cursor.fetchall() != scores:
+        raise ValueError("Deleting a player with matches should update the "
+                         "scores of his opponents.")
+    db.commit()
+    db.close()
+
+    for backend in (tournament, tournament_memory):
+        tid = backend.registerTournament("Test Delete")
+        [a, b, c, d] = backend.importPlayers(["D1", "D2", "D3", "D4"], tid)
+        backend.reportMatches(tid, [(a, b, a), (c, d, None)])
+        backend.deletePlayers()
+        if backend.countPlayers() != 0:
+            raise ValueError("Players with matches should be deleted.")
+    print "33. Players can be deleted with their matches."
+
+
+def testMatchingSpeed():
+    import timeit
+    # In every block of 4 players the last 2 already played, so the greedy
+    # pairing of each score group leaves players behind, and the blossom
+    # algorithm has to pair them.
+    players = [(i, "P%d" % i, 3 - i // 500) for i in range(2000)]
+    played = set(pairKey(i + 2, i + 3) for i in range(0, 2000, 4))
+    start = timeit.default_timer()
+    pairs = groupMatchingPairs(players, played)
+    seconds = timeit.default_timer() - start
+    paired = set(p[0] for pair in pairs for p in pair)
+    if len(paired) != 2000 or \
+            any(pairKey(p[0], q[0]) in played for (p, q) in pairs):
+        raise ValueError("The matching should pair every player once.")
+    if any(p[2] != q[2] for (p, q) in pairs):
+        raise ValueError("The matching should pair each score group inside.")
+    # It usually takes well under a second, and a matching of all the players
+    # at once takes minutes: the limit is loose so slow machines don't fail
+    if seconds >= 30:
+        raise ValueError("The matching of 2000 players took %.2f seconds." %
+                         seconds)
+    print "34. The matching pairs 2000 players a score group at a time."
+
+
 if __name__ == '__main__':
     testDeleteMatches()
     testDelete()
@@ -305,4 +980,25 @@ if __name__ == '__main__':
     testDraws()
     testOpponentMatchWins()
     testMultipleTournaments()
+    testConnectionPool()
+    testPlayedPairs()
+    testPairingEngine()
+    testMatchingStrategy()
+    testStandingsTable()
+    testReportRound()
+    testImportPlayers()
+    testIndexes()
+    testMemoryBackend()
+    testBenchmark()
+    testSafeNames()
+    testExportStandings()
+    testRoundVersions()
+    testStandingsCache()
+    testTiebreakers()
+    testPoints()
+    testSimulator()
+    testMetrics()
+    testPreparedStatements()
+    testDeletePlayersWithMatches()
+    testMatchingSpeed()
     print "Success!  All tests pass!"